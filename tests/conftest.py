@@ -0,0 +1,8 @@
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+
+# Parts of unidec.tools still call np.trapz, which was removed in NumPy 2.4
+if not hasattr(np, "trapz"):
+    np.trapz = np.trapezoid
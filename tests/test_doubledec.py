@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+
+from unidec.modules import DoubleDec
+
+
+def write_inputs(tmpdir):
+    x = np.arange(1000, 1200, 0.5)
+    kernel = np.transpose([np.arange(-10, 10, 0.5), np.exp(-np.arange(-10, 10, 0.5) ** 2)])
+    kfile = os.path.join(tmpdir, "kernel.txt")
+    np.savetxt(kfile, kernel)
+    files = []
+    for i in range(2):
+        f = os.path.join(tmpdir, "spec%d_mass.txt" % i)
+        np.savetxt(f, np.transpose([x, np.exp(-(x - 1100 - i) ** 2 / 4)]))
+        files.append(f)
+    return files, kfile
+
+
+def test_batch_dd_default_npz_loads_with_load_dd(tmp_path):
+    files, kfile = write_inputs(str(tmp_path))
+    outfiles = DoubleDec.batch_dd(files, kfile)
+    for f, out in zip(files, outfiles):
+        assert out.endswith("dd.npz")
+        # DataCollector asks for the text name of the output
+        path = os.path.splitext(f)[0] + "dd.txt"
+        assert not os.path.isfile(path)
+        data = DoubleDec.load_dd(path)
+        assert data.shape == (400, 2)
+
+
+def test_batch_dd_text(tmp_path):
+    files, kfile = write_inputs(str(tmp_path))
+    outfiles = DoubleDec.batch_dd(files, kfile, binary=False)
+    assert all(f.endswith("_massdd.txt") for f in outfiles)
+    assert np.loadtxt(outfiles[0]).shape == (400, 2)
+    assert np.allclose(DoubleDec.load_dd(outfiles[0]), np.loadtxt(outfiles[0]))
+
+
+def test_load_dd_reads_newest_output(tmp_path):
+    files, kfile = write_inputs(str(tmp_path))
+    textfile = DoubleDec.batch_dd(files, kfile, binary=False)[0]
+    np.savetxt(textfile, np.zeros((3, 2)))
+    assert DoubleDec.load_dd(textfile).shape == (3, 2)
+    # A later npz run is read rather than the old text output
+    os.utime(textfile, (0, 0))
+    DoubleDec.batch_dd(files, kfile)
+    assert DoubleDec.load_dd(textfile).shape == (400, 2)
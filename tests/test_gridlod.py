@@ -0,0 +1,67 @@
+import numpy as np
+
+from unidec.modules import gridlod
+from unidec.modules.plot2d import Plot2dBase
+from unidec.modules.unidecstructure import UniDecConfig
+
+
+def large_contour(lod=True):
+    xvals = np.linspace(1000, 5000, 20000)
+    yvals = np.arange(1, 51.)
+    grid = np.outer(np.exp(-(xvals - 3000) ** 2 / 1e5), np.exp(-(yvals - 20) ** 2 / 50))
+    plot = Plot2dBase()
+    plot.lod = lod
+    plot.contourplot(xvals=xvals, yvals=yvals, zgrid=grid, config=UniDecConfig(), discrete=0, repaint=False)
+    return plot
+
+
+def test_pool_to_keeps_peak_max():
+    x = np.arange(1000.)
+    grid = np.zeros((1000, 4))
+    grid[501, 2] = 5
+    (xp, yp), pooled = gridlod.pool_to([x, np.arange(4.)], grid, [100, None])
+    assert len(xp) == len(pooled) == 125
+    assert np.amax(pooled) == 5
+
+
+def test_large_contour_keeps_full_limits():
+    plot = large_contour()
+    assert plot.lodgrid is not None
+    assert np.allclose(plot.subplot1.get_xlim(), (1000, 5000))
+    assert np.allclose(plot.subplot1.get_ylim(), (1, 50))
+    plot.get_png()
+    assert np.allclose(plot.subplot1.get_xlim(), (1000, 5000))
+
+
+def test_large_contour_zoom_round_trip():
+    plot = large_contour()
+    fullkey = plot.lodkey
+    plot.subplot1.set_xlim(2900, 3100)
+    plot.subplot1.set_ylim(10, 30)
+    assert np.allclose(plot.subplot1.get_xlim(), (2900, 3100))
+    assert np.allclose(plot.subplot1.get_ylim(), (10, 30))
+    assert plot.lodkey != fullkey
+    plot.subplot1.set_xlim(1000, 5000)
+    plot.subplot1.set_ylim(1, 50)
+    assert np.allclose(plot.subplot1.get_xlim(), (1000, 5000))
+    assert np.allclose(plot.subplot1.get_ylim(), (1, 50))
+    assert plot.lodkey == fullkey
+    plot.get_png()
+
+
+def test_colorbar_survives_refine_and_clear():
+    plot = large_contour()
+    plot.subplot1.set_xlim(2900, 3100)
+    assert plot.cbar.mappable not in plot.lodartists
+    plot.get_png()
+    plot.clear_plot("nopaint")
+    assert plot.lodkey is None and plot.lodgrid is None
+
+
+def test_small_contour_skips_lod():
+    xvals = np.linspace(1000, 2000, 100)
+    yvals = np.arange(1, 11.)
+    plot = Plot2dBase()
+    plot.contourplot(xvals=xvals, yvals=yvals, zgrid=np.random.rand(100, 10), config=UniDecConfig(), discrete=0,
+                     repaint=False)
+    assert plot.lodgrid is None
@@ -0,0 +1,35 @@
+import numpy as np
+
+import unidec.tools as ud
+from unidec.modules import MassSpecBuilder
+
+
+def test_split_peak_shape_matches_make_peak_shape():
+    x = np.linspace(990, 1010, 2001)
+    for fwhm in [0.5, 3.]:
+        expected = ud.make_peak_shape(x, 2, fwhm, 1000., norm_area=True)
+        shape = MassSpecBuilder.peak_shapes(x, 2, np.full(len(x), fwhm), np.full(len(x), 1000.))
+        assert np.allclose(shape, expected)
+
+
+def test_peak_shapes_match_make_peak_shape():
+    x = np.linspace(990, 1010, 2001)
+    for psfun in [0, 1, 2]:
+        expected = ud.make_peak_shape(x, psfun, 2., 1001., norm_area=True)
+        shape = MassSpecBuilder.peak_shapes(x, psfun, np.full(len(x), 2.), np.full(len(x), 1001.))
+        assert np.allclose(shape, expected)
+
+
+def test_spectrum_profiles_peaks_outside_axis():
+    mzaxis = np.linspace(1000, 2000, 1001)
+    ztab = np.arange(1, 5)
+    outside = [[100000., 10., 2., 0., 1.]]
+    out = MassSpecBuilder.spectrum_profiles([outside], mzaxis, ztab)
+    assert out.shape == (1, len(mzaxis))
+    assert np.all(out == 0)
+    # Chunks of peaks that are all outside are skipped, and the rest are still added
+    inside = [[3000., 10., 2., 0., 1.]]
+    out = MassSpecBuilder.spectrum_profiles([outside * 5 + inside], mzaxis, ztab, chunksize=10)
+    expected = MassSpecBuilder.spectrum_profiles([inside], mzaxis, ztab)
+    assert np.any(expected > 0)
+    assert np.allclose(out, expected)
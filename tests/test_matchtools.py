@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from unidec.modules import matchtools
+
+
+def random_sites(rng, nsites, integer=False):
+    pvals = [rng.uniform(0.01, 1, rng.integers(1, 7)) for i in range(nsites)]
+    mvals = [rng.integers(100, 400, len(p)).astype(float) for p in pvals]
+    if not integer:
+        mvals = [m + rng.uniform(0, 1, len(m)) for m in mvals]
+    return pvals, mvals
+
+
+@pytest.mark.parametrize("topn", [None, 1, 3])
+@pytest.mark.parametrize("min_prob", [0, 0.01])
+def test_sitematch_to_targets_matches_brute_force(topn, min_prob):
+    rng = np.random.default_rng(0)
+    for case in range(40):
+        pvals, mvals = random_sites(rng, rng.integers(1, 6), integer=case % 2 == 0)
+        indexes, masses, probs = matchtools.site_combinations(pvals, mvals)
+        targets = masses[rng.integers(0, len(masses), 4)] + rng.uniform(-3, 3, 4)
+        tolerance = [2, 5, 20][case % 3]
+        results = matchtools.sitematch_to_targets(targets, pvals, mvals, tolerance=tolerance, topn=topn,
+                                                  min_prob=min_prob, maxpairs=int(rng.integers(1, 50)))
+        for t, (ri, rm, rp) in zip(targets, results):
+            b1 = (np.abs(masses - t) < tolerance) & (probs >= min_prob)
+            expected = np.sort(probs[b1])[::-1][:topn]
+            assert np.allclose(rp, expected)
+            # The indexes give back the masses and probabilities
+            sitemasses = [mvals[s][ri[:, s]] for s in range(len(pvals))]
+            siteprobs = [pvals[s][ri[:, s]] for s in range(len(pvals))]
+            assert np.allclose(np.sum(sitemasses, axis=0), rm)
+            assert np.allclose(np.prod(siteprobs, axis=0), rp)
+
+
+def test_nearest_site_combinations_matches_brute_force():
+    rng = np.random.default_rng(1)
+    for case in range(40):
+        pvals, mvals = random_sites(rng, rng.integers(1, 6))
+        indexes, masses, probs = matchtools.site_combinations(pvals, mvals)
+        targets = rng.uniform(np.amin(masses) - 10, np.amax(masses) + 10, 5)
+        nindexes, nmasses, nprobs = matchtools.nearest_site_combinations(targets, pvals, mvals,
+                                                                         maxpairs=int(rng.integers(1, 20)))
+        errors = np.abs(np.subtract.outer(targets, masses))
+        assert np.allclose(np.abs(nmasses - targets), np.amin(errors, axis=1))
+
+
+def test_site_unique_masses():
+    mvals = [np.array([1., 2., 3.]), np.array([0., 1.])]
+    assert np.allclose(matchtools.site_unique_masses(mvals), [1, 2, 3, 4])
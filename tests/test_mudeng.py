@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import unidec.tools as ud
+from unidec.metaunidec.mudeng import MetaUniDec, group_masses
+from unidec.modules.peakstructure import Peaks
+from unidec.modules.unidecstructure import UniDecConfig
+
+
+def fake_engine(peaklists, massbins=1.):
+    config = UniDecConfig()
+    config.massbins = massbins
+    config.peaknorm = 0
+    spectra = []
+    for peaks in peaklists:
+        pks = Peaks()
+        pks.add_rows(len(peaks), {"mass": peaks[:, 0], "height": peaks[:, 1]})
+        pks.flush()
+        spectra.append(SimpleNamespace(peaks=peaks, pks=pks))
+    return SimpleNamespace(config=config, data=SimpleNamespace(spectra=spectra))
+
+
+def test_close_species_stay_separate():
+    rng = np.random.default_rng(0)
+    peaklists = []
+    for i in range(2000):
+        masses = np.array([10000., 10004.]) + rng.normal(0, 0.5, 2)
+        peaklists.append(np.transpose([masses, rng.uniform(0.5, 1, 2), np.ones(2)]))
+    eng = fake_engine(peaklists)
+    allpeaks = MetaUniDec.combine_scanpeaks(eng)
+    assert len(allpeaks) == 2
+    assert np.allclose(allpeaks[:, 0], [10000, 10004], atol=0.1)
+    indexes = np.array([s.pks.get_values("index") for s in eng.data.spectra])
+    assert np.all(indexes[:, 0] == 0) and np.all(indexes[:, 1] == 1)
+
+
+def test_group_masses_splits_wide_runs_only():
+    # The second run has no gap as large as the window but spans more than it
+    masses = np.array([1., 1.5, 10., 10.5, 11.9, 12.5, 13.5])
+    groups = group_masses(masses, np.ones(len(masses)), 2.)
+    assert list(groups) == [0, 0, 1, 1, 1, 1, 2]
+
+
+def test_round_to_nearest_array():
+    values = np.array([1.04, 1.05, 1.26, 7.])
+    assert np.allclose(ud.round_to_nearest(values, 0.1), [ud.round_to_nearest(v, 0.1) for v in values])
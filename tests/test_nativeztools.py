@@ -0,0 +1,55 @@
+import numpy as np
+
+from unidec.modules import nativeztools as nzt
+
+
+def loop_extract(offsetgrid, igrid, offsets, widths, eshape=0):
+    extracts = np.zeros((len(offsets), len(igrid)))
+    for i, (f, width) in enumerate(zip(offsets, widths)):
+        if eshape == 1:
+            width *= 3.
+        b1 = (offsetgrid >= f - width) & (offsetgrid < f + width)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            wgrid = np.exp(-((offsetgrid - f) ** 2.) / (2. * width * width)) if eshape == 1 else 1
+        extracts[i] = np.sum(np.where(b1, igrid * wgrid, 0), axis=1)
+    return extracts
+
+
+def make_grid():
+    rng = np.random.default_rng(1)
+    massaxis = np.arange(10000., 200000., 500.)
+    chargeaxis = np.arange(1., 60.)
+    offsetgrid = nzt.make_offset_grid(massaxis, chargeaxis)
+    igrid = rng.uniform(0, 1, offsetgrid.shape)
+    return offsetgrid, igrid
+
+
+def test_extract_offsets_matches_loop():
+    offsetgrid, igrid = make_grid()
+    offsets = [-3., -1., 0., 0.5, 2., 5.]
+    widths = [0.5, 1., 2., 0.25, 1., 0.]
+    for eshape in [0, 1]:
+        out = nzt.extract_offsets(offsetgrid, igrid, offsets, widths, eshape=eshape)
+        assert out.shape == (len(offsets), len(igrid))
+        assert np.allclose(out, loop_extract(offsetgrid, igrid, offsets, widths, eshape=eshape))
+
+
+def test_extract_offsets_edges():
+    offsetgrid, igrid = make_grid()
+    # Points exactly on the lower edge are in the window and points on the upper edge are not
+    f = offsetgrid[3, 7]
+    out = nzt.extract_offsets(offsetgrid, igrid, [f + 1.], [1.])
+    assert np.allclose(out, loop_extract(offsetgrid, igrid, [f + 1.], [1.]))
+    assert nzt.extract_offsets(offsetgrid, igrid, [], []).shape == (0, len(igrid))
+
+
+def test_peak_extract_areas():
+    x = np.arange(0., 100., 0.5)
+    y = np.exp(-(x - 50.) ** 2 / 20.)
+    heights, areas = nzt.peak_extract(x, np.array([y, 2 * y]), [0, 10.], [50.], 3, integralranges=[[40., 60.]])
+    inside = (x > 40.) & (x < 60.)
+    assert np.isclose(areas[0, 0], np.trapezoid(y[inside], x[inside]))
+    shifted = (x + 10. > 40.) & (x + 10. < 60.)
+    assert np.isclose(areas[1, 0], np.trapezoid(2 * y[shifted], x[shifted] + 10.))
+    assert np.isclose(heights[0, 0], 1.)
+    assert np.allclose(nzt.peak_extract(x, np.array([y]), [0], [50.], 3, integralranges=[[]])[1], 0)
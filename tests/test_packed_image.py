@@ -0,0 +1,49 @@
+import numpy as np
+
+from unidec.metaunidec.packed_image import PackedImage, write_packed_hdf5
+
+
+def random_pixels(n=30, seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = []
+    for i in range(n):
+        # Include empty pixels and a few large ones
+        npoints = [0, 5, 50, 400][rng.integers(0, 4)]
+        mz = np.sort(rng.uniform(500, 1500, npoints))
+        pixels.append((i, (i % 6, i // 6, 1), np.transpose([mz, rng.uniform(0, 10, npoints)])))
+    return pixels
+
+
+def test_packed_image_matches_pixels(tmp_path):
+    path = str(tmp_path / "packed.hdf5")
+    pixels = random_pixels()
+    write_packed_hdf5(path, iter(pixels), chunksize=100, nbins=50)
+
+    packed = PackedImage(path, blocksize=150)
+    assert packed.num == len(pixels)
+    assert np.array_equal(packed.coords, [p[1] for p in pixels])
+    for i, c, data in pixels:
+        assert np.allclose(packed.get_spectrum(i).reshape(-1, 2), data.reshape(-1, 2))
+
+    mzranges = [[500, 1500], [700, 710], [1000, 1200], [2000, 3000]]
+    images = packed.ion_images(mzranges)
+    for r, image in zip(mzranges, images):
+        expected = [np.sum(d[(d[:, 0] >= r[0]) & (d[:, 0] <= r[1]), 1]) if len(d) > 0 else 0 for i, c, d in pixels]
+        assert np.allclose(image, expected)
+    assert np.allclose(packed.ion_image(mzranges[1]), images[1])
+
+
+def test_packed_sum_spectrum(tmp_path):
+    path = str(tmp_path / "packed.hdf5")
+    pixels = random_pixels(seed=1)
+    write_packed_hdf5(path, iter(pixels), nbins=50)
+
+    packed = PackedImage(path, blocksize=150)
+    alldata = np.concatenate([d.reshape(-1, 2) for i, c, d in pixels])
+    edges = np.linspace(np.amin(alldata[:, 0]), np.amax(alldata[:, 0]), 51)
+    assert np.allclose(packed.sumdat[:, 1], np.histogram(alldata[:, 0], bins=edges, weights=alldata[:, 1])[0])
+
+    selected = np.arange(len(pixels)) % 3 == 0
+    subset = np.concatenate([pixels[i][2].reshape(-1, 2) for i in np.nonzero(selected)[0]])
+    region = packed.sum_spectrum(pixels=selected, nbins=50)
+    assert np.allclose(region[:, 1], np.histogram(subset[:, 0], bins=edges, weights=subset[:, 1])[0])
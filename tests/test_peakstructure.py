@@ -0,0 +1,70 @@
+import pickle
+
+import numpy as np
+
+import unidec.tools as ud
+from unidec.modules.peakstructure import Peak, Peaks
+
+
+def make_peaks():
+    pks = Peaks()
+    pks.add_peaks(np.array([[1000., 5.], [2000., 10.], [3000., 2.]]))
+    return pks
+
+
+def test_pickle_after_views_used():
+    pks = make_peaks()
+    pks.peaks[1].label = "B"
+    pks.peaks.append(Peak())
+    out = pickle.loads(pickle.dumps(pks))
+    assert out.plen == 4
+    assert [p.mass for p in out.peaks] == [1000., 2000., 3000., 0]
+    assert out.peaks[1].label == "B"
+    out.peaks[0].mass = 1500.
+    assert out.get_values("mass")[0] == 1500.
+    assert pks.get_values("mass")[0] == 1000.
+
+
+def test_views_follow_columns():
+    pks = make_peaks()
+    p = pks.peaks[0]
+    assert p.height == 5.
+    pks.set_values("height", np.array([1., 2., 3.]))
+    assert p.height == 1.
+    p.height = 7.
+    assert pks.get_values("height")[0] == 7.
+    p.label = "A"
+    p.score = 2
+    assert p.score == 2
+    assert pks.get_values("label")[0] == "A"
+    pks.peaks.sort(key=lambda x: x.height)
+    assert [q.height for q in pks.peaks] == [2., 3., 7.]
+    assert list(pks.get_values("height")) == [2., 3., 7.]
+
+
+def test_integers_written_as_integers():
+    pks = Peaks()
+    pks.add_peaks(np.array([[1000., 5.], [2000., 10.]]))
+    pks.peaks[0].avgcharge = 12
+    pks.peaks[1].avgcharge = 14
+    pks.set_values("integral", np.array([5, 6]))
+    out = pks.copy(type="Full")
+    assert out.splitlines()[1].split("\t")[10] == "12"
+    assert out.splitlines()[2].split("\t")[4] == "6"
+    df = pks.to_df()
+    assert list(df["Avgcharge"]) == ["12", "14"]
+    assert list(df["Integral"]) == ["5", "6"]
+    assert pks.get_values("avgcharge").dtype == float
+
+
+def test_peaks_error_fwhm():
+    x = np.arange(900., 1100., 0.1)
+    y = np.exp(-(x - 1000.) ** 2 / (2 * 5. ** 2))
+    pks = Peaks()
+    pks.add_peaks(np.array([[1000., 1.]]))
+    ud.peaks_error_FWHM(pks, np.transpose([x, y]))
+    p = pks.peaks[0]
+    assert abs(p.errorFWHM - 2 * np.sqrt(2 * np.log(2)) * 5.) < 0.2
+    assert abs(p.centroid - 1000.) < 0.1
+    assert not p.badFWHM
+    assert p.intervalFWHM[0] < 1000. < p.intervalFWHM[1]
@@ -0,0 +1,50 @@
+import numpy as np
+
+from unidec import scandec
+
+
+def scan(i):
+    return np.transpose([np.arange(i + 1, dtype=float), np.full(i + 1, float(i))])
+
+
+def test_write_resume_and_read(tmp_path):
+    outfile = str(tmp_path / "out.hdf5")
+    hdf, group, done = scandec.open_output(outfile, "in.mzML", False)
+    assert done == set()
+    scans = [(i, "controllerType=0 controllerNumber=1 scan=%d" % (i + 1), i * 0.1) for i in range(4)]
+    scandec.write_results(group, scans[:2], [scan(0), scan(1)])
+    # An interrupted write leaves values past the last complete scan
+    scandec.append_dataset(group["mass"], np.ones(5))
+    scandec.append_dataset(group["intensity"], np.ones(5))
+    scandec.append_dataset(group["id"], np.array(["partial"], dtype=object))
+    hdf.close()
+
+    hdf, group, done = scandec.open_output(outfile, "in.mzML", False)
+    assert done == {0, 1}
+    scandec.write_results(group, scans[2:], [scan(2), None])
+    hdf.close()
+    assert list(scandec.read_failed(outfile)) == [3]
+
+    # Failed scans are not done, so a resumed run tries them again
+    hdf, group, done = scandec.open_output(outfile, "in.mzML", False)
+    assert done == {0, 1, 2}
+    scandec.write_results(group, scans[3:], [scan(3)])
+    hdf.close()
+    assert len(scandec.read_failed(outfile)) == 0
+
+    index, ids, times, data = scandec.read_scans(outfile)
+    assert list(index) == [0, 1, 2, 3]
+    assert list(ids) == [s[1] for s in scans]
+    assert np.allclose(times, [0, 0.1, 0.2, 0.3])
+    for i, d in enumerate(data):
+        assert np.array_equal(d, scan(i))
+
+
+def test_restart_starts_over(tmp_path):
+    outfile = str(tmp_path / "out.hdf5")
+    hdf, group, done = scandec.open_output(outfile, "in.mzML", False)
+    scandec.write_results(group, [(5, "5", 1.)], [scan(5)])
+    hdf.close()
+    hdf, group, done = scandec.open_output(outfile, "in.mzML", False, resume=False)
+    hdf.close()
+    assert done == set()
@@ -0,0 +1,73 @@
+import numpy as np
+
+from unidec.modules.unidecstructure import DataContainer
+from unidec.modules.unidec_enginebase import UniDecEngine
+
+
+def test_copy_shares_until_written():
+    data = DataContainer()
+    data.data2 = np.array([[1., 2.], [3., 4.]])
+    new = data.copy()
+    assert new.data2 is data.data2
+    new.writable("data2")[:, 1] = 0
+    assert np.all(data.data2[:, 1] == [2., 4.])
+    assert np.all(new.data2[:, 1] == 0)
+
+
+def test_snapshot_versions_and_restore():
+    data = DataContainer()
+    data.massdat = np.ones((3, 2))
+    version, arrays = data.snapshot()
+    assert version == data.version
+    assert data.versions["massdat"] <= version
+    assert arrays["massdat"] is data.massdat
+
+    # Writing in place after a snapshot copies first, so the snapshot keeps the old values
+    data.writable("massdat")[:, 1] = 5
+    assert data.version > version
+    assert np.all(arrays["massdat"][:, 1] == 1)
+    # An array set after the snapshot is not shared, so it is not copied
+    fresh = np.zeros((3, 2))
+    data.massdat = fresh
+    assert data.writable("massdat") is fresh
+
+    data.restore((version, arrays))
+    assert data.massdat is arrays["massdat"]
+    data.writable("massdat")[0, 1] = 7
+    assert arrays["massdat"][0, 1] == 1
+
+
+def test_history_keeps_data_references():
+    eng = UniDecEngine(silent=True)
+    eng.data.data2 = np.ones((4, 2))
+    first = eng.data.data2
+    eng.config.mzsig = 5.
+    eng.update_history()
+    eng.data.writable("data2")[:, 1] = 2
+    eng.config.mzsig = 7.
+    eng.update_history()
+    assert eng.data.data2 is not first
+    assert np.all(first[:, 1] == 1)
+
+    # Undo sets back the config only, unless the data is asked for too
+    eng.undo()
+    assert eng.config.mzsig == 5.
+    assert np.all(eng.data.data2[:, 1] == 2)
+    eng.redo()
+    eng.undo(data=True)
+    assert eng.config.mzsig == 5.
+    assert eng.data.data2 is first
+    eng.redo(data=True)
+    assert eng.config.mzsig == 7.
+    assert np.all(eng.data.data2[:, 1] == 2)
+
+
+def test_history_drops_old_data_references():
+    eng = UniDecEngine(silent=True)
+    for i in range(15):
+        eng.data.data2 = np.full((2, 2), float(i))
+        eng.config.mzsig = float(i + 1)
+        eng.update_history()
+    kept = [s for s in eng.data_history if s is not None]
+    assert len(kept) == 10
+    assert kept[-1][1]["data2"] is eng.data.data2
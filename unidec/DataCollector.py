@@ -950,7 +950,7 @@ class DataCollector(wx.Frame):
                 if self.filetype == 1:
                     data = get_dataset(msdata, "mass_data_dd")
                 else:
-                    data = np.loadtxt(filename)
+                    data = DoubleDec.load_dd(filename)
 
             if not ud.isempty(self.range):
                 bool1 = data[:, 0] >= self.range[0]
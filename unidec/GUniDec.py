@@ -773,7 +773,7 @@ class UniDecApp(UniDecPres):
             bool1 = self.eng.data.data2[:, 0] > limits[0]
             bool2 = self.eng.data.data2[:, 0] < limits[1]
             bool3 = np.all(np.array([bool1, bool2]), axis=0)
-            self.eng.data.data2[bool3, 1] = 0
+            self.eng.data.writable("data2")[bool3, 1] = 0
             ud.dataexport(self.eng.data.data2, self.eng.config.infname)
 
             self.view.clear_all_plots()
@@ -890,8 +890,9 @@ class UniDecApp(UniDecPres):
 
         if self.eng.pks.changed == 1:
             print("Simulating Peaks")
-            mztab = ud.make_peaks_mztab(self.eng.data.mzgrid, self.eng.pks, self.eng.config.adductmass)
-            ud.make_peaks_mztab_spectrum(self.eng.data.mzgrid, self.eng.pks, self.eng.data.data2, mztab)
+            mzaxis, ztab, grid = self.eng.data.get_mzgrid2d()
+            mztab = ud.make_peaks_mztab(grid, self.eng.pks, self.eng.config.adductmass, xvals=mzaxis, yvals=ztab)
+            ud.make_peaks_mztab_spectrum(None, self.eng.pks, self.eng.data.data2, mztab, yvals=ztab)
             self.view.peakpanel.add_data(self.eng.pks)
             self.makeplot2(1)
             self.makeplot6(1)
@@ -1068,7 +1069,7 @@ class UniDecApp(UniDecPres):
         :return: None
         """
         dlg = nativez.NativeZ(self.view)
-        dlg.initialize_interface(self.eng.data.massdat[:, 0], np.unique(self.eng.data.mzgrid[:, 1]),
+        dlg.initialize_interface(self.eng.data.massdat[:, 0], self.eng.data.get_mzgrid2d()[1],
                                  self.eng.data.massgrid,
                                  self.eng.config, self.eng.pks)
         dlg.ShowModal()
@@ -1,6 +1,7 @@
 from unidec.engine import UniDec
 from unidec.modules.matchtools import *
 from unidec.modules import peakstructure
+from unidec.modules.report_renderer import ReportRenderer
 from unidec.tools import known_extensions, strip_char_from_string, find_kernel_file
 import os
 import numpy as np
@@ -8,6 +9,8 @@ import time
 import webbrowser
 import sys
 import re
+import shutil
+import tempfile
 
 basic_parameters = [["Sample name", True, "The File Name or Path. File extensions are optional."],
                     ["Data Directory", False, "The directory of the data files. If you do not specify this, "
@@ -431,6 +434,13 @@ class UniDecBatchProcessor(object):
         self.time_range = None
         self.integrate = False
         self.global_html_str = ""
+        self.global_html_part = None
+        self.report_jobs = []
+        # Report plots are rendered by this many worker processes (None for the number of CPUs, 1 for no workers),
+        # cached in report_cachedir if set, and decimated to report_maxpoints if set
+        self.report_workers = None
+        self.report_cachedir = None
+        self.report_maxpoints = None
         self.filename = ""
         self.outbase = ""
         self.outfile = ""
@@ -473,6 +483,13 @@ class UniDecBatchProcessor(object):
 
         duplicate_paths = self.check_duplicate_filenames(use_converted=use_converted)
 
+        # Start the global HTML report, which is written as each report finishes
+        if write_html:
+            self.open_global_html_part()
+        renderer = ReportRenderer(nworkers=self.report_workers, cachedir=self.report_cachedir,
+                                  maxpoints=self.report_maxpoints)
+        self.report_jobs = []
+
         total_n = len(self.rundf)
         # Loop through the DataFrame
         for i, row in self.rundf.iterrows():
@@ -587,12 +604,13 @@ class UniDecBatchProcessor(object):
                     findex = i
                 else:
                     findex = None
-                outfile = self.eng.gen_html_report(open_in_browser=False, interactive=interactive, findex=findex,
-                                                   results_string=results_string, del_columns=del_columns)
-                htmlfiles.append(outfile)
+                job = self.eng.start_html_report(interactive=interactive, findex=findex, renderer=renderer,
+                                                 results_string=results_string, del_columns=del_columns)
+                htmlfiles.append(job.outfile)
 
-                # Add the HTML report to the global HTML string
-                self.global_html_str += self.eng.html_str
+                # Add the HTML report to the global HTML report once its plots are rendered
+                self.report_jobs.append(job)
+                self.finish_reports(wait=False)
                 # Add the peaks to the global peaks
                 self.pks.merge_in_peaks(self.eng.pks, filename=path, filenumber=i)
             else:
@@ -600,6 +618,9 @@ class UniDecBatchProcessor(object):
                 print("File not found:", path)
                 htmlfiles.append("")
 
+        self.finish_reports(wait=True)
+        renderer.close()
+
         # Write the number of peaks IDed
         self.rundf["NumPeaks"] = npeaks
 
@@ -621,17 +642,9 @@ class UniDecBatchProcessor(object):
             self.write_xlsx()
 
         if write_html:
-            # Write the global HTML string to a file
+            # Move the global HTML report into place
             self.global_html_file = self.outbase + "_report.html"
-            with open(self.global_html_file, "w", encoding="utf-8") as f:
-                title_string = "UPP Results " + str(self.filename)
-                f.write("<html>")
-                f.write("<title>" + title_string + "</title>")
-                f.write("<header><h1>" + title_string + "</h1></header>")
-                # Remove text between <h1> and </h1> tags
-                self.global_html_str = re.sub(r"<h1>.*</h1>", "", self.global_html_str)
-                f.write(self.global_html_str)
-                f.write("</html>")
+            self.close_global_html_part(self.global_html_file)
             print("Write to: ", self.global_html_file)
 
         if write_peaks:
@@ -642,6 +655,46 @@ class UniDecBatchProcessor(object):
         print("Batch Run Time:", self.runtime)
         return self.rundf
 
+    def open_global_html_part(self):
+        """
+        Start the global HTML report in a temporary file in the top directory.
+        The reports of each file are added by finish_reports, and close_global_html_part moves it into place.
+        :return: None
+        """
+        title_string = "UPP Results " + str(self.filename)
+        topdir = self.top_dir if os.path.isdir(self.top_dir) else None
+        fd, self.global_html_part = tempfile.mkstemp(prefix="UPP_", suffix="_report.html.part", dir=topdir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write("<html>")
+            f.write("<title>" + title_string + "</title>")
+            f.write("<header><h1>" + title_string + "</h1></header>")
+
+    def close_global_html_part(self, outfile):
+        """
+        Finish the global HTML report and move it to outfile
+        :param outfile: Path of the global HTML report
+        :return: None
+        """
+        with open(self.global_html_part, "a", encoding="utf-8") as f:
+            f.write("</html>")
+        shutil.move(self.global_html_part, outfile)
+        self.global_html_part = None
+
+    def finish_reports(self, wait=True):
+        """
+        Finish the pending HTML reports in order and add them to the global HTML report.
+        :param wait: If True, wait for all reports. If False, only finish reports whose plots are already rendered.
+        :return: None
+        """
+        while len(self.report_jobs) > 0 and (wait or self.report_jobs[0].done()):
+            html_str = self.report_jobs.pop(0).finish()
+            if self.global_html_part is not None:
+                # Remove text between <h1> and </h1> tags
+                with open(self.global_html_part, "a", encoding="utf-8") as f:
+                    f.write(re.sub(r"<h1>.*</h1>", "", html_str))
+            else:
+                self.global_html_str += html_str
+
     def write_peaks(self, outfile=None):
         # Write the peaks to a file
         if outfile is None:
@@ -448,10 +448,8 @@ class UniDec(UniDecEngine):
             if not efficiency:
                 # Import Grid
                 try:
-                    self.data.mzgrid = np.fromfile(self.config.mzgridfile, dtype=self.config.dtype)
-                    xv, yv = np.meshgrid(self.data.ztab, self.data.data2[:, 0])
-                    xv = np.c_[np.ravel(yv), np.ravel(xv)]
-                    self.data.mzgrid = np.c_[xv, self.data.mzgrid]
+                    grid = np.fromfile(self.config.mzgridfile, dtype=self.config.dtype)
+                    self.data.set_mzgrid(grid, self.data.data2[:, 0], self.data.ztab)
                 except Exception as e:
                     print("Error: Mismatched dimensions between processed and deconvolved data. ", e)
                     self.data.mzgrid = []
@@ -459,6 +457,9 @@ class UniDec(UniDecEngine):
             for r in runstats:
                 if r[0] == "avgscore":
                     self.config.avgscore = float(r[2])
+                # Pick up the parameters chosen by the autotune grid in the core
+                if self.config.autotune and r[0] in ["mzsig", "zzsig", "beta", "psig"]:
+                    setattr(self.config, r[0], float(r[2]))
 
         else:
             # Calculate Error
@@ -480,10 +481,8 @@ class UniDec(UniDecEngine):
                 self.data.mztgrid = np.clip(self.data.mztgrid, 0.0, np.amax(self.data.mztgrid))
                 self.data.mztgrid = self.data.mztgrid.reshape(
                     (len(np.unique(self.data.data3[:, 0])), len(np.unique(self.data.data3[:, 1])), zlen))
-                self.data.mzgrid = np.sum(self.data.mztgrid, axis=1)
-                xv, yv = np.meshgrid(self.data.ztab, np.unique(self.data.data3[:, 0]))
-                xv = np.c_[np.ravel(yv), np.ravel(xv)]
-                self.data.mzgrid = np.c_[xv, np.ravel(self.data.mzgrid)]
+                self.data.set_mzgrid(np.sum(self.data.mztgrid, axis=1), np.unique(self.data.data3[:, 0]),
+                                     self.data.ztab)
 
     def pick_peaks(self, calc_dscore=True):
         """
@@ -526,7 +525,7 @@ class UniDec(UniDecEngine):
             print("Warning: Normalization is 0. Setting to 1.")
 
         peaks[:, 1] = peaks[:, 1] / norm
-        self.data.massdat[:, 1] = self.data.massdat[:, 1] / norm
+        self.data.writable("massdat")[:, 1] = self.data.massdat[:, 1] / norm
         self.config.massdatnorm = self.config.massdatnormtop / np.amax(peaks[:, 1])
 
         self.pks = peakstructure.Peaks()
@@ -535,7 +534,8 @@ class UniDec(UniDecEngine):
         ud.dataexport(peaks, self.config.peaksfile)
         # Generate Intensities of Each Charge State for Each Peak
         try:
-            mztab = ud.make_peaks_mztab(self.data.mzgrid, self.pks, self.config.adductmass)
+            mzaxis, ztab, grid = self.data.get_mzgrid2d()
+            mztab = ud.make_peaks_mztab(grid, self.pks, self.config.adductmass, xvals=mzaxis, yvals=ztab)
         except Exception:
             mztab = []
             pass
@@ -551,7 +551,7 @@ class UniDec(UniDecEngine):
             print("Error in error calculations:", e)
         if self.config.batchflag == 0:
             try:
-                ud.make_peaks_mztab_spectrum(self.data.mzgrid, self.pks, self.data.data2, mztab)
+                ud.make_peaks_mztab_spectrum(None, self.pks, self.data.data2, mztab, yvals=self.data.ztab)
                 self.export_config()
             except Exception:
                 pass
@@ -581,11 +581,22 @@ class UniDec(UniDecEngine):
             self.pks.convolved = True
         return np.array(convdata)
 
-    def autorun(self, auto_peak_width=True, silent=False):
+    def autorun(self, auto_peak_width=True, silent=False, autotune=False):
+        """
+        Processes, deconvolves, picks peaks, and integrates with the current settings.
+        :param auto_peak_width: If True, the peak width is set automatically before deconvolution
+        :param silent: If True, suppresses output
+        :param autotune: If True, the core searches a grid of mzsig, beta, and psig and keeps the best UniScore.
+        The chosen values are written back into self.config.
+        :return: None
+        """
         self.process_data(silent=silent)
         if auto_peak_width:
             self.get_auto_peak_width()
+        oldautotune = self.config.autotune
+        self.config.autotune = autotune or oldautotune
         self.run_unidec(silent=silent)
+        self.config.autotune = oldautotune
         self.pick_peaks()
         self.autointegrate()
         self.export_params(silent=silent)
@@ -656,7 +667,7 @@ class UniDec(UniDecEngine):
             self.config.kendrickmass = self.config.molig
         if self.config.kendrickmass > 0:
             self.pks.get_mass_defects(self.config.kendrickmass, mode=centermode)
-            return np.array([[p.mass, p.kendrickdefect] for p in self.pks.peaks])
+            return np.transpose([self.pks.get_values("mass"), self.pks.get_values("kendrickdefect")])
         else:
             print("Need non-zero Kendrick mass")
             return None
@@ -778,10 +789,10 @@ class UniDec(UniDecEngine):
                     print("Unable to autointegrate")
 
             # Get Params
-            peaks = np.array([[p.mass, p.height] for p in self.pks.peaks])
+            peaks = np.transpose([self.pks.get_values("mass"), self.pks.get_values("height")])
             try:
                 self.autointegrate()
-                areas = [p.integral for p in self.pks.peaks]
+                areas = self.pks.get_values("integral")
             except (IndexError, ValueError, AttributeError, ZeroDivisionError):
                 areas = peaks[:, 1]
                 print("Failed to integrate. Substituting heights for areas.")
@@ -829,6 +840,7 @@ class UniDec(UniDecEngine):
         :return: None
         """
         self.pks = peakstructure.Peaks()
+        self.data.writable("massdat")
         if self.config.smooth > 0:
             self.data.massdat = ud.gsmooth(self.data.massdat, self.config.smooth)
         # Baseline Subtraction
@@ -877,12 +889,8 @@ class UniDec(UniDecEngine):
         Will overwrite mass peaks.
         :return: cpeaks (Z x 2 array of (charge state, intensity))
         """
-        if not ud.isempty(self.data.mzgrid):
-            dat = self.data.mzgrid
-            c = dat[:, 2]
-            xlen = len(np.unique(dat[:, 0]))
-            ylen = len(np.unique(dat[:, 1]))
-            newgrid = np.reshape(c, (xlen, ylen))
+        if self.data.has_mzgrid():
+            newgrid = self.data.get_mzgrid2d()[2]
 
             cint = np.sum(newgrid, axis=0)
             if self.config.peaknorm == 1:
@@ -1004,8 +1012,8 @@ class UniDec(UniDecEngine):
             print("No Peaks Detected")
             return
 
-        integrals = np.array([p.integral for p in self.pks.peaks])
-        heights = np.array([p.height for p in self.pks.peaks])
+        integrals = self.pks.get_values("integral")
+        heights = self.pks.get_values("height")
         # corrints = np.array([p.corrint for p in self.pks.peaks])
         # fitareas = np.array([p.fitarea for p in self.pks.peaks])
         if self.config.peaknorm == 1:
@@ -1147,7 +1155,7 @@ class UniDec(UniDecEngine):
             # print(badarea, zs, p.cs_score)
 
     def get_mzstack(self, xfwhm=2):
-        zarr = np.reshape(self.data.mzgrid[:, 2], (len(self.data.data2), len(self.data.ztab)))
+        zarr = np.reshape(self.data.get_mzgrid2d()[2], (len(self.data.data2), len(self.data.ztab)))
         # zarr = zarr / np.amax(np.sum(zarr, axis=1)) * np.amax(self.data.data2[:, 1])
         for i, p in enumerate(self.pks.peaks):
             # fwhm = p.errorFWHM
@@ -32,13 +32,7 @@ def plot_function(x, y):
     # to number of m/z values in original data
     ynew = datainterpolation(xnew)  # evalues the interpolation at the equally-spaced m/z values
 
-    negvalues = 0
-
-    for i in range(0, len(ynew)):  # set any negative interpolated abundances to 0
-
-        if ynew[i] < 0:
-            ynew[i] = 0
-            negvalues += 1
+    ynew = np.clip(ynew, 0, None)  # set any negative interpolated abundances to 0
 
     next2power = np.ceil(np.log2(len(ynew)))
     newpadding = pow(2, next2power) - len(ynew)
@@ -96,22 +90,14 @@ def findmax(expandedspan,ABFT,ftx,lowend,delta,pctpkht): #find all the local max
         else:
             ABFTRange.append(ABFT[i])
     minNum = pctpkht*max(ABFTRange)
-    refmaxtab = []
-
-
-    for i in range(0 + delta, HalfLen - delta):
-        if ftx[i] < lowend:
-            continue
-        else:
-            large = True
-            baseline = True
-            if ABFT[i] < minNum:
-                baseline = False
-            for j in range(i - delta, i + delta):
-                if ABFT[i] < ABFT[j]:
-                    large = False
-            if large == True and baseline == True:
-                refmaxtab.append([ftx[i], ABFT[i]])
+    if HalfLen - 2 * delta <= 0:
+        return []
+    # Maximum of ABFT[i - delta:i + delta] for each i in range(delta, HalfLen - delta)
+    windowmax = np.amax(np.lib.stride_tricks.sliding_window_view(ABFT[:HalfLen - 1], 2 * delta), axis=1)
+    index = np.arange(delta, HalfLen - delta)
+    vals = ABFT[index]
+    good = (ftx[index] >= lowend) & (vals >= minNum) & (vals >= windowmax[:len(index)])
+    refmaxtab = [[ftx[i], ABFT[i]] for i in index[good]]
     return refmaxtab
 
 
@@ -186,163 +172,127 @@ def subunit(refmaxtabCalc, numcharCalc, omegaCalc, chargestatesCalc, chargestate
     stdevmass = np.sqrt(stdevtot / numcharCalc)
     return submass, stdevmass
 
-def envelope_calc(chargestatesr,expandedspan,submass,ftx,ftspacing,FT,y):
-    omegafinal = expandedspan / submass * 2
-    ABIFT = []
-    ABIFTmax = []
-    ABIFTmaxfinal = 0
-    ABIFTintegral = 0
-    msintegral = sum(y)
-    for i in range(0, len(chargestatesr)):
-        freqmax = (chargestatesr[i] + 1 / 2) * omegafinal
-        freqmin = (chargestatesr[i] - 1 / 2) * omegafinal
-        condition = np.logical_and((ftx / ftspacing) > freqmin, (ftx / ftspacing) < freqmax)
-        csdata = np.extract(condition, FT)  # extracts the FFT data from the FFT spectrum that are within 1/2
-        # the peak spacing of each maximum
-        extlen = np.size(csdata)
-        leftzeroes = np.ceil(freqmin)
-        rightzeroes = np.size(FT) - extlen - leftzeroes
-        paddedcsdata = np.lib.pad(csdata, (np.int_(leftzeroes), np.int_(rightzeroes)), 'constant',
-                                  constant_values=(0, 0))
-        IFT = np.fft.ifft(paddedcsdata)
-        ABIFT.append(abs(IFT[int((len(IFT)) / 2):]))
+def window_bounds(ftx, ftspacing, freqmin, freqmax):
+    """
+    Finds the Fourier indexes that fall strictly inside each frequency window.
+    :param ftx: Fourier x-axis
+    :param ftspacing: Fourier spacing
+    :param freqmin: Array of lower window edges in units of ftspacing
+    :param freqmax: Array of upper window edges in units of ftspacing
+    :return: lo, hi arrays so that indexes lo <= i < hi are inside each window
+    """
+    ftindex = ftx / ftspacing
+    lo = np.searchsorted(ftindex, freqmin, side="right")
+    hi = np.searchsorted(ftindex, freqmax, side="left")
+    return lo, np.maximum(hi, lo)
 
-    ############### Normalization of the IFFT Data ##########################
-    for i in range(0, len(chargestatesr)):
-        ABIFTmax.append(max(ABIFT[i]))
 
-    ABIFTmaxfinal = max(ABIFTmax)
+def window_ifft(chargestatesr, omegafinal, ftx, ftspacing, FT, chunksize=2 ** 24):
+    """
+    Inverse Fourier transforms the window around each charge state in one batched FFT.
+
+    Each window is 1/2 the peak spacing on either side of the charge state frequency. Charge states are processed in
+    chunks to keep the 2D array under chunksize elements.
+    :param chargestatesr: Array of charge states
+    :param omegafinal: Fundamental frequency spacing
+    :param ftx: Fourier x-axis
+    :param ftspacing: Fourier spacing
+    :param FT: Fourier transform of the mirrored data
+    :param chunksize: Maximum number of elements in each batched FFT
+    :return: 2D complex array with the second half of the inverse FFT for each charge state
+    """
+    chargestatesr = np.asarray(chargestatesr, dtype=float)
+    lo, hi = window_bounds(ftx, ftspacing, (chargestatesr - 1 / 2) * omegafinal,
+                           (chargestatesr + 1 / 2) * omegafinal)
+    n = len(FT)
+    index = np.arange(n)
+    step = max(1, int(chunksize / n))
+    out = []
+    for start in range(0, len(chargestatesr), step):
+        end = start + step
+        mask = (index >= lo[start:end, None]) & (index < hi[start:end, None])
+        IFT = np.fft.ifft(np.where(mask, FT, 0), axis=1)
+        out.append(IFT[:, int(n / 2):])
+    if len(out) == 0:
+        return np.zeros((0, n - int(n / 2)), dtype=complex)
+    return np.concatenate(out, axis=0)
+
+
+def normalize_envelopes(ABIFT, msintegral, maxval=None):
+    """
+    Normalizes the envelope functions to a max of 1 and then to the integral of the mass spectrum.
+    :param ABIFT: 2D array of envelope functions
+    :param msintegral: Integral of the mass spectrum
+    :param maxval: Value to normalize the max to. Default is the max of ABIFT.
+    :return: Normalized ABIFT
+    """
+    if maxval is None:
+        maxval = np.amax(ABIFT)
+    ABIFT = ABIFT / maxval
+    return ABIFT / np.sum(ABIFT) * msintegral
 
-    for i in range(0, len(chargestatesr)):
-        for j in range(0, len(ABIFT[i])):
-            ABIFT[i][j] = ABIFT[i][j] / ABIFTmaxfinal
 
-    for i in range(0, len(chargestatesr)):
-        ABIFTintegral += sum(ABIFT[i])
-    for i in range(0, len(chargestatesr)):
-        for j in range(0, len(ABIFT[i])):
-            ABIFT[i][j] = ABIFT[i][j] / ABIFTintegral * msintegral
+def envelope_calc(chargestatesr,expandedspan,submass,ftx,ftspacing,FT,y):
+    omegafinal = expandedspan / submass * 2
+    msintegral = sum(y)
+    # extracts the FFT data from the FFT spectrum that are within 1/2 the peak spacing of each maximum
+    ABIFT = np.abs(window_ifft(chargestatesr, omegafinal, ftx, ftspacing, FT))
 
-    return ABIFT
+    ############### Normalization of the IFFT Data ##########################
+    return normalize_envelopes(ABIFT, msintegral)
 
 def zerocharge(ABIFT,xnew,chargestatesr):
-    yfull = []
-    for i in range (0,len(ABIFT)):
-        yfulltemp = ABIFT[i][0:int(len(xnew))]
-        yfull.append(yfulltemp)
-    xfull = []
-    for i in range(0,len(chargestatesr)):
-        if i != len(chargestatesr) + 1:
-            xfull.append(xnew)
-    xfull = np.array(xfull)
-
-    ######### multiplies each x component by its charge state #############################
-    for i in range(0, len(xfull)):
-        for j in range(0, len(xfull[0])):
-            xfull[i][j] = chargestatesr[i] * xfull[i][j]
-    ######### multiplies each x component by its charge state #############################
-
-    ######### interpolates that data to make them equally spaced ##########################
-    xnewfinal = []
-    ynewfinal = []
-    for i in range(0, len(xfull)):
-        datainterpolation = interpolate.InterpolatedUnivariateSpline(xfull[i], yfull[i], k=3)
-        xnew = np.linspace(np.min(xfull[i]), np.max(xfull[i]), np.size(xfull),
-                           endpoint=True)  # number of equally-spaced m/z
-        # values is equal to number of
-        # m/z values in original data
-        xnewfinal.append(xnew)
-        ynew = datainterpolation(xnew)
-        ynewfinal.append(ynew)
-    ######### interpolates that data to make them equally spaced ##########################
+    chargestatesr = np.asarray(chargestatesr, dtype=float)
+    yfull = np.array([ABIFT[i][0:int(len(xnew))] for i in range(0, len(ABIFT))])
 
     ######### creates range in 10's for the entire zero charge spectrum ######
-    xmax = []
-    xmin = []
-    for i in range(0, len(xnewfinal)):
-        xmax.append(xnewfinal[i][-1] / 10)
-        xmin.append(xnewfinal[i][0] / 10)
-    xmaxfinal = (np.ceil(xmax)) * 10
-    xminfinal = (np.floor(xmin)) * 10
-    xrange = np.arange((min(xminfinal)), (max(xmaxfinal) + 10), 10)
+    xmin = np.floor(chargestatesr * np.min(xnew) / 10) * 10
+    xmax = np.ceil(chargestatesr * np.max(xnew) / 10) * 10
+    xrange = np.arange((min(xmin)), (max(xmax) + 10), 10)
     ######### creates range in 10's for the entire zero charge spectrum ######
 
-    ########### creates charge specific x axis in 10's for each charge state###########
-    xrangespec = []
-    xmin = np.floor(xmin) * 10
-    xmax = np.ceil(xmax) * 10
-    yrangespec = []
-    for i in range(0, len(xmin)):
-        xrangespectemp = np.arange(xmin[i], xmax[i] + 10, 10)
-        xrangespec.append(xrangespectemp)
-    for i in range(0, len(xrangespec)):
-        datainterpolation = interpolate.InterpolatedUnivariateSpline(xfull[i], yfull[i], k=3)
-        yrangespectemp = datainterpolation(xrangespec[i])
-        yrangespec.append(yrangespectemp)
-    ########### creates charge specific x axis in 10's fir each charge state###########
-
-    ####### places a zero if the data is outside the range of the original charge state specific spectrum #######
-    for i in range(0, len(xrangespec)):
-        Ytempnum = (max(xrange) - max(xrangespec[i])) / 10
-        yzerosright = np.zeros(int(Ytempnum))
-        yrangespec[i] = np.append(yrangespec[i], yzerosright)
-        Ytempnum2 = (min(xrangespec[i]) - min(xrange)) / 10
-        yzerosleft = np.zeros(int(Ytempnum2))
-        yrangespec[i] = np.append(yzerosleft, yrangespec[i])
-    yfinal = np.zeros(len(yrangespec[0]))
-    for i in range(len(yrangespec)):
-        yfinal += yrangespec[i]
-    ####### places a zero if the data is outside the range of the original charge state specific spectrum #######
+    ########### interpolates each charge state onto the mass axis ###########
+    # Multiplying x by the charge state only rescales the spline, so all charge states can share one spline fit on
+    # xnew, which is evaluated at mass / charge
+    splines = interpolate.make_interp_spline(xnew, np.transpose(yfull), k=3)
+    yrangespec = np.zeros((len(chargestatesr), len(xrange)))
+    for i in range(0, len(chargestatesr)):
+        # places a zero if the data is outside the range of the original charge state specific spectrum
+        b1 = (xrange >= xmin[i]) & (xrange <= xmax[i])
+        spline = interpolate.BSpline(splines.t, splines.c[:, i], splines.k)
+        yrangespec[i, b1] = spline(xrange[b1] / chargestatesr[i])
+    yfinal = np.sum(yrangespec, axis=0)
+    ########### interpolates each charge state onto the mass axis ###########
 
     return xrange,yfinal,yrangespec
 
 def FFTFilter(expandedspanCalc, submassCalc, ZFreqData, ftxCalc, ftspacingCalc, FTCalc, chargestatesrCalc, OTnum):
     omegafinal = expandedspanCalc / submassCalc * 2
-    ABIFT = []
-    for i in range(0, len(chargestatesrCalc)):  ###here we include all the harmonics, including in calculating noise
-        # bands, so we'll have to add a new loop just to calculate single-harmonic envelopes with and without noise
-        freqmax = (chargestatesrCalc[i] + 1 / 2) * omegafinal
-        freqmin = (chargestatesrCalc[i] - 1 / 2) * omegafinal
-        paddedcsdata = np.zeros(np.size(FTCalc))
-
-        for j in range(1, OTnum):
-            condition = np.logical_and((ftxCalc / ftspacingCalc) > j * freqmin,
-                                       (ftxCalc / ftspacingCalc) < j * freqmax)
-            csdata = 2 * np.extract(condition, FTCalc)  # extracts the FFT data from the FFT spectrum that are
-            #  within 1/2 the peak spacing of each maximum, and the 2 is because the amplitude was halved due to mirroring the data
-            extlen = np.size(csdata)
-            print(j * freqmax)
-            leftzeroes = np.ceil(j * freqmin)
-            rightzeroes = np.size(FTCalc) - extlen - leftzeroes
-            paddedcsdata = np.add(paddedcsdata, np.lib.pad(csdata, (np.int_(leftzeroes), np.int_(rightzeroes)),
-                                                           'constant', constant_values=(0, 0)))
-
-        IFT = np.fft.ifft(paddedcsdata)
-        ABIFT.append(IFT[int((len(IFT)) / 2):])
-    reconst = np.zeros(len(ABIFT[1]))
-    baseline = np.zeros(len(ABIFT[1]))
+    chargestatesrCalc = np.asarray(chargestatesrCalc, dtype=float)
+    # Here we include all the harmonics of all the charge states. Because the inverse FFT is linear, the sum of the
+    # envelopes is the inverse FFT of the sum of the windows, so it only needs one FFT.
+    harmonics = np.arange(1, OTnum)
+    freqmin = np.ravel(harmonics[:, None] * (chargestatesrCalc - 1 / 2) * omegafinal)
+    freqmax = np.ravel(harmonics[:, None] * (chargestatesrCalc + 1 / 2) * omegafinal)
+    lo, hi = window_bounds(ftxCalc, ftspacingCalc, freqmin, freqmax)
+    # Count how many windows cover each point. The 2 is because the amplitude was halved due to mirroring the data.
+    weights = np.zeros(np.size(FTCalc) + 1)
+    np.add.at(weights, lo, 2)
+    np.add.at(weights, hi, -2)
+    weights = np.cumsum(weights)[:-1]
+    IFT = np.fft.ifft(weights * FTCalc)
+    reconst = IFT[int((len(IFT)) / 2):]
+
     zerofreqwindow = ZFreqData  # governs how far out, in multiples of the fundamental spacing, data for the
     # zero-frequency (FT baseline) peak should be used
     maxfreq = np.max(ftxCalc) / ftspacingCalc
-    conditionleft = ftxCalc / ftspacingCalc < zerofreqwindow * omegafinal  # extract Fourier data near zero
-    # frequency to add to reconstructed spectrum
-    csdataleft = np.extract(conditionleft,
-                            FTCalc)  # extracts the FFT data from the FFT spectrum that are within 1/2
-    # the peak spacing of each maximum, and the 2 is because the amplitude was halved due to mirroring the data
-    csdataleft[0] = csdataleft[0]
-    extlenleft = np.size(csdataleft)
+    # extract Fourier data near zero frequency to add to reconstructed spectrum
+    conditionleft = ftxCalc / ftspacingCalc < zerofreqwindow * omegafinal
     conditionright = ftxCalc / ftspacingCalc > (maxfreq - zerofreqwindow * omegafinal)
-    csdataright = np.extract(conditionright, FTCalc)
-    extlenright = np.size(csdataright)
-    middlezeroes = np.size(FTCalc) - extlenleft - extlenright
-    zerofreqdata = np.append(np.lib.pad(csdataleft, (0, np.int_(middlezeroes)),
-                                        'constant', constant_values=(0, 0)), csdataright)
+    zerofreqdata = np.where(conditionleft | conditionright, FTCalc, 0)
 
     IFTzero = np.fft.ifft(zerofreqdata)
-    baseline = np.add(baseline, IFTzero[int((len(IFTzero)) / 2):])
-
-    for i in range(0, len(chargestatesrCalc)):
-        reconst = np.add(reconst, ABIFT[i])
+    baseline = IFTzero[int((len(IFTzero)) / 2):]
 
     # self.reconstenv = np.abs(self.reconst + self.baseline)
     reconstspec = np.real(reconst + baseline)
@@ -351,122 +301,41 @@ def FFTFilter(expandedspanCalc, submassCalc, ZFreqData, ftxCalc, ftspacingCalc,
 
 def AverageHarmFun(chargestatesrCalc,expandedspanCalc,submassCalc,ftxCalc,ftspacingCalc,FTCalc,paddedxnewCalc,xnewCalc,
                 ynewCalc,ydataCalc,ov):
-
+    cs = len(chargestatesrCalc)
+    msintegral = sum(ydataCalc)
     ABIFT = []
-    ABIFTmax = []
+    ABIFTmaxfinal = 0
     ABIFTintegral = 0
-    msintegral = sum(ydataCalc)
-    print(msintegral)
     for k in range(1,ov+1):
-        ABIFTtemp = []
-        for i in range(0, len(chargestatesrCalc)):
-            omegafinal = expandedspanCalc / (submassCalc/k) * 2
-            freqmax = (chargestatesrCalc[i] + 1 / 2) * omegafinal
-            freqmin = (chargestatesrCalc[i] - 1 / 2) * omegafinal
-            condition = np.logical_and((ftxCalc / ftspacingCalc) > freqmin, (ftxCalc / ftspacingCalc) < freqmax)
-            csdata = np.extract(condition, FTCalc)  # extracts the FFT data from the FFT spectrum that are within 1/2
-            # the peak spacing of each maximum
-            extlen = np.size(csdata)
-            leftzeroes = np.ceil(freqmin)
-            rightzeroes = np.size(FTCalc) - extlen - leftzeroes
-            paddedcsdata = np.lib.pad(csdata, (np.int_(leftzeroes), np.int_(rightzeroes)), 'constant',
-                                      constant_values=(0, 0))
-            IFT = np.fft.ifft(paddedcsdata)
-            ABIFTtemp.append(abs(IFT[int((len(IFT)) / 2):]))
+        omegafinal = expandedspanCalc / (submassCalc/k) * 2
+        ABIFTtemp = np.abs(window_ifft(chargestatesrCalc, omegafinal, ftxCalc, ftspacingCalc, FTCalc))
+        ############### Normalization of the IFFT Data ##########################
+        # The max and integral are running values across all harmonics
+        ABIFTmaxfinal = max(ABIFTmaxfinal, np.amax(ABIFTtemp))
+        ABIFTtemp = ABIFTtemp / ABIFTmaxfinal
+        ABIFTintegral += np.sum(ABIFTtemp)
+        ABIFT.append(ABIFTtemp / ABIFTintegral * msintegral)
     ############### Normalization of the IFFT Data ##########################
-        for i in range(0, len(chargestatesrCalc)):
-            ABIFTmax.append(max(ABIFTtemp[i]))
-
-        ABIFTmaxfinal = max(ABIFTmax)
-
-        for i in range(0, len(chargestatesrCalc)):
-            for j in range(0, len(ABIFTtemp[i])):
-                ABIFTtemp[i][j] = ABIFTtemp[i][j] / ABIFTmaxfinal
-
-        for i in range(0, len(chargestatesrCalc)):
-            ABIFTintegral += sum(ABIFTtemp[i])
-        print(ABIFTintegral)
-        for i in range(0, len(chargestatesrCalc)):
-            for j in range(0, len(ABIFTtemp[i])):
-                ABIFTtemp[i][j] = ABIFTtemp[i][j] / ABIFTintegral * msintegral
-            ABIFT.append(ABIFTtemp[i])
-    ############### Normalization of the IFFT Data ##########################
-    print (len(ABIFT))
-    Average = FinalAvg(ABIFT,len(chargestatesrCalc),msintegral)
+    Average = FinalAvg(np.concatenate(ABIFT, axis=0), cs, msintegral)
     return Average
 
 def FinalAvg(Average, cs, msintegral):
-    if len(Average) > cs:
-        print('1')
-        AverageNew = []
-        for i in range(0, len(Average) - cs):
-            Averagetemp = []
-            for j in range(0, (len(Average[0]))):
-                Averagetemp.append((Average[i][j] + Average[i + cs][j]) / 2)
-            AverageNew.append(Averagetemp)
-        print(AverageNew)
-        return FinalAvg(AverageNew, cs, msintegral)
-    else:
-        print('2')
-        ABIFTmax =[]
-        ABIFTintegral = 0
-        for i in range(0, cs):
-            ABIFTmax.append(max(Average[i]))
-
-        ABIFTmaxfinal = max(ABIFTmax)
-
-        for i in range(0, cs):
-            for j in range(0, len(Average[i])):
-                Average[i][j] = Average[i][j] / ABIFTmaxfinal
-
-        for i in range(0, cs):
-            ABIFTintegral += sum(Average[i])
-        for i in range(0, cs):
-            for j in range(0, len(Average[i])):
-                Average[i][j] = Average[i][j] / ABIFTintegral * msintegral
-        return Average
+    Average = np.asarray(Average)
+    # Repeatedly average each harmonic with the next one until only one set of charge states remains
+    while len(Average) > cs:
+        Average = (Average[:-cs] + Average[cs:]) / 2
+    return normalize_envelopes(Average, msintegral)
 
 def realdata(chargestatesr,expandedspan,submass,ftx,ftspacing,FT,y):
     omegafinal = expandedspan / submass * 2
-    ABIFT = []
-    ABIFTmax = []
-    ABIFTmaxfinal = 0
-    ABIFTintegral = 0
     msintegral = sum(y)
-    for i in range(0, len(chargestatesr)):
-        freqmax = (chargestatesr[i] + 1 / 2) * omegafinal
-        freqmin = (chargestatesr[i] - 1 / 2) * omegafinal
-        condition = np.logical_and((ftx / ftspacing) > freqmin, (ftx / ftspacing) < freqmax)
-        csdata = np.extract(condition, FT)  # extracts the FFT data from the FFT spectrum that are within 1/2
-        # the peak spacing of each maximum
-        extlen = np.size(csdata)
-        leftzeroes = np.ceil(freqmin)
-        rightzeroes = np.size(FT) - extlen - leftzeroes
-        paddedcsdata = np.lib.pad(csdata, (np.int_(leftzeroes), np.int_(rightzeroes)), 'constant',
-                                  constant_values=(0, 0))
-        IFT = np.fft.ifft(paddedcsdata)
-        ABIFT.append(np.real(IFT[int((len(IFT)) / 2):]))
-
-    ############### Normalization of the IFFT Data ##########################    for i in range(0, len(chargestatesr)):
-        ABIFTmax.append(max(ABIFT[i]))
-
-    ABIFTmaxfinal = max(ABIFTmax)
-
-    for i in range(0, len(chargestatesr)):
-        for j in range(0, len(ABIFT[i])):
-            ABIFT[i][j] = ABIFT[i][j] / ABIFTmaxfinal
-
-    for i in range(0, len(chargestatesr)):
-        for j in range(0, len(ABIFT[i])):
-            if ABIFT[i][j] >= 0:
-                ABIFTintegral += ABIFT[i][j]
-            else:
-                ABIFTintegral += 0
-    for i in range(0, len(chargestatesr)):
-        for j in range(0, len(ABIFT[i])):
-            ABIFT[i][j] = ABIFT[i][j] / ABIFTintegral * msintegral/2
+    # extracts the FFT data from the FFT spectrum that are within 1/2 the peak spacing of each maximum
+    ABIFT = np.real(window_ifft(chargestatesr, omegafinal, ftx, ftspacing, FT))
 
-    return ABIFT
+    ############### Normalization of the IFFT Data ##########################
+    ABIFT = ABIFT / np.amax(ABIFT)
+    ABIFTintegral = np.sum(np.clip(ABIFT, 0, None))
+    return ABIFT / ABIFTintegral * msintegral/2
 
 def inputmax(chargestaterCalc,submassCalc,ABFT,ftx):
     refmaxtab = []
@@ -1,12 +1,14 @@
 import time
 import os
 import numpy as np
+import h5py
 from pubsub import pub
 import wx
 from scipy.spatial.distance import cosine
 from unidec.modules import PlottingWindow, unidecstructure
 import unidec.tools as ud
 from unidec.metaunidec import mudstruct
+from unidec.metaunidec.packed_image import PackedImage
 
 __author__ = 'Michael.Marty'
 
@@ -40,6 +42,7 @@ class ImagingWindow(wx.Frame):
         self.exchoice = 2
         self.mass_extracted = None
         self.mz_extracted = None
+        self.packed = None
 
     def init(self, data, config=None):
         """
@@ -54,6 +57,9 @@ class ImagingWindow(wx.Frame):
         menu_open = filemenu.Append(wx.ID_ANY, "Open HDF5 File",
                                     "Open an HDF5 to view")
         self.Bind(wx.EVT_MENU, self.on_open_hdf5, menu_open)
+        menu_pack = filemenu.Append(wx.ID_ANY, "Convert imzML to Packed HDF5",
+                                    "Pack the pixels of an imzML file into an HDF5 file and view it")
+        self.Bind(wx.EVT_MENU, self.on_imzml_to_packed, menu_pack)
         menu_bar = wx.MenuBar()
         menu_bar.Append(filemenu, "&File")
 
@@ -130,6 +136,23 @@ class ImagingWindow(wx.Frame):
         self.data = data
         self.x = np.array(self.data.var1)
         self.y = np.array(self.data.var2)
+        self.mzdat = self.data.mzdat
+        self.packed = None
+        self.mass_extracted = None
+        self.mz_extracted = None
+
+    def init_packed(self, packed):
+        """
+        Use packed imaging data from PackedImage. There is only m/z data, and ion images are made by area.
+        :param packed: PackedImage
+        :return: None
+        """
+        self.packed = packed
+        self.x = np.array(self.packed.coords[:, 0])
+        self.y = np.array(self.packed.coords[:, 1])
+        self.mzdat = self.packed.sumdat
+        if self.mzdat is None:
+            self.mzdat = self.packed.sum_spectrum()
         self.mass_extracted = None
         self.mz_extracted = None
 
@@ -137,11 +160,12 @@ class ImagingWindow(wx.Frame):
         self.exchoice = self.ctletype.GetSelection()
 
     def load(self, e=None):
-        self.load_plot1()
+        if self.packed is None:
+            self.load_plot1()
         self.load_plot4()
 
     def load_plot4(self, e=None):
-        self.plot4.plotrefreshtop(self.data.mzdat[:, 0], self.data.mzdat[:, 1], xlabel="m/z (Th)",
+        self.plot4.plotrefreshtop(self.mzdat[:, 0], self.mzdat[:, 1], xlabel="m/z (Th)",
                                   ylabel="Intensity")
 
     def load_plot1(self, e=None):
@@ -150,6 +174,9 @@ class ImagingWindow(wx.Frame):
 
     def extract(self, e=None, erange=None, dtype="mass", plot=None, no_face=False):
         self.update()
+        if self.packed is not None:
+            self.extract_packed(erange=erange, dtype=dtype, plot=plot)
+            return
         if erange is None:
             erange = self.plot1.subplot1.get_xlim()
             self.load_plot1()
@@ -179,6 +206,25 @@ class ImagingWindow(wx.Frame):
         elif dtype == "mz":
             self.mz_extracted = self.exdata
 
+    def extract_packed(self, erange=None, dtype="mz", plot=None):
+        """
+        Make an ion image from packed data with the cumulative sums of each pixel.
+        :param erange: [min, max] m/z range
+        :param dtype: Only "mz" is available for packed data
+        :param plot: Plot for the image
+        :return: None
+        """
+        if dtype != "mz" or erange is None:
+            print("Packed imaging data only has m/z data")
+            return
+        if self.exchoice != 2:
+            print("Packed imaging data is extracted by area")
+        self.mzrange = erange
+        print("Extracting in Range:", erange)
+        self.exdata = self.packed.ion_image(erange)
+        self.image_plot(plot=plot)
+        self.mz_extracted = self.exdata
+
     def extract2(self, e=None):
         erange = self.plot3.subplot1.get_xlim()
         self.load_plot1()
@@ -198,6 +244,12 @@ class ImagingWindow(wx.Frame):
 
         ball = b1 * b2 * b3 * b4
 
+        if self.packed is not None:
+            regiondat2 = self.packed.sum_spectrum(pixels=ball, nbins=len(self.mzdat))
+            self.plot6.plotrefreshtop(regiondat2[:, 0], regiondat2[:, 1], xlabel="m/z (Th)", ylabel="Intensity")
+            self.region_mzdat = regiondat2
+            return
+
         regiondat = np.sum(self.data.massgrid[ball, :, 1], axis=0)
         regiondat = np.transpose([self.data.massdat[:, 0], regiondat])
         self.plot3.plotrefreshtop(regiondat[:, 0], regiondat[:, 1], xlabel="Mass (Da)", ylabel="Intensity")
@@ -221,17 +273,20 @@ class ImagingWindow(wx.Frame):
     def extract3(self, e=None):
         erange = self.plot4.subplot1.get_xlim()
         self.load_plot4()
-        self.plot4.add_rect(erange[0], 0, erange[1] - erange[0], np.amax(self.data.mzdat[:, 1]), facecolor="y")
+        self.plot4.add_rect(erange[0], 0, erange[1] - erange[0], np.amax(self.mzdat[:, 1]), facecolor="y")
         self.extract(erange=erange, dtype="mz", plot=self.plot5)
 
     def extract4(self, e=None):
         erange = self.plot6.subplot1.get_xlim()
         self.load_plot4()
-        self.plot4.add_rect(erange[0], 0, erange[1] - erange[0], np.amax(self.data.mzdat[:, 1]), facecolor="y")
+        self.plot4.add_rect(erange[0], 0, erange[1] - erange[0], np.amax(self.mzdat[:, 1]), facecolor="y")
         self.plot6.add_rect(erange[0], 0, erange[1] - erange[0], np.amax(self.region_mzdat[:, 1]), facecolor="y")
         self.extract(erange=erange, dtype="mz", plot=self.plot5)
 
     def plot_mz_values(self, e=None):
+        if self.packed is not None:
+            print("Packed imaging data has no mass data")
+            return
         print("Plotting mz")
         erange = self.massrange
         midpoint = np.mean(erange)
@@ -258,6 +313,12 @@ class ImagingWindow(wx.Frame):
                 print("Need HDF5 file")
                 return
         dlg.Destroy()
+        hdf = h5py.File(path, "r")
+        packed = "imaging" in hdf
+        hdf.close()
+        if packed:
+            self.open_packed(path)
+            return
         data = mudstruct.MetaDataSet(None)
         data.import_hdf5(path, speedy=True)
         data.import_grids()
@@ -265,6 +326,27 @@ class ImagingWindow(wx.Frame):
         self.load()
         self.extract()
 
+    def open_packed(self, path):
+        self.init_packed(PackedImage(path))
+        self.load()
+        self.extract3()
+
+    def on_imzml_to_packed(self, e=None):
+        dlg = wx.FileDialog(self, "Choose a data file in imzML format", '', "", "*.imzml*")
+        if dlg.ShowModal() == wx.ID_OK:
+            infile = dlg.GetPath()
+            dlg.Destroy()
+            if os.path.splitext(infile)[1].lower() != ".imzml":
+                print("Need imzml file")
+                return
+            outfile = os.path.splitext(infile)[0] + "_packed.hdf5"
+            print("Packing imzML file", infile, "to", outfile)
+            from unidec.metaunidec.imzml_reader import imzml_to_packed_hdf5
+            imzml_to_packed_hdf5(infile, outfile)
+            self.open_packed(outfile)
+        else:
+            dlg.Destroy()
+
     def on_cosine(self, event=None):
         print("Calculating Cosine Similarity")
         d1 = self.mass_extracted
@@ -5,6 +5,7 @@ from pyimzml.ImzMLWriter import ImzMLWriter
 import h5py
 import unidec.tools as ud
 from unidec.modules.hdf5_tools import replace_dataset
+from unidec.metaunidec.packed_image import write_packed_hdf5
 
 
 class Imzml_Reader:
@@ -22,12 +23,23 @@ class Imzml_Reader:
 
     def get_data(self):
         self.data = []
-        for idx, (x, y, z) in enumerate(self.coords):
-            mzs, intensities = self.msrun.getspectrum(idx)
-            self.data.append(np.transpose([mzs, intensities]))
+        for idx, coords, data in self.iter_spectra():
+            self.data.append(data)
         # self.data = np.array(self.data)
         return self.data
 
+    def iter_spectra(self):
+        """
+        Read the spectra one at a time.
+        :return: Generator of the index, coordinates, and data (N x 2) of each pixel
+        """
+        for idx, coords in enumerate(self.coords):
+            if len(self.data) > idx:
+                yield idx, coords, self.data[idx]
+            else:
+                mzs, intensities = self.msrun.getspectrum(idx)
+                yield idx, coords, np.transpose([mzs, intensities])
+
     def write_to_hdf5(self, outfile=None):
         if outfile is None:
             outfile = self.header + ".hdf5"
@@ -45,11 +57,8 @@ class Imzml_Reader:
         config = hdf.require_group("config")
         config.attrs["metamode"] = -1
 
-        if len(self.data)==0:
-            self.get_data()
         num = 0
-        for idx, (x, y, z) in enumerate(self.coords):
-            data = self.data[idx]
+        for idx, (x, y, z), data in self.iter_spectra():
             if not ud.isempty(data):
                 group = msdataset.require_group(str(idx))
                 replace_dataset(group, "raw_data", data=data)
@@ -63,6 +72,19 @@ class Imzml_Reader:
         msdataset.attrs["num"] = num
         hdf.close()
 
+    def write_packed_hdf5(self, outfile=None, chunksize=1048576):
+        """
+        Write all pixels into packed datasets in the "imaging" group, streaming spectra from the imzML file.
+        See packed_image.write_packed_hdf5 for the layout.
+        :param outfile: Output HDF5 file path. Default is the imzML file with a .hdf5 extension.
+        :param chunksize: Number of points to buffer before each write and the HDF5 chunk size
+        :return: None
+        """
+        if outfile is None:
+            outfile = self.header + ".hdf5"
+        write_packed_hdf5(outfile, self.iter_spectra(), chunksize=chunksize)
+
+
 def hdf5_to_imzml(path, outpath):
     from unidec.metaunidec.mudeng import MetaUniDec
     eng = MetaUniDec()
@@ -85,10 +107,14 @@ def hdf5_to_imzml(path, outpath):
 
 def imzml_to_hdf5(infile, outfile):
     r = Imzml_Reader(infile)
-    data = r.get_data()
     r.write_to_hdf5(outfile)
 
 
+def imzml_to_packed_hdf5(infile, outfile):
+    r = Imzml_Reader(infile)
+    r.write_packed_hdf5(outfile)
+
+
 if __name__ == '__main__':
     path = "C:\\Data\\Imaging\\UoB_RepairedRK_image_200x200um_proc\\RepairedRK_image_200x200um_proc.hdf5"
     outpath = "C:\\Data\\Imaging\\UoB_RepairedRK_image_200x200um_proc\\test.imzml"
@@ -38,6 +38,47 @@ def metaunidec_call(config, *args, **kwargs):
     return out
 
 
+def group_masses(masses, weights, window):
+    """
+    Group sorted masses. Each mass joins the current group if it is within the window of the weighted mean mass of the
+    group so far. Otherwise, it starts a new group.
+
+    Runs of masses with all gaps less than the window are found first, and only runs wider than the window are split
+    one mass at a time.
+    :param masses: Sorted array of masses
+    :param weights: Array of weights for each mass, such as peak heights
+    :param window: Mass window
+    :return: Array of the group index of each mass
+    """
+    n = len(masses)
+    starts = np.concatenate(([True], np.diff(masses) >= window))
+    groups = np.cumsum(starts) - 1
+    runstarts = np.flatnonzero(starts)
+    runends = np.append(runstarts[1:], n)
+    wide = masses[runends - 1] - masses[runstarts] >= window
+    if not np.any(wide):
+        return groups
+
+    g = -1
+    for start, end, w in zip(runstarts, runends, wide):
+        if not w:
+            g += 1
+            groups[start:end] = g
+            continue
+        for i in range(start, end):
+            if i == start or masses[i] - mean >= window:
+                g += 1
+                wsum = msum = sumall = count = 0.
+            wsum += weights[i]
+            msum += weights[i] * masses[i]
+            sumall += masses[i]
+            count += 1
+            # Use the plain average while the group has no weight
+            mean = msum / wsum if wsum != 0 else sumall / count
+            groups[i] = g
+    return groups
+
+
 class MetaUniDec(unidec_enginebase.UniDecEngine):
     def __init__(self):
         """
@@ -178,32 +219,51 @@ class MetaUniDec(unidec_enginebase.UniDecEngine):
             self.pks = peakstructure.Peaks()
 
     def combine_scanpeaks(self):
-        allpeaks = np.array([])
-        window = self.config.massbins * 2
-        for s in self.data.spectra:
-            for i, p in enumerate(s.peaks):
-                if len(allpeaks) > 0:
-                    masses = allpeaks[:, 0]
-                    adiff = np.abs(masses - p[0])
-                    if np.any(adiff < window):
-                        index = np.argmin(adiff)
-                        allpeaks[index, 1] += p[1]
-                        weighted_dscore = (p[1] * p[2] + allpeaks[index, 1] * allpeaks[index, 2]) / (
-                                p[1] + allpeaks[index, 1])
-                        allpeaks[index, 2] = weighted_dscore
-
-                        weighted_mass = (p[1] * p[0] + allpeaks[index, 1] * allpeaks[index, 0]) / (
-                                p[1] + allpeaks[index, 1])
-                        weighted_mass = ud.round_to_nearest(weighted_mass, self.config.massbins * 0.1)
-                        allpeaks[index, 0] = weighted_mass
+        """
+        Combine the peaks from each spectrum into a single list of peaks.
 
-                    else:
-                        index = len(allpeaks)
-                        allpeaks = np.append(allpeaks, [p], axis=0)
-                else:
-                    index = 0
-                    allpeaks = np.array([p])
-                s.pks.peaks[i].index = index
+        All peaks are sorted by mass once and grouped with group_masses, so each peak is within the window (2 mass bins)
+        of the height-weighted mass of its group. Each group has the summed height and the height-weighted mass and
+        DScore of its peaks.
+        The index of the group is stored in each peak of each spectrum.
+        :return: Array of combined peaks (mass, height, dscore)
+        """
+        window = self.config.massbins * 2
+        peaklist = []
+        owners = []
+        for j, s in enumerate(self.data.spectra):
+            if len(s.peaks) > 0:
+                peaklist.append(np.reshape(s.peaks, (len(s.peaks), -1))[:, :3])
+                owners.append(np.full(len(s.peaks), j))
+        if len(peaklist) == 0:
+            return np.array([])
+        peaklist = np.concatenate(peaklist).astype(float)
+        owners = np.concatenate(owners)
+
+        # Sort once and group the sorted masses
+        order = np.argsort(peaklist[:, 0], kind="stable")
+        groups = np.empty(len(order), dtype=int)
+        groups[order] = group_masses(peaklist[order, 0], peaklist[order, 1], window)
+        ngroups = groups.max() + 1
+
+        heights = np.bincount(groups, weights=peaklist[:, 1], minlength=ngroups)
+        counts = np.bincount(groups, minlength=ngroups)
+        wmass = np.bincount(groups, weights=peaklist[:, 0] * peaklist[:, 1], minlength=ngroups)
+        wdscore = np.bincount(groups, weights=peaklist[:, 2] * peaklist[:, 1], minlength=ngroups)
+        # Use the plain average for groups without any height
+        b1 = heights != 0
+        masses = np.where(b1, wmass / np.where(b1, heights, 1),
+                          np.bincount(groups, weights=peaklist[:, 0], minlength=ngroups) / counts)
+        dscores = np.where(b1, wdscore / np.where(b1, heights, 1),
+                           np.bincount(groups, weights=peaklist[:, 2], minlength=ngroups) / counts)
+        masses = ud.round_to_nearest(masses, self.config.massbins * 0.1)
+        allpeaks = np.transpose([masses, heights, dscores])
+
+        # Link the peaks in each spectrum to the combined peaks
+        positions = 0
+        for j, s in enumerate(self.data.spectra):
+            s.pks.set_values("index", groups[positions:positions + s.pks.plen])
+            positions += len(s.peaks)
 
         if self.config.peaknorm == 1:
             allpeaks[:, 1] /= np.amax(allpeaks[:, 1])
@@ -220,38 +280,34 @@ class MetaUniDec(unidec_enginebase.UniDecEngine):
             self.out = metaunidec_call(self.config, "-scanpeaks")
             self.data.import_hdf5()
 
+        # Sum the heights of the peaks in each spectrum that are linked to each combined peak
+        indexes = []
+        columns = []
+        heights = []
+        for j, s in enumerate(self.data.spectra):
+            for p2 in s.pks.peaks:
+                indexes.append(p2.index)
+                columns.append(j)
+                heights.append(p2.height)
         self.data.exgrid = np.zeros((len(self.pks.peaks), len(self.data.spectra)))
-        for i, p in enumerate(self.pks.peaks):
-            for j, s in enumerate(self.data.spectra):
-                ints = 0
-                for p2 in s.pks.peaks:
-                    if p2.index == i:
-                        ints += p2.height
-                self.data.exgrid[i, j] = ints
+        indexes = np.array(indexes, dtype=int)
+        b1 = (indexes >= 0) & (indexes < len(self.pks.peaks))
+        np.add.at(self.data.exgrid, (indexes[b1], np.array(columns, dtype=int)[b1]), np.array(heights)[b1])
 
         self.normalize_exgrid()
 
     def normalize_exgrid(self):
         print(self.config.exnorm)
-        if self.config.exnorm == 3:
-            for i in range(0, len(self.data.exgrid)):
-                if np.amax(self.data.exgrid[i]) != 0:
-                    self.data.exgrid[i] /= np.amax(self.data.exgrid[i])
-
-        if self.config.exnorm == 4:
-            for i in range(0, len(self.data.exgrid)):
-                if np.amax(self.data.exgrid[i]) != 0:
-                    self.data.exgrid[i] /= np.sum(self.data.exgrid[i])
-
-        if self.config.exnorm == 1:
-            for i in range(0, len(self.data.exgrid[0])):
-                if np.amax(self.data.exgrid[:, i]) != 0:
-                    self.data.exgrid[:, i] /= np.amax(self.data.exgrid[:, i])
-
-        if self.config.exnorm == 2:
-            for i in range(0, len(self.data.exgrid[0])):
-                if np.amax(self.data.exgrid[:, i]) != 0:
-                    self.data.exgrid[:, i] /= np.sum(self.data.exgrid[:, i])
+        exgrid = self.data.exgrid
+        if self.config.exnorm in [1, 2, 3, 4] and len(exgrid) > 0:
+            # Normalize each peak (3 and 4) or each spectrum (1 and 2) by its max or its sum
+            axis = 1 if self.config.exnorm in [3, 4] else 0
+            maxes = np.amax(exgrid, axis=axis, keepdims=True)
+            if self.config.exnorm in [1, 3]:
+                norms = maxes
+            else:
+                norms = np.sum(exgrid, axis=axis, keepdims=True)
+            np.divide(exgrid, norms, out=exgrid, where=maxes != 0)
 
         for i, p in enumerate(self.pks.peaks):
             p.extracts = self.data.exgrid[i]
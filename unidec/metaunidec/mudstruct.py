@@ -202,9 +202,10 @@ class MetaDataSet:
         print("Adding:", name, "to", self.topname)
         snew = Spectrum(self.topname, self.len, self.eng)
         snew.rawdata = data
-        snew.data2 = deepcopy(data)
+        snew.data2 = data
         if self.eng.config.datanorm == 1:
             try:
+                snew.data2 = np.array(data)
                 snew.data2[:, 1] /= np.amax(snew.data2[:, 1])
             except:
                 pass
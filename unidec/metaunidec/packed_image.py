@@ -0,0 +1,232 @@
+import numpy as np
+import h5py
+
+__author__ = 'Michael.Marty'
+
+'''
+Packed storage for imaging data. All pixels are stored in a few chunked datasets in the "imaging" group
+rather than one group per pixel, and ion images are made from cumulative sums read in blocks of pixels.
+'''
+
+
+def write_packed_hdf5(outfile, spectra, chunksize=1048576, nbins=10000):
+    """
+    Write all pixels into a few packed datasets in the "imaging" group, rather than one group per pixel.
+
+    The m/z values, intensities, and the cumulative sum of the intensities within each pixel are concatenated
+    into chunked datasets. The start of each pixel is stored in "offsets" (with the total length at the end) and
+    its position in "coords". Spectra are written in blocks as they are read. The summed spectrum of all pixels
+    is stored in "sum" so that it does not need to be rebuilt each time the file is opened.
+    :param outfile: Output HDF5 file path
+    :param spectra: Iterable of the index, (x, y, z) coordinates, and data (N x 2) of each pixel
+    :param chunksize: Number of points to buffer before each write and the HDF5 chunk size
+    :param nbins: Number of bins in the summed spectrum
+    :return: None
+    """
+    hdf = h5py.File(outfile, "a")
+    try:
+        del hdf["imaging"]
+    except:
+        pass
+    imaging = hdf.require_group("imaging")
+    datasets = {}
+    for name in ["mz", "intensity", "cumulative"]:
+        datasets[name] = imaging.create_dataset(name, shape=(0,), maxshape=(None,), dtype=float,
+                                                chunks=(chunksize,))
+
+    offsets = [0]
+    coords = []
+    buffer = {"mz": [], "intensity": [], "cumulative": []}
+    nbuffer = 0
+    mzmin, mzmax = np.inf, -np.inf
+    for idx, (x, y, z), data in spectra:
+        data = np.reshape(data, (-1, 2))
+        buffer["mz"].append(data[:, 0])
+        buffer["intensity"].append(data[:, 1])
+        buffer["cumulative"].append(np.cumsum(data[:, 1]))
+        offsets.append(offsets[-1] + len(data))
+        coords.append([int(x), int(y), int(z)])
+        if len(data) > 0:
+            mzmin = min(mzmin, np.amin(data[:, 0]))
+            mzmax = max(mzmax, np.amax(data[:, 0]))
+        nbuffer += len(data)
+        if nbuffer >= chunksize:
+            write_buffer(datasets, buffer)
+            nbuffer = 0
+    write_buffer(datasets, buffer)
+
+    imaging.create_dataset("offsets", data=np.array(offsets, dtype=np.int64))
+    imaging.create_dataset("coords", data=np.array(coords, dtype=int).reshape(-1, 3))
+    imaging.attrs["num"] = len(coords)
+    if mzmin > mzmax:
+        # No points in any pixel
+        mzmin, mzmax = 0, 1
+    imaging.attrs["mzmin"] = mzmin
+    imaging.attrs["mzmax"] = mzmax
+    hdf.close()
+
+    sumdat = PackedImage(outfile).sum_spectrum(nbins=nbins)
+    hdf = h5py.File(outfile, "a")
+    hdf["imaging"].create_dataset("sum", data=sumdat)
+    hdf.close()
+
+
+def write_buffer(datasets, buffer):
+    """
+    Append buffered arrays to resizable datasets and empty the buffer.
+    :param datasets: Dictionary of HDF5 datasets
+    :param buffer: Dictionary of lists of arrays, with the same keys as datasets
+    :return: None
+    """
+    for name, dataset in datasets.items():
+        if len(buffer[name]) == 0:
+            continue
+        values = np.concatenate(buffer[name])
+        start = len(dataset)
+        dataset.resize((start + len(values),))
+        dataset[start:] = values
+        buffer[name] = []
+
+
+def segment_searchsorted(values, offsets, targets, side="left"):
+    """
+    Run searchsorted within each segment of a packed array at once.
+    :param values: Concatenated values, sorted within each segment
+    :param offsets: Start of each segment, with the total length at the end
+    :param targets: Value to search for in each segment, or a single value for all segments
+    :param side: "left" or "right", as in np.searchsorted
+    :return: Index in values for each segment
+    """
+    lo = np.array(offsets[:-1], dtype=np.int64)
+    hi = np.array(offsets[1:], dtype=np.int64)
+    targets = np.broadcast_to(targets, lo.shape)
+    # Bisect all segments together
+    while True:
+        active = lo < hi
+        if not np.any(active):
+            break
+        mid = (lo + hi) // 2
+        midvals = values[np.where(active, mid, 0)]
+        if side == "left":
+            goright = active & (midvals < targets)
+        else:
+            goright = active & (midvals <= targets)
+        lo = np.where(goright, mid + 1, lo)
+        hi = np.where(active & ~goright, mid, hi)
+    return lo
+
+
+def pixel_blocks(offsets, blocksize):
+    """
+    Split the pixels into blocks of whole pixels with about blocksize points each.
+    A pixel with more than blocksize points is a block on its own.
+    :param offsets: Start of each pixel, with the total length at the end
+    :param blocksize: Number of points in each block
+    :return: List of (first pixel, last pixel + 1) for each block
+    """
+    blocks = []
+    start = 0
+    num = len(offsets) - 1
+    while start < num:
+        end = np.searchsorted(offsets, offsets[start] + blocksize, side="right") - 1
+        end = min(max(end, start + 1), num)
+        blocks.append((start, end))
+        start = end
+    return blocks
+
+
+class PackedImage:
+    def __init__(self, path, blocksize=4194304):
+        """
+        Open imaging data packed by write_packed_hdf5.
+        Only the offsets and coordinates of the pixels are loaded. The m/z values and intensities are read from
+        the file in blocks of pixels when they are needed.
+        :param path: HDF5 file path
+        :param blocksize: Number of points to read at a time
+        """
+        self.path = path
+        self.blocksize = blocksize
+        hdf = h5py.File(path, "r")
+        imaging = hdf["imaging"]
+        self.offsets = imaging["offsets"][()]
+        self.coords = imaging["coords"][()]
+        self.mzmin = imaging.attrs["mzmin"]
+        self.mzmax = imaging.attrs["mzmax"]
+        if "sum" in imaging:
+            self.sumdat = imaging["sum"][()]
+        else:
+            self.sumdat = None
+        hdf.close()
+        self.num = len(self.coords)
+
+    def get_spectrum(self, index):
+        """
+        Get the spectrum for one pixel.
+        :param index: Pixel index
+        :return: Data array (N x 2)
+        """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        hdf = h5py.File(self.path, "r")
+        mz = hdf["imaging/mz"][start:end]
+        intensities = hdf["imaging/intensity"][start:end]
+        hdf.close()
+        return np.transpose([mz, intensities])
+
+    def ion_image(self, mzrange):
+        """
+        Sum the intensity of each pixel within an m/z range from the cumulative sums.
+        :param mzrange: [min, max] m/z range, inclusive
+        :return: Array of total intensity in the range for each pixel
+        """
+        return self.ion_images([mzrange])[0]
+
+    def ion_images(self, mzranges):
+        """
+        Make ion images for several m/z ranges. Each block of pixels is read once for all of the ranges.
+        :param mzranges: List of [min, max] m/z ranges
+        :return: Array of ion images (ranges x pixels)
+        """
+        images = np.zeros((len(mzranges), self.num))
+        hdf = h5py.File(self.path, "r")
+        for start, end in pixel_blocks(self.offsets, self.blocksize):
+            first, last = self.offsets[start], self.offsets[end]
+            if last == first:
+                continue
+            mz = hdf["imaging/mz"][first:last]
+            cumulative = hdf["imaging/cumulative"][first:last]
+            offsets = self.offsets[start:end + 1] - first
+            starts = offsets[:-1]
+            for i, mzrange in enumerate(mzranges):
+                lo = segment_searchsorted(mz, offsets, mzrange[0], side="left")
+                hi = segment_searchsorted(mz, offsets, mzrange[1], side="right")
+                # The cumulative sums start over in each pixel, so the sum before the first point of a pixel is 0
+                upper = np.where(hi > starts, cumulative[np.clip(hi - 1, 0, None)], 0)
+                lower = np.where(lo > starts, cumulative[np.clip(lo - 1, 0, None)], 0)
+                images[i, start:end] = upper - lower
+        hdf.close()
+        return images
+
+    def sum_spectrum(self, pixels=None, nbins=10000):
+        """
+        Sum the spectra of the pixels onto a common m/z axis with nbins bins.
+        :param pixels: Boolean array or indexes of the pixels to sum. None for all pixels.
+        :param nbins: Number of bins from the smallest to the largest m/z
+        :return: Data array (nbins x 2) of the bin centers and summed intensities
+        """
+        edges = np.linspace(self.mzmin, self.mzmax, nbins + 1)
+        total = np.zeros(nbins)
+        selected = np.ones(self.num, dtype=bool)
+        if pixels is not None:
+            selected = np.zeros(self.num, dtype=bool)
+            selected[pixels] = True
+        hdf = h5py.File(self.path, "r")
+        for start, end in pixel_blocks(self.offsets, self.blocksize):
+            if not np.any(selected[start:end]):
+                continue
+            first, last = self.offsets[start], self.offsets[end]
+            mz = hdf["imaging/mz"][first:last]
+            intensities = hdf["imaging/intensity"][first:last]
+            weights = np.repeat(selected[start:end], np.diff(self.offsets[start:end + 1])) * intensities
+            total += np.histogram(mz, bins=edges, weights=weights)[0]
+        hdf.close()
+        return np.transpose([(edges[1:] + edges[:-1]) / 2., total])
@@ -13,9 +13,9 @@ import unidec.tools as ud
 import h5py
 from unidec.modules.hdf5_tools import replace_dataset, get_dataset
 from unidec.metaunidec import mudeng
+from unidec.metaunidec import ultrameta_backend as umback
 from unidec import MetaUniDec as mudpres
 from unidec.metaunidec.gui_elements.um_list_ctrl import *
-import threading
 import numpy as np
 import wx
 
@@ -235,6 +235,10 @@ class DataCollector(wx.Frame):
         self.topname = "ms_dataset"
         self.configname = "config"
         self.removezeros = False
+        # Worker processes for extraction (None for the number of CPUs) and directory for the summary caches (None to
+        # put them next to each file)
+        self.nworkers = None
+        self.cachedir = None
 
         self.update_set(0)
         self.Centre()
@@ -438,19 +442,8 @@ class DataCollector(wx.Frame):
             if not os.path.isfile(path):
                 print("Error2: File Not Found:", path)
                 return
-            hdf = h5py.File(path, 'a')
-            h5_config = hdf.require_group("config")
-            h5_config.attrs.modify("exnorm", self.config.exnorm)
-            h5_config.attrs.modify("exnormz", self.config.exnormz)
-            h5_config.attrs.modify("exchoice", self.config.exchoice)
-            h5_config.attrs.modify("exchoicez", self.config.exchoicez)
-            h5_config.attrs.modify("exwindow", self.config.exwindow)
-            h5_config.attrs.modify("exthresh", self.config.exthresh)
-
-            pdataset = hdf.require_group("/peaks")
-            ultrapeakdata = np.array([int(x[1]) for x in self.xvals])
-            replace_dataset(pdataset, "ultrapeakdata", data=ultrapeakdata)
-            hdf.close()
+            params = umback.extract_params(self.config, [int(x[1]) for x in self.xvals])
+            umback.write_params(path, params)
 
             self.run_hdf5(path)
         except Exception as e:
@@ -497,20 +490,32 @@ class DataCollector(wx.Frame):
             path = y[0]
             if self.localpath == 1:
                 path = os.path.join(self.directory, path)
+            if not os.path.isfile(path):
+                path2 = os.path.join(self.directory, path)
+                if os.path.isfile(path2):
+                    path = path2
+                    self.localpath = 1
+                    print("Switching to local path mode")
+                else:
+                    print("Error4: File Not Found:", path)
+                    return
             paths.append(path)
 
         if fit is None:
-            if False:
-                threads = []
-                for p in paths:
-                    t = threading.Thread(target=self.update_hdf5, args=(p,))
-                    threads.append(t)
-                    t.start()
-                for t in threads:
-                    t.join()
-            else:
-                for p in paths:
-                    self.update_hdf5(p)
+            params = umback.extract_params(self.config, [int(x[1]) for x in self.xvals])
+        else:
+            params = None
+        summaries = umback.process_files(paths, self.config, params=params, topname=self.topname,
+                                         v1name=self.v1name, cachedir=self.cachedir, nworkers=self.nworkers)
+        for path, summary in summaries.items():
+            if summary is None:
+                self.SetStatusText("ERROR with File: " + path, number=2)
+                print("Error5: Unable to process file:", path)
+                return
+        if any(s["v1found"] for s in summaries.values()):
+            self.ylabel = self.v1name
+        elif any(s["cvfound"] for s in summaries.values()) and self.ylabel == "":
+            self.ylabel = "Collision Voltage"
         print("Total Execution Time: %.2gs" % (time.perf_counter() - tstart))
         for x in self.xvals:
             print(x)
@@ -543,87 +548,29 @@ class DataCollector(wx.Frame):
                 extracts = []
                 zexts = []
                 xvalsall = []
-                for y in self.yvals:
+                for y, path in zip(self.yvals, paths):
                     label = y[3]
                     if label == u:
-                        path = y[0]
-                        if self.localpath == 1:
-                            path = os.path.join(self.directory, path)
-                        if not os.path.isfile(path):
-                            path2 = os.path.join(self.directory, path)
-                            if os.path.isfile(path2):
-                                path = path2
-                                self.localpath = 1
-                                print("Switching to local path mode")
-                            else:
-                                print("Error4: File Not Found:", path)
-                                return
                         color = y[1]
                         linestyle = y[2]
                         print(path, u, index, marker, linestyle)
                         self.hdf5_file = path
-
-                        hdf = h5py.File(path, "r")
-
-                        msdata1 = hdf.require_group(self.topname)
-                        self.len = msdata1.attrs["num"]
-
-                        xvals = []
-                        zdat = []
-                        for f in np.arange(0, self.len):
-                            msdata = hdf.get(self.topname + "/" + str(f))
-                            self.attrs = dict(list(msdata.attrs.items()))
-                            if self.v1name in list(self.attrs.keys()):
-                                var1 = self.attrs[self.v1name]
-                                self.ylabel = self.v1name
-                            elif "var1" in list(self.attrs.keys()):
-                                var1 = self.attrs["var1"]
-                            elif "Variable 1" in list(self.attrs.keys()):
-                                var1 = self.attrs["Variable 1"]
-                            elif "collision_voltage" in list(self.attrs.keys()):
-                                var1 = self.attrs["collision_voltage"]
-                                if self.ylabel == "":
-                                    self.ylabel = "Collision Voltage"
-                            elif "Collision Voltage" in list(self.attrs.keys()):
-                                var1 = self.attrs["Collision Voltage"]
-                                if self.ylabel == "":
-                                    self.ylabel = "Collision Voltage"
-                            else:
-                                var1 = f
-
-                            try:
-                                var1 = float(var1)
-                            except:
-                                var1 = f
-
-                            zdata = get_dataset(msdata, "charge_data")
-                            try:
-                                zdata[:, 1] /= np.amax(zdata[:, 1])
-                                zval = ud.center_of_mass(zdata)[0]
-
-                            except:
-                                print("ERROR with Zdata")
-                                print(zdata)
-                                zval = 0
-                                pass
-                            zdat.append(zval)
-                            xvals.append(var1)
-                        xvalsall.append(xvals)
-                        pdataset = hdf.require_group("/peaks")
+                        summary = summaries[path]
+                        self.len = len(summary["xvals"])
+                        xvalsall.append(list(summary["xvals"]))
                         # Get the peaks back in
-                        ultrapeaks = get_dataset(pdataset, "ultrapeakdata")
+                        ultrapeaks = summary["ultrapeaks"]
                         peak = np.argwhere(ultrapeaks == index)[0][0]
 
                         try:
-                            exz = get_dataset(pdataset, "ultrazextracts")[:, peak]
+                            exz = summary["zextracts"][:, peak]
                         except Exception as e:
                             print(e)
-                            exz = zdat
+                            exz = summary["zvals"]
                         zexts.append(exz)
 
-                        ex = get_dataset(pdataset, "ultraextracts")[:, peak]
+                        ex = summary["extracts"][:, peak]
                         extracts.append(ex)
-                        hdf.close()
 
                 if not ud.isempty(xvalsall) and not ud.isempty(extracts):
                     extracts = np.array(extracts)
@@ -0,0 +1,251 @@
+import os
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import h5py
+import unidec.tools as ud
+from unidec.modules.hdf5_tools import replace_dataset, get_dataset
+from unidec.metaunidec import mudeng
+
+__author__ = 'michael.marty'
+
+'''
+Backend for UltraMeta that runs the extractions and reads the results for many MetaUniDec HDF5 files without the GUI.
+
+Each file is handled by a worker in a pool of processes. A worker writes the extraction parameters to the file, runs
+the -ultraextract step, and reads back a summary with only the values needed to compare files:
+xvals: Variable 1 of each spectrum
+zvals: Charge state center of mass of each spectrum
+ultrapeaks: Peak values that were extracted
+extracts, zextracts: Mass and charge extracts (spectra x peaks). zextracts is empty if not in the file.
+v1found, cvfound: Whether the Variable 1 name or the collision voltage were found in the spectrum attributes
+
+The summary is cached on disk next to each file along with the modification time of the file and the extraction
+parameters. If the file has not changed since, the extraction is skipped and the summary is read from the cache.
+'''
+
+extract_keys = ["exnorm", "exnormz", "exchoice", "exchoicez", "exwindow", "exthresh"]
+summary_keys = ["xvals", "zvals", "ultrapeaks", "extracts", "zextracts"]
+
+
+def extract_params(config, peakindexes):
+    """
+    Get the extraction parameters that are written to each file.
+    :param config: UniDecConfig object
+    :param peakindexes: List of peak indexes to extract
+    :return: Dictionary of parameters
+    """
+    params = {k: getattr(config, k) for k in extract_keys}
+    params = {k: v.item() if isinstance(v, np.generic) else v for k, v in params.items()}
+    params["ultrapeakdata"] = [int(i) for i in peakindexes]
+    return params
+
+
+def write_params(path, params):
+    """
+    Write the extraction parameters to the config attributes and the peak indexes to the peaks group of a file.
+    :param path: Path to the HDF5 file
+    :param params: Dictionary from extract_params
+    :return: None
+    """
+    hdf = h5py.File(path, 'a')
+    h5_config = hdf.require_group("config")
+    for k in extract_keys:
+        h5_config.attrs.modify(k, params[k])
+    pdataset = hdf.require_group("/peaks")
+    replace_dataset(pdataset, "ultrapeakdata", data=np.array(params["ultrapeakdata"]))
+    hdf.close()
+
+
+def read_summary(path, topname="ms_dataset", v1name="Variable 1"):
+    """
+    Read the values needed by UltraMeta from a file. Only the attributes and charge data of each spectrum and the
+    extracts in the peaks group are read.
+    :param path: Path to the HDF5 file
+    :param topname: Name of the group with the spectra
+    :param v1name: Name of the Variable 1 attribute
+    :return: Summary dictionary
+    """
+    hdf = h5py.File(path, "r")
+    msdata1 = hdf.require_group(topname)
+    num = msdata1.attrs["num"]
+    xvals = []
+    zdat = []
+    v1found = False
+    cvfound = False
+    for f in np.arange(0, num):
+        msdata = hdf.get(topname + "/" + str(f))
+        attrs = msdata.attrs
+        if v1name in attrs:
+            var1 = attrs[v1name]
+            v1found = True
+        elif "var1" in attrs:
+            var1 = attrs["var1"]
+        elif "Variable 1" in attrs:
+            var1 = attrs["Variable 1"]
+        elif "collision_voltage" in attrs:
+            var1 = attrs["collision_voltage"]
+            cvfound = True
+        elif "Collision Voltage" in attrs:
+            var1 = attrs["Collision Voltage"]
+            cvfound = True
+        else:
+            var1 = f
+
+        try:
+            var1 = float(var1)
+        except:
+            var1 = f
+
+        zdata = get_dataset(msdata, "charge_data")
+        try:
+            zdata[:, 1] /= np.amax(zdata[:, 1])
+            zval = ud.center_of_mass(zdata)[0]
+        except:
+            print("ERROR with Zdata")
+            print(zdata)
+            zval = 0
+        zdat.append(zval)
+        xvals.append(var1)
+
+    pdataset = hdf.require_group("/peaks")
+    summary = {"xvals": np.array(xvals, dtype=float), "zvals": np.array(zdat, dtype=float),
+               "ultrapeaks": get_dataset(pdataset, "ultrapeakdata"),
+               "extracts": get_dataset(pdataset, "ultraextracts"),
+               "zextracts": get_dataset(pdataset, "ultrazextracts"),
+               "v1found": v1found, "cvfound": cvfound}
+    hdf.close()
+    return summary
+
+
+def cache_path(path, cachedir=None):
+    """
+    Get the path of the summary cache for a file.
+    :param path: Path to the HDF5 file
+    :param cachedir: Directory for the cache. Default is None, which puts it next to the file.
+    :return: Path to the cache file
+    """
+    if cachedir is None:
+        return os.path.splitext(path)[0] + "_umsummary.npz"
+    name = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(cachedir, name + "_umsummary.npz")
+
+
+def file_stamp(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def load_cache(path, key, cachedir=None):
+    """
+    Load the cached summary for a file if the file has not changed since it was cached.
+    :param path: Path to the HDF5 file
+    :param key: Dictionary of settings that must match the cached settings
+    :param cachedir: Directory for the cache
+    :return: Summary dictionary and cached settings, or None, None if there is no matching cache
+    """
+    cfile = cache_path(path, cachedir)
+    if not os.path.isfile(cfile):
+        return None, None
+    try:
+        with np.load(cfile, allow_pickle=False) as npz:
+            info = json.loads(str(npz["info"]))
+            if info["stamp"] != file_stamp(path) or any(info["key"].get(k) != v for k, v in key.items()):
+                return None, None
+            summary = {k: npz[k] for k in summary_keys}
+    except Exception as e:
+        print("Unable to read summary cache:", cfile, e)
+        return None, None
+    summary["v1found"] = info["v1found"]
+    summary["cvfound"] = info["cvfound"]
+    return summary, info["key"]
+
+
+def save_cache(path, summary, key, cachedir=None):
+    """
+    Save a summary for a file with the current modification time of the file.
+    :param path: Path to the HDF5 file
+    :param summary: Summary dictionary from read_summary
+    :param key: Dictionary of settings to save with the summary
+    :param cachedir: Directory for the cache
+    :return: None
+    """
+    cfile = cache_path(path, cachedir)
+    info = {"stamp": file_stamp(path), "key": key, "v1found": summary["v1found"], "cvfound": summary["cvfound"]}
+    try:
+        if cachedir is not None and not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        with open(cfile, "wb") as f:
+            np.savez(f, info=json.dumps(info), **{k: summary[k] for k in summary_keys})
+    except Exception as e:
+        print("Unable to write summary cache:", cfile, e)
+
+
+def process_file(path, config, params=None, topname="ms_dataset", v1name="Variable 1", cachedir=None):
+    """
+    Run the extraction on a file if needed and read its summary.
+    :param path: Path to the HDF5 file
+    :param config: UniDecConfig object with UniDecPath set
+    :param params: Dictionary from extract_params. None to only read the file without running the extraction.
+    :param topname: Name of the group with the spectra
+    :param v1name: Name of the Variable 1 attribute
+    :param cachedir: Directory for the summary cache
+    :return: Summary dictionary, or None if the file was not found or failed
+    """
+    if not os.path.isfile(path):
+        print("Error2: File Not Found:", path)
+        return None
+    key = {"topname": topname, "v1name": v1name}
+    summary, cachedkey = load_cache(path, key, cachedir)
+    if params is not None and (summary is None or cachedkey.get("params") != params):
+        summary = None
+        try:
+            write_params(path, params)
+            print("Running MetaUniDec -ultraextract", path)
+            out = mudeng.metaunidec_call(config, "-ultraextract", path=path)
+            if out != 0:
+                print("ERROR C: File", path, out)
+                return None
+        except Exception as e:
+            print("ERROR Python: File", path, e)
+            return None
+        key["params"] = params
+    elif summary is not None:
+        return summary
+
+    try:
+        summary = read_summary(path, topname=topname, v1name=v1name)
+    except Exception as e:
+        print("ERROR reading file:", path, e)
+        return None
+    save_cache(path, summary, key, cachedir)
+    return summary
+
+
+def process_files(paths, config, params=None, topname="ms_dataset", v1name="Variable 1", cachedir=None,
+                  nworkers=None):
+    """
+    Run the extraction on each file if needed and read the summaries, with a pool of worker processes.
+    :param paths: List of paths to HDF5 files
+    :param config: UniDecConfig object with UniDecPath set
+    :param params: Dictionary from extract_params. None to only read the files.
+    :param topname: Name of the group with the spectra
+    :param v1name: Name of the Variable 1 attribute
+    :param cachedir: Directory for the summary cache. Default is None, which puts each cache next to its file.
+    :param nworkers: Number of worker processes. Default is the number of CPUs. If 1, runs in this process.
+    :return: Dictionary of summaries from process_file for each unique path
+    """
+    upaths = list(dict.fromkeys(paths))
+    if nworkers is None:
+        nworkers = multiprocessing.cpu_count()
+    nworkers = min(nworkers, len(upaths))
+    args = (config, params, topname, v1name, cachedir)
+    if nworkers <= 1:
+        results = [process_file(p, *args) for p in upaths]
+    else:
+        with ProcessPoolExecutor(max_workers=nworkers) as executor:
+            futures = [executor.submit(process_file, p, *args) for p in upaths]
+            results = [f.result() for f in futures]
+    return dict(zip(upaths, results))
@@ -194,10 +194,10 @@ class UniDecCD(engine.UniDec):
             self.invinjtime = 1. / self.it
 
         elif extension.lower() == ".i2ms" or extension.lower() == ".dmt":
-            # Import Thermo Raw file using ThermoDataImporter
-            self.I2MSI = i2ms_importer.I2MSImporter(self.path)
+            # Import i2MS or DMT file using I2MSImporter, filtering the pre-threshold in the SQL query
+            self.I2MSI = i2ms_importer.I2MSImporter(self.path, threshold=self.config.CDprethresh)
             # Get the data
-            data = self.I2MSI.grab_data(threshold=self.config.CDprethresh)
+            data = self.I2MSI.grab_data()
             mz = data[:, 0]
             intensity = data[:, 1]
             # Get the scans
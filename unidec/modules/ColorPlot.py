@@ -8,6 +8,7 @@ import matplotlib.colorbar as colorbar
 
 from unidec.modules.PlottingWindow import PlottingWindowBase
 from unidec.tools import color_map_array
+from unidec.modules.gridlod import GridPyramid
 
 '''
 # These functions are getting pulled from unidectools. You can uncomment this to avoid having to import them.
@@ -114,14 +115,30 @@ class ColorPlot2D(PlottingWindowBase):
                              extent=extent, norm=normalization, aspect='auto')
         self.subplot1.set_title("Deconvolution in m/z vs. Arrival Time")
 
-        # Loop through each charge state and make the color plot to layer on top of the black background
-        for i in range(0, zlen):
-            #cm.register_cmap(cmap=, name="newcmap")
-            grid_slice = np.sqrt(mzgrid[:, :, i])
-            normalization = cm.colors.Normalize(vmax=0.5, vmin=0.00)
-            self.subplot1.imshow(np.transpose(grid_slice), origin="lower", cmap=cmarr[i], extent=extent,
-                                 norm=normalization,
-                                 aspect='auto')
+        def draw(mzax, dtax, mzgrid):
+            if len(mzax) > 1 and len(dtax) > 1:
+                xdiff = mzax[1] - mzax[0]
+                ydiff = dtax[1] - dtax[0]
+                extent = (min(mzax) - 0.5 * xdiff, max(mzax) + 0.5 * xdiff, min(dtax) - 0.5 * ydiff,
+                          max(dtax) + 0.5 * ydiff)
+            else:
+                extent = None
+            images = []
+            # Loop through each charge state and make the color plot to layer on top of the black background
+            for i in range(0, zlen):
+                #cm.register_cmap(cmap=, name="newcmap")
+                grid_slice = np.sqrt(mzgrid[:, :, i])
+                normalization = cm.colors.Normalize(vmax=0.5, vmin=0.00)
+                images.append(self.subplot1.imshow(np.transpose(grid_slice), origin="lower", cmap=cmarr[i],
+                                                   extent=extent, norm=normalization, aspect='auto'))
+            return images
+
+        # Draw large grids at screen resolution, with finer levels drawn on zoom
+        width, height = self.lod_size()
+        if self.lod and (len(mzax) >= 2 * width or len(dtax) >= 2 * height):
+            self.setup_lod(GridPyramid(mzax, dtax, mzgrid), draw)
+        else:
+            draw(mzax, dtax, mzgrid)
 
         # Labels and legends
         self.subplot1.set_xlabel("m/z (Th)")
@@ -4,6 +4,7 @@ import matplotlib.pyplot as plt
 import unidec.tools as ud
 from copy import deepcopy
 from scipy import fftpack
+import scipy.fft
 import scipy.stats as stats
 
 '''
@@ -40,6 +41,56 @@ def make_kernel(data):
     return output
 
 
+def prep_kernel(kernel, length):
+    """
+    Normalize the kernel, pad it to the data length, and shift its max to the first point.
+    :param kernel: Kernel data (N x 2)
+    :param length: Length of the data
+    :return: Kernel intensities ready for dd_stack
+    """
+    kernel = np.array(kernel, dtype=float)
+    try:
+        kernel[:, 1] /= np.amax(kernel[:, 1])
+    except:
+        kernel /= np.amax(kernel)
+    if length > len(kernel):
+        kernel = ud.pad_data_length(kernel, pad_until_length=length)
+    return make_kernel(kernel)
+
+
+def dd_stack(stack, kernel, maxiter=50, tolerance=0.0001):
+    """
+    Richardson-Lucy deconvolution of a stack of spectra with the same kernel.
+
+    The kernel FFTs are computed once, and each iteration is a batched FFT along the mass axis over the spectra that
+    have not yet converged. Each spectrum stops on the same criteria as a single run.
+    :param stack: Intensities (S x N)
+    :param kernel: Kernel from prep_kernel (N)
+    :param maxiter: Maximum number of iterations
+    :param tolerance: Convergence criteria for the relative change in each spectrum
+    :return: Deconvolved intensities, each normalized to a max of 1 (S x N)
+    """
+    stack = np.array(stack, dtype=float)
+    n = stack.shape[1]
+    kfft = scipy.fft.rfft(kernel)
+    ckfft = scipy.fft.rfft(kernel[::-1])
+    I = deepcopy(stack)
+    active = np.arange(len(stack))
+    i = 0
+    while i < maxiter and len(active) > 0:
+        Ia = I[active]
+        conv = np.abs(scipy.fft.irfft(scipy.fft.rfft(Ia, axis=1, workers=-1) * kfft, n=n, axis=1, workers=-1))
+        ratio = ud.safedivide(stack[active], conv)
+        newI = Ia * np.abs(scipy.fft.irfft(scipy.fft.rfft(ratio, axis=1, workers=-1) * ckfft, n=n, axis=1,
+                                           workers=-1))
+        diff = np.sum((Ia - newI) ** 2, axis=1) / np.sum(Ia, axis=1)
+        I[active] = newI
+        active = active[diff > tolerance]
+        i += 1
+    I /= np.amax(I, axis=1, keepdims=True)
+    return I
+
+
 def import_kernel_and_run(data, kfile):
     dd = DoubleDec()
     dd.kimport(kfile)
@@ -47,15 +98,60 @@ def import_kernel_and_run(data, kfile):
     return dd.dec2
 
 
-def batch_dd(files, kfile):
+def batch_dd(files, kfile, binary=True):
+    """
+    Run DoubleDec on a list of files with the same kernel.
+
+    The kernel is loaded once. Spectra with the same length are stacked and deconvolved together with dd_stack, using
+    one kernel FFT for each length.
+    :param files: List of data file paths
+    :param kfile: Kernel file path
+    :param binary: If True (default), write each output to a compressed npz file under the key "data". Use load_dd to
+    read it by the name of the text output, as DataCollector does. If False, write text.
+    :return: List of output file paths
+    """
+    kernel = np.loadtxt(kfile)
+    datalist = []
+    groups = {}
+    for i, f in enumerate(files):
+        data = np.loadtxt(f)
+        data[:, 1] /= np.amax(data[:, 1])
+        if len(kernel) > len(data):
+            data = ud.pad_data_length(data, pad_until_length=len(kernel))
+        datalist.append(data)
+        groups.setdefault(len(data), []).append(i)
+
+    outfiles = []
     for f in files:
-        outfile = os.path.splitext(f)[0]+"dd.txt"
-        dd = DoubleDec()
-        dd.dd_import(f, kfile)
-        dd.dd_run()
-        np.savetxt(outfile, dd.dec2)
-        print(f, kfile, outfile)
-    pass
+        if binary:
+            outfiles.append(os.path.splitext(f)[0] + "dd.npz")
+        else:
+            outfiles.append(os.path.splitext(f)[0] + "dd.txt")
+
+    for length, indexes in groups.items():
+        decs = dd_stack([datalist[i][:, 1] for i in indexes], prep_kernel(kernel, length))
+        for i, dec in zip(indexes, decs):
+            dec2 = np.transpose([datalist[i][:, 0], dec])
+            if binary:
+                np.savez_compressed(outfiles[i], data=dec2)
+            else:
+                np.savetxt(outfiles[i], dec2)
+            print(files[i], kfile, outfiles[i])
+    return outfiles
+
+
+def load_dd(path):
+    """
+    Load a DoubleDec output from batch_dd. The npz file with the same name as the text file is read if it exists and
+    the text file does not or is older.
+    :param path: Output text file path, such as the data file name with dd.txt
+    :return: Data array (N x 2)
+    """
+    npzpath = os.path.splitext(path)[0] + ".npz"
+    if os.path.isfile(npzpath) and (not os.path.isfile(path) or os.path.getmtime(npzpath) >= os.path.getmtime(path)):
+        with np.load(npzpath) as npz:
+            return npz["data"]
+    return np.loadtxt(path)
 
 
 class DoubleDec:
@@ -81,17 +177,7 @@ class DoubleDec:
         self.kernel = make_kernel(self.kernel)
 
     def dd_core(self, data, kernel):
-        ckernel = kernel[::-1]
-        I = deepcopy(data)
-        i = 0
-        diff = 1
-        while i < 50 and diff > 0.0001:
-            newI = I * cconv2(ud.safedivide(data, cconv2(kernel, I)), ckernel)
-            diff = np.sum((I - newI) ** 2) / np.sum(I)
-            I = newI
-            i += 1
-        I /= np.amax(I)
-        return I
+        return dd_stack([data], kernel)[0]
 
     def dd_run(self, data=None, kernel=None):
         if data is not None:
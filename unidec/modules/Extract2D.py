@@ -266,10 +266,9 @@ class Extract2DPlot(wx.Frame):
         :return: None
         """
         # TODO: Optimize function. It currently preforms the extraction on all every time but doesn't need to...
-        self.igrid = np.zeros((len(self.datalist), len(self.m1range), len(self.m2range)))
         method = self.extractdict[self.params[8]]
-        for i, data in enumerate(self.datalist):
-            self.igrid[i] = ud.data_extract_grid(data, self.massgrid, extract_method=method, window=self.params[7])
+        self.igrid = ud.data_extract_grid_stack(self.datalist, self.massgrid, extract_method=method,
+                                                window=self.params[7]).astype(float)
         try:
             self.igrid /= np.amax(self.igrid)
         except Exception as e:
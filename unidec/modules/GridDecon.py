@@ -5,26 +5,118 @@ import wx
 import time
 
 import scipy.ndimage.filters as filt
+from scipy import signal
+from scipy import sparse
+import scipy.sparse.linalg as splinalg
 
 from unidec.modules import unidecstructure
 from unidec.modules import PlottingWindow
 from unidec import tools as ud
 
 
-def make_pmat(mzgrid, fwhm):
-    vec = np.ravel(mzgrid)
-    g1, g2 = np.meshgrid(vec, vec)
-    sig = fwhm / 2.35482
-    pmat = np.exp(-(g1 - g2) ** 2. / (2. * sig * sig))
-    thresh = 0.001
-    pmat = np.clip(pmat, thresh, 1) - thresh
-    pmat /= np.amax(pmat)
+def psf_kernel(x, sig, thresh=0.001):
+    """
+    Thresholded Gaussian point-spread function, normalized to a maximum of 1.
+    :param x: Offsets in m/z
+    :param sig: Gaussian sigma in m/z
+    :param thresh: Relative threshold below which the point-spread function is set to zero
+    :return: Kernel values at x
+    """
+    k = np.exp(-x ** 2. / (2. * sig * sig))
+    k = np.clip(k, thresh, 1) - thresh
+    return k / (1. - thresh)
+
+
+def make_pmat_sparse(vec, sig, thresh=0.001):
+    """
+    Exact point-spread matrix between all pairs of grid points, stored as a banded sparse matrix.
+
+    Only pairs closer in m/z than the point where the Gaussian falls below thresh are stored.
+    :param vec: Flattened m/z values of the grid
+    :param sig: Gaussian sigma in m/z
+    :param thresh: Relative threshold below which the point-spread function is set to zero
+    :return: Sparse CSR matrix of shape (len(vec), len(vec))
+    """
+    n = len(vec)
+    cutoff = sig * np.sqrt(2. * np.log(1. / thresh))
+    order = np.argsort(vec, kind="stable")
+    svec = vec[order]
+    # Each sorted point only overlaps with a contiguous band of its neighbors
+    lo = np.searchsorted(svec, svec - cutoff, side="left")
+    hi = np.searchsorted(svec, svec + cutoff, side="right")
+    counts = hi - lo
+    rows = np.repeat(np.arange(n), counts)
+    starts = np.cumsum(counts) - counts
+    cols = lo[rows] + np.arange(len(rows)) - starts[rows]
+    rows = order[rows]
+    cols = order[cols]
+    vals = psf_kernel(vec[rows] - vec[cols], sig, thresh)
+    pmat = sparse.csr_matrix((vals, (rows, cols)), shape=(n, n))
+    pmat.eliminate_zeros()
     return pmat
 
 
+def make_pmat_binned(vec, sig, thresh=0.001, oversample=10):
+    """
+    Approximate point-spread operator that bins the grid onto a fine linear m/z axis, convolves with the
+    point-spread function by FFT, and interpolates back onto the grid points.
+
+    Memory is linear in the number of grid points and each application is O(M log M) for M m/z bins, regardless of
+    how many grid points overlap.
+    :param vec: Flattened m/z values of the grid
+    :param sig: Gaussian sigma in m/z
+    :param thresh: Relative threshold below which the point-spread function is set to zero
+    :param oversample: Number of m/z bins per sigma
+    :return: scipy.sparse.linalg.LinearOperator of shape (len(vec), len(vec))
+    """
+    n = len(vec)
+    dx = sig / oversample
+    halfwidth = int(np.ceil(sig * np.sqrt(2. * np.log(1. / thresh)) / dx))
+    kernel = psf_kernel(np.arange(-halfwidth, halfwidth + 1) * dx, sig, thresh)
+    start = np.amin(vec)
+    pos = (vec - start) / dx
+    i0 = np.floor(pos).astype(int)
+    f = pos - i0
+    nbins = int(np.amax(i0)) + 2
+
+    def matvec(b):
+        b = np.ravel(b)
+        hist = np.bincount(i0, b * (1 - f), minlength=nbins) + np.bincount(i0 + 1, b * f, minlength=nbins)
+        c = signal.fftconvolve(hist, kernel, mode="same")
+        return c[i0] * (1 - f) + c[i0 + 1] * f
+
+    # The operator is symmetric, so the transpose is the operator itself
+    return splinalg.LinearOperator((n, n), matvec=matvec, rmatvec=matvec, dtype=float)
+
+
+def make_pmat(mzgrid, fwhm, thresh=0.001, maxnnz=2e7):
+    """
+    Make the point-spread operator between all pairs of grid points.
+
+    Uses the exact banded sparse matrix if the number of overlapping pairs is below maxnnz. Otherwise, falls back to
+    the binned FFT convolution, which keeps memory linear in grid size.
+    :param mzgrid: Grid of m/z values
+    :param fwhm: Full width at half max of the peak in m/z
+    :param thresh: Relative threshold below which the point-spread function is set to zero
+    :param maxnnz: Maximum number of stored pairs for the sparse matrix
+    :return: Sparse matrix or LinearOperator supporting .dot and .T
+    """
+    vec = np.ravel(mzgrid).astype(float)
+    sig = fwhm / 2.35482
+    cutoff = sig * np.sqrt(2. * np.log(1. / thresh))
+    svec = np.sort(vec)
+    nnz = np.sum(np.searchsorted(svec, svec + cutoff, side="right")
+                 - np.searchsorted(svec, svec - cutoff, side="left"))
+    if nnz <= maxnnz:
+        return make_pmat_sparse(vec, sig, thresh)
+    else:
+        print("Using binned FFT point-spread function for", nnz, "overlapping pairs")
+        return make_pmat_binned(vec, sig, thresh)
+
+
 def conv(b, pmat):
     shape = b.shape
-    dotproduct = np.dot(np.ravel(b), pmat)
+    dotproduct = pmat.T.dot(np.ravel(b))
     return np.reshape(dotproduct, shape)
 
 
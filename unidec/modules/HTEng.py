@@ -986,7 +986,7 @@ class UniChromCDEng(HTEng, UniDecCD):
             bsum += np.outer(bz, bmz)
 
         # Create new data object
-        newd = deepcopy(self.data)
+        newd = self.data.copy()
         # Filter Harray with the boolean array
         newh2 = self.harray * bsum
         # Transform and populate the new data object
@@ -1066,7 +1066,7 @@ class UniChromCDEng(HTEng, UniDecCD):
         b2 = np.logical_and(b3, b4)
 
         b3 = np.outer(b2, b)
-        newd = deepcopy(self.data)
+        newd = self.data.copy()
 
         newh2 = self.harray * b3
 
@@ -449,18 +449,10 @@ class MassDefectWindow(wx.Frame):
 
         if not self.notchanged or not self.total:
             # Run on all
-            igrids = []
-            m1grid, m2grid = None, None
-            for i, dat in enumerate(self.datalist):
-                self.data1d, self.data2d, m1grid, m2grid, igrid = ud.kendrick_analysis(dat, self.m0,
-                                                                                       centermode=self.centermode,
-                                                                                       nbins=self.nbins,
-                                                                                       transformmode=self.transformmode,
-                                                                                       xaxistype=self.xtype,
-                                                                                       massrange=self.massrange)
-                igrids.append(igrid)
+            m1grid, m2grid, igrids = ud.kendrick_analysis_stack(self.datalist, self.m0, centermode=self.centermode,
+                                                                nbins=self.nbins, transformmode=self.transformmode,
+                                                                xaxistype=self.xtype, massrange=self.massrange)
             # Sum and reshape
-            igrids = np.array(igrids)
             igrids /= np.amax(igrids)
             sumgrid = np.sum(igrids, axis=0)
             self.igrids = igrids
@@ -5,8 +5,151 @@ from unidec.modules import isotopetools as iso
 __author__ = 'Michael.Marty'
 
 
+def peak_shapes(x, psfun, fwhm, mid):
+    """
+    Evaluate area normalized peak shapes, with each x value paired with its own peak width and midpoint.
+    :param x: Array of x values
+    :param psfun: Peak shape function integer code (see ud.make_peak_shape)
+    :param fwhm: Array of peak full width half max values for each x
+    :param mid: Array of peak midpoints for each x
+    :return: Array of peak shape values
+    """
+    if psfun == 0 or psfun == 3:
+        return ud.ndis(x, mid, fwhm, norm_area=True)
+    elif psfun == 1:
+        return ud.ldis(x, mid, fwhm, norm_area=True)
+    elif psfun == 2:
+        a = 1 / (fwhm * np.pi / 2.) / 0.83723895067
+        sig2 = fwhm / (2 * np.sqrt(2 * np.log(2)))
+        # ldis scales a in place, so it gets its own copy
+        return np.where(x > mid, ud.ldis(x, mid, fwhm, a=np.array(a)), ud.ndis_std(x, mid, sig2, a=a))
+    else:
+        return x * 0
+
+
+def spectrum_profiles(arrays, mzaxis, ztab, adductmass=1.00727647, psfun=0, window=None, chunksize=2 ** 22):
+    """
+    Sum the peaks for all species and charge states of several parameter arrays on one m/z axis.
+
+    Each peak is only evaluated within +/- window * fwhm of its center, which is found with searchsorted, and all
+    peaks are added onto the spectra at once with np.bincount.
+
+    :param arrays: List of P x 5 arrays of parameters [mass, mass fwhm, z avg, z std dev, intensity]
+    :param mzaxis: Sorted m/z axis
+    :param ztab: Array of charge states
+    :param adductmass: Mass of electrospray adduct species
+    :param psfun: Peak shape function integer code
+    :param window: Width of the window in multiples of the peak fwhm. Default is None, which is 5 for Gaussian peaks
+    and the full m/z axis for peaks with Lorentzian tails.
+    :param chunksize: Maximum number of peak values to evaluate at a time
+    :return: Array of spectra intensities (len(arrays) x len(mzaxis))
+    """
+    mzaxis = np.asarray(mzaxis, dtype=float)
+    ztab = np.asarray(ztab, dtype=float)
+    n = len(mzaxis)
+    arrays = [np.abs(np.reshape(np.array(a, dtype=float), (-1, 5))) for a in arrays]
+    specindex = np.concatenate([np.full(len(a), i) for i, a in enumerate(arrays)]).astype(int)
+    array = np.concatenate(arrays) if len(arrays) > 0 else np.zeros((0, 5))
+    mmid, msig, zmid, zsig, inten = [array[:, i, np.newaxis] for i in range(5)]
+    if window is None and psfun in (0, 3):
+        window = 5
+
+    # Charge state distribution for each species (P x Z)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zint = ud.ndis_std(ztab[np.newaxis, :], zmid, zsig, norm_area=True)
+    single = zsig[:, 0] == 0
+    if np.any(single):
+        onehot = np.zeros((np.sum(single), len(ztab)))
+        onehot[np.arange(len(onehot)), np.argmin(np.abs(ztab[np.newaxis, :] - zmid[single]), axis=1)] = 1
+        zint[single] = onehot
+
+    # One peak for each species and charge state with nonzero intensity
+    weights = zint * inten
+    mzvals = (mmid + adductmass * ztab) / ztab
+    mzsigs = msig / ztab
+    good = weights != 0
+    weights = weights[good]
+    mzvals = mzvals[good]
+    mzsigs = mzsigs[good]
+    specs = np.broadcast_to(specindex[:, np.newaxis], good.shape)[good]
+
+    if window is None:
+        # Full axis for every peak, so evaluate blocks of peaks densely and add each block to its spectra
+        output = np.zeros((len(arrays), n))
+        step = max(chunksize // max(n, 1), 1)
+        for first in range(0, len(mzvals), step):
+            c = slice(first, first + step)
+            block = peak_shapes(mzaxis[np.newaxis, :], psfun, mzsigs[c, np.newaxis], mzvals[c, np.newaxis])
+            block *= weights[c, np.newaxis]
+            # Peaks are grouped by spectrum, so sum the rows of each spectrum together
+            firsts = np.flatnonzero(np.diff(specs[c], prepend=-1))
+            output[specs[c][firsts]] += np.add.reduceat(block, firsts, axis=0)
+        return output
+
+    # Index range of the m/z axis for each peak
+    starts = np.searchsorted(mzaxis, mzvals - window * mzsigs, side="left")
+    ends = np.searchsorted(mzaxis, mzvals + window * mzsigs, side="right")
+    lengths = ends - starts
+    output = np.zeros(len(arrays) * n)
+
+    # Split the peaks into chunks with at most about chunksize values in each
+    bounds = np.cumsum(lengths)
+    cuts = np.searchsorted(bounds, np.arange(chunksize, bounds[-1] if len(bounds) > 0 else 0, chunksize))
+    for first, last in zip(np.concatenate(([0], cuts)), np.concatenate((cuts, [len(lengths)]))):
+        if last <= first:
+            continue
+        counts = lengths[first:last]
+        total = int(np.sum(counts))
+        if total == 0:
+            # All of these peaks are outside of the m/z axis
+            continue
+        peak = np.repeat(np.arange(first, last), counts)
+        index = starts[peak] + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        values = peak_shapes(mzaxis[index], psfun, mzsigs[peak], mzvals[peak]) * weights[peak]
+        index += specs[peak] * n
+        lo = np.amin(index)
+        hi = np.amax(index) + 1
+        output[lo:hi] += np.bincount(index - lo, weights=values, minlength=hi - lo)
+    return np.reshape(output, (len(arrays), n))
+
+
+def finish_spectra(outputs, mzaxis, mzrange, noise=0, baseline=0, rng=None, scramble=False):
+    """
+    Normalize spectra and add optional background and noise, then renormalize.
+    :param outputs: Array of spectra intensities (B x N)
+    :param mzaxis: m/z axis
+    :param mzrange: Tuple or list defining range of m/z values
+    :param noise: Std deviation of random Gaussian noise to be added to normalized spectrum
+    :param baseline: Peak intensity of sinusoidal baseline to be added to normalized spectrum
+    :param rng: Random number generator for the noise. Default is None, which uses np.random.
+    :param scramble: If True, shuffle the intensities of each spectrum
+    :return: Normalized spectra intensities (B x N)
+    """
+    if rng is None:
+        rng = np.random
+    outputs = outputs / np.amax(outputs, axis=1, keepdims=True)
+
+    if baseline > 0:
+        background = np.sin((mzaxis - mzrange[0]) / (mzrange[1] - mzrange[0]) * np.pi) * baseline
+        outputs = outputs + background
+    if baseline < 0:
+        outputs += np.abs(baseline)
+    outputs /= np.amax(outputs, axis=1, keepdims=True)
+
+    if noise > 0:
+        noisedat = rng.normal(0, noise, size=outputs.shape)
+        outputs = np.abs(outputs + noisedat)
+
+    outputs /= np.amax(outputs, axis=1, keepdims=True)
+
+    if scramble:
+        for output in outputs:
+            rng.shuffle(output)
+    return outputs
+
+
 def make_mass_spectrum(array, zrange=(10, 50), mzrange=(2000, 10000), mz_bin_size=1, adductmass=1.00727647, psfun=0,
-                       noise=0, baseline=0, **kwargs):
+                       noise=0, baseline=0, window=None, **kwargs):
     """
     Create a new mass spectrum.
 
@@ -23,55 +166,48 @@ def make_mass_spectrum(array, zrange=(10, 50), mzrange=(2000, 10000), mz_bin_siz
     :param psfun: Peak shape function integer code
     :param noise: Std deviation of random Gaussian noise to be added to normalized spectrum
     :param baseline: Peak intensity of sinusoidal baseline to be added to normalized spectrum
+    :param window: Width of the window around each peak in multiples of the fwhm (see spectrum_profiles)
     :param kwargs: Keyword catcher
     :return: Spectrum, ztab (new spectrum in N x 2 (m/z, intensity) and charge states allowed)
     """
     mzaxis = np.arange(mzrange[0], mzrange[1], mz_bin_size)
     ztab = np.arange(zrange[0], zrange[1] + 1, 1)
 
-    array = np.array(array)
-    num = int(len(array.flatten()) / 5)
-    array = np.reshape(array, (num, 5))
-    array = np.abs(array)
-    output = np.zeros(len(mzaxis))
-    for i in range(0, len(array)):
-        mmid = array[i, 0]
-        msig = array[i, 1]
-        zmid = array[i, 2]
-        zsig = array[i, 3]
-        inten = array[i, 4]
-
-        if zsig != 0:
-            zint = np.array(ud.ndis_std(ztab, zmid, zsig, norm_area=True))
-        else:
-            zint = np.zeros(len(ztab))
-            zint[np.argmin(np.abs(ztab - zmid))] = 1
-
-        mzvals = (mmid + adductmass * ztab) / ztab
-        mzsigs = msig / ztab
-
-        for j in range(0, len(ztab)):
-            output += ud.make_peak_shape(mzaxis, psfun, mzsigs[j], mzvals[j], norm_area=True) * zint[j] * inten
-    output /= np.amax(output)
+    output = spectrum_profiles([array], mzaxis, ztab, adductmass=adductmass, psfun=psfun, window=window)
+    scramble = "scramble" in kwargs and kwargs["scramble"]
+    output = finish_spectra(output, mzaxis, mzrange, noise=noise, baseline=baseline, scramble=scramble)[0]
 
-    if baseline > 0:
-        background = np.sin((mzaxis - mzrange[0]) / (mzrange[1] - mzrange[0]) * np.pi) * baseline
-        output = output + background
-    if baseline < 0:
-        output += np.abs(baseline)
-    output /= np.amax(output)
+    return np.transpose([mzaxis, output]), ztab
 
-    if noise > 0:
-        noisedat = np.random.normal(0, noise, size=len(output))
-        output = np.abs(output + noisedat)
 
-    output /= np.amax(output)
+def make_mass_spectra(arrays, zrange=(10, 50), mzrange=(2000, 10000), mz_bin_size=1, adductmass=1.00727647, psfun=0,
+                      noise=0, baseline=0, window=None, seed=None, scramble=False, **kwargs):
+    """
+    Create a batch of new mass spectra on a shared m/z axis. See make_mass_spectrum.
 
-    if "scramble" in kwargs:
-        if kwargs['scramble']:
-            np.random.shuffle(output)
+    The noise is drawn from np.random.default_rng(seed), so a batch can be made again exactly from the same seed.
 
-    return np.transpose([mzaxis, output]), ztab
+    :param arrays: List of P x 5 arrays of parameters [mass, mass fwhm, z avg, z std dev, intensity]. P may differ.
+    :param zrange: Tuple of list define range of allowed charge states
+    :param mzrange: Tuple or list defining range of m/z values
+    :param mz_bin_size: delta mz of mzaxis
+    :param adductmass: Mass of electrospray adduct species
+    :param psfun: Peak shape function integer code
+    :param noise: Std deviation of random Gaussian noise to be added to each normalized spectrum
+    :param baseline: Peak intensity of sinusoidal baseline to be added to each normalized spectrum
+    :param window: Width of the window around each peak in multiples of the fwhm (see spectrum_profiles)
+    :param seed: Seed for the noise
+    :param scramble: If True, shuffle the intensities of each spectrum
+    :param kwargs: Keyword catcher
+    :return: mzaxis, spectra intensities (len(arrays) x len(mzaxis)), ztab
+    """
+    mzaxis = np.arange(mzrange[0], mzrange[1], mz_bin_size)
+    ztab = np.arange(zrange[0], zrange[1] + 1, 1)
+    rng = np.random.default_rng(seed)
+
+    outputs = spectrum_profiles(arrays, mzaxis, ztab, adductmass=adductmass, psfun=psfun, window=window)
+    outputs = finish_spectra(outputs, mzaxis, mzrange, noise=noise, baseline=baseline, rng=rng, scramble=scramble)
+    return mzaxis, outputs, ztab
 
 
 def get_zrange(params):
@@ -154,29 +290,24 @@ def simple_spectrum2(masslist, **kwargs):
 
 
 def isotopic_spectrum(masslist, chargelist=None, intlist=None, x=None, resolution=100000, **kwargs):
-    allparams = []
-
-    for i, mass in enumerate(masslist):
-        dist = iso.calc_averagine_isotope_dist(mass, **kwargs)
-        dist[:, 1] /= np.amax(dist[:, 1])
-
-        if chargelist is not None:
-            z = chargelist[i]
-        else:
-            z = 1
-
-        if intlist is not None:
-            intensity = intlist[i]
-        else:
-            intensity = 1
-
-        params = np.array(
-            [[m[0], m[0] / float(resolution), z, 0, intensity * m[1]] for i, m in enumerate(dist)])
-
-        allparams.append(params)
-
-    params = np.concatenate(allparams)
-    print(params)
+    dists = [iso.calc_averagine_isotope_dist(mass, **kwargs) for mass in masslist]
+    lengths = np.array([len(d) for d in dists])
+    dist = np.concatenate(dists)
+    # Normalize each isotope distribution to its max
+    starts = np.cumsum(lengths) - lengths
+    dist[:, 1] /= np.repeat(np.maximum.reduceat(dist[:, 1], starts), lengths)
+
+    if chargelist is not None:
+        z = np.repeat(chargelist, lengths)
+    else:
+        z = np.ones(len(dist))
+
+    if intlist is not None:
+        intensity = np.repeat(intlist, lengths)
+    else:
+        intensity = np.ones(len(dist))
+
+    params = np.transpose([dist[:, 0], dist[:, 0] / float(resolution), z, np.zeros(len(dist)), intensity * dist[:, 1]])
     zrange = get_zrange(params)
     mzrange = get_mzrange(params, **kwargs)
     spec = make_mass_spectrum(params, zrange=zrange, mzrange=mzrange, resolution=resolution, **kwargs)
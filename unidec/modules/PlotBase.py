@@ -88,6 +88,13 @@ class PlotBase(object):
         self.aspect = "auto"
         self.canvas = None
         self.is2d = False
+        # Level of detail for large 2D grids, see setup_lod
+        self.lod = True
+        self.lodgrid = None
+        self.loddraw = None
+        self.lodartists = []
+        self.lodkey = None
+        self.lodbusy = False
 
     def repaint(self, setupzoom=False, resetzoom=False):
         if resetzoom:
@@ -106,7 +113,11 @@ class PlotBase(object):
 
     def setup_zoom(self, plots=None, zoom=None, data_lims=None, pad=0, groups=None):
         # Autoscale Y
-        xmin, ymin, xmax, ymax = GetMaxes(self.subplot1)
+        if data_lims is not None and self.lodgrid is not None:
+            # The drawn artists of a level of detail plot may only cover part of the data
+            xmin, ymin, xmax, ymax = data_lims
+        else:
+            xmin, ymin, xmax, ymax = GetMaxes(self.subplot1)
         self.subplot1.set_ylim((ymin, ymax))
         self.subplot1.set_xlim((xmin, xmax))
         pass
@@ -213,6 +224,63 @@ class PlotBase(object):
         self.figure.savefig(png, format="png")
         return png.getvalue()
 
+    def lod_size(self):
+        """
+        Size of the main axes in pixels, which sets the resolution that large grids are reduced to.
+        :return: width, height
+        """
+        width, height = self.figure.get_size_inches() * self.figure.dpi
+        return int(width * self._axes[2]), int(height * self._axes[3])
+
+    def setup_lod(self, lodgrid, draw):
+        """
+        Draw a grid at screen resolution and redraw it at finer levels when the axes are zoomed.
+        :param lodgrid: GridPyramid from unidec.modules.gridlod
+        :param draw: Function that takes x values, y values, and a grid, draws them on self.subplot1, and returns a
+        list of the artists it made
+        :return: List of artists from draw
+        """
+        self.lodgrid = lodgrid
+        self.loddraw = draw
+        x, y, grid, self.lodkey = lodgrid.view(*self.lod_size())
+        self.lodartists = draw(x, y, grid)
+        # Keep the limits of the full grid so that redrawing a cropped grid does not autoscale to the crop
+        self.subplot1.set_xlim(self.subplot1.get_xlim())
+        self.subplot1.set_ylim(self.subplot1.get_ylim())
+        self.subplot1.callbacks.connect("xlim_changed", self.refine_lod)
+        self.subplot1.callbacks.connect("ylim_changed", self.refine_lod)
+        return self.lodartists
+
+    def refine_lod(self, ax=None):
+        """
+        Redraw the grid from setup_lod for the current axis limits if a different level or range is needed.
+        :param ax: Axes that changed. Unused.
+        :return: None
+        """
+        if self.lodgrid is None or self.loddraw is None or self.lodbusy:
+            return
+        xlim = self.subplot1.get_xlim()
+        ylim = self.subplot1.get_ylim()
+        x, y, grid, key = self.lodgrid.view(*self.lod_size(), xlim=np.array(xlim) * self.kdnorm, ylim=ylim)
+        if key == self.lodkey:
+            return
+        self.lodbusy = True
+        try:
+            for a in self.lodartists:
+                try:
+                    a.remove()
+                except Exception:
+                    pass
+            self.lodkey = key
+            autoscale = self.subplot1.get_autoscale_on()
+            self.subplot1.set_autoscale_on(False)
+            self.lodartists = self.loddraw(x, y, grid)
+            self.subplot1.set_autoscale_on(autoscale)
+            self.subplot1.set_xlim(xlim, emit=False)
+            self.subplot1.set_ylim(ylim, emit=False)
+        finally:
+            self.lodbusy = False
+
     def kda_test(self, xvals):
         """
         Test whether the axis should be normalized to convert mass units from Da to kDa.
@@ -339,6 +407,10 @@ class PlotBase(object):
         self.lines = []
         self.kda = False
         self.kdnorm = 1.
+        self.lodgrid = None
+        self.loddraw = None
+        self.lodartists = []
+        self.lodkey = None
         # self.zoomvals = None
         if "nopaint" not in args:
             self.repaint()
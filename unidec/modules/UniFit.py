@@ -13,6 +13,7 @@ import sys
 import time
 import scipy.special as special
 import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 __author__ = 'Michael.Marty'
 
@@ -163,6 +164,72 @@ def MinFree(ptot, ltot, ureact, prottab, ligtab, paths, kds, pguess, lguess, nfa
     return pfree, lfree
 
 
+def MinFreeAll(ptots, ltots, ureact, prottab, ligtab, paths, kds, pguesses, lguesses, nfactors, maxit=100):
+    """
+    Solve the mass balance equations for free protein and ligand at all concentration points at once.
+
+    Uses a batched, damped Newton iteration with a finite difference Jacobian. Any points that fail to converge are
+    solved individually with MinFree.
+    :return: Array of shape (len(ptots), 2) of free protein and free ligand concentrations
+    """
+    ptots = np.asarray(ptots, dtype=float)
+    ltots = np.asarray(ltots, dtype=float)
+    pfree = np.array(pguesses, dtype=float)
+    lfree = np.array(lguesses, dtype=float)
+    tiny = np.finfo(float).tiny
+
+    def residuals(p, l):
+        _, sumprot, sumlig = MakeGrid(p, l, ureact, prottab, ligtab, paths, kds, nfactors)
+        return ptots - sumprot, ltots - sumlig
+
+    with np.errstate(all="ignore"):
+        pfree, lfree = _newton_free(residuals, pfree, lfree, maxit)
+
+    pfree = np.clip(pfree, 0, ptots)
+    lfree = np.clip(lfree, 0, ltots)
+    rp, rl = residuals(pfree, lfree)
+    good = np.isfinite(rp) & np.isfinite(rl)
+    good &= np.abs(rp) <= 1e-8 * np.maximum(ptots, tiny)
+    good &= np.abs(rl) <= 1e-8 * np.maximum(ltots, tiny)
+    for i in np.nonzero(np.logical_not(good))[0]:
+        pfree[i], lfree[i] = MinFree(ptots[i], ltots[i], ureact, prottab, ligtab, paths, kds, pguesses[i],
+                                     lguesses[i], nfactors)
+    return np.transpose([pfree, lfree])
+
+
+def _newton_free(residuals, pfree, lfree, maxit):
+    tiny = np.finfo(float).tiny
+    step = np.sqrt(np.finfo(float).eps)
+    rp, rl = residuals(pfree, lfree)
+    for it in range(0, maxit):
+        # Forward difference Jacobian for all points at once
+        dp = step * np.maximum(np.abs(pfree), tiny)
+        dl = step * np.maximum(np.abs(lfree), tiny)
+        rpp, rlp = residuals(pfree + dp, lfree)
+        rpl, rll = residuals(pfree, lfree + dl)
+        j11 = (rpp - rp) / dp
+        j21 = (rlp - rl) / dp
+        j12 = (rpl - rp) / dl
+        j22 = (rll - rl) / dl
+        det = j11 * j22 - j12 * j21
+        det[det == 0] = tiny
+        sp = (j22 * rp - j12 * rl) / det
+        sl = (j11 * rl - j21 * rp) / det
+        # Damp steps that would make concentrations negative
+        newp = pfree - sp
+        newl = lfree - sl
+        newp = np.where(newp < 0, pfree / 2., newp)
+        newl = np.where(newl < 0, lfree / 2., newl)
+        change = np.amax(np.abs(np.concatenate([(newp - pfree) / np.maximum(np.abs(newp), tiny),
+                                                (newl - lfree) / np.maximum(np.abs(newl), tiny)])))
+        pfree = newp
+        lfree = newl
+        rp, rl = residuals(pfree, lfree)
+        if not change > 1e-12:
+            break
+    return pfree, lfree
+
+
 def GetFree(pO, ptot, ltot, ureact, prottab, ligtab, paths, kds, nfactors):
     pfree = pO[0]
     lfree = pO[1]
@@ -171,7 +238,9 @@ def GetFree(pO, ptot, ltot, ureact, prottab, ligtab, paths, kds, nfactors):
 
 
 def MakeGrid(pfree, lfree, ureact, prottab, ligtab, paths, kds, nfactors):
-    intgrid = np.zeros_like(prottab)
+    # pfree and lfree may be scalars or arrays of concentration points, which are added as trailing axes
+    extra = (1,) * np.ndim(pfree)
+    intgrid = np.zeros(np.shape(prottab) + np.shape(pfree))
     intgrid[1, 0] = pfree
     try:
         intgrid[0, 1] = lfree
@@ -194,9 +263,9 @@ def MakeGrid(pfree, lfree, ureact, prottab, ligtab, paths, kds, nfactors):
         if denom != 0:
             intgrid[nump, numl] += (pfree ** nump) * (lfree ** (numl * h)) / denom
     if nfactors is not None:
-        intgrid = nfactors * intgrid
-    sumprot = np.sum(prottab * intgrid)
-    sumlig = np.sum(ligtab * intgrid)
+        intgrid = np.reshape(nfactors, np.shape(nfactors) + extra) * intgrid
+    sumprot = np.sum(np.reshape(prottab, np.shape(prottab) + extra) * intgrid, axis=(0, 1))
+    sumlig = np.sum(np.reshape(ligtab, np.shape(ligtab) + extra) * intgrid, axis=(0, 1))
     return intgrid, sumprot, sumlig
 
 
@@ -343,16 +412,13 @@ def draw_graph(graph1, graph2, kds, errors, kdmap, header, ax=None, ulabel=""):
 
 
 def MinFreeError(kds, data, weights, kdargs):
-    out = [MinFree(kdargs.pconc[i], kdargs.lconc[i], kdargs.ureact, kdargs.nprottab, kdargs.nligtab, kdargs.paths, kds,
-                   kdargs.pfrees[i], kdargs.lfrees[i], kdargs.nfactors) for i in range(0, len(kdargs.lconc))]
-    out = np.array(out)
+    out = MinFreeAll(kdargs.pconc, kdargs.lconc, kdargs.ureact, kdargs.nprottab, kdargs.nligtab, kdargs.paths, kds,
+                     kdargs.pfrees, kdargs.lfrees, kdargs.nfactors)
     kdargs.pfrees = out[:, 0]
     kdargs.lfrees = out[:, 1]
     if np.any(kdargs.pfrees == 0) or np.any(kdargs.lfrees[1:] == 0):
-        out = [
-            MinFree(kdargs.pconc[i], kdargs.lconc[i], kdargs.ureact, kdargs.nprottab, kdargs.nligtab, kdargs.paths, kds,
-                    kdargs.pfrees[i], kdargs.lfrees[i], kdargs.nfactors) for i in range(0, len(kdargs.lconc))]
-        out = np.array(out)
+        out = MinFreeAll(kdargs.pconc, kdargs.lconc, kdargs.ureact, kdargs.nprottab, kdargs.nligtab, kdargs.paths, kds,
+                         kdargs.pfrees, kdargs.lfrees, kdargs.nfactors)
         kdargs.pfrees = out[:, 0]
         kdargs.lfrees = out[:, 1]
     errors = np.ravel([GetError(data[:, i], kdargs.pfrees[i], kdargs.lfrees[i], kdargs.ureact, kdargs.nprottab,
@@ -364,13 +430,11 @@ def MinFreeError(kds, data, weights, kdargs):
 def GetDegenKD(kds, kdargs):
     if len(kdargs.degen > 0):
         dktot = []
+        out = MinFreeAll(kdargs.pconc, kdargs.lconc, kdargs.ureact, kdargs.nprottab, kdargs.nligtab, kdargs.paths,
+                         kds, kdargs.pfrees, kdargs.lfrees, kdargs.nfactors)
+        pfrees = out[:, 0]
+        lfrees = out[:, 1]
         for i in range(0, len(kdargs.lconc)):
-            out = [
-                MinFree(kdargs.pconc[i], kdargs.lconc[i], kdargs.ureact, kdargs.nprottab, kdargs.nligtab, kdargs.paths,
-                        kds, kdargs.pfrees[i], kdargs.lfrees[i], kdargs.nfactors) for i in range(0, len(kdargs.lconc))]
-            out = np.array(out)
-            pfrees = out[:, 0]
-            lfrees = out[:, 1]
             degenkd = []
             grid = MakeGrid(pfrees[i], lfrees[i], kdargs.ureact, kdargs.nprottab, kdargs.nligtab, kdargs.paths, kds,
                             kdargs.nfactors)[0]
@@ -403,18 +467,8 @@ def BootMin(data, kdargs, weights):
     return np.concatenate(Minimize(data, kdargs, weights=weights))
 
 
-def BootMinWorker(queue, results_queue):
-    while True:
-        try:
-            out = queue.get(False)
-        except Exception as e:
-            break
-        data = out[0]
-        kdargs = out[1]
-        weights = out[2]
-        results = np.concatenate(Minimize(data, kdargs, weights=weights))
-        results_queue.put(results)
-    return
+def BootMinChunk(data, kdargs, weightlist):
+    return [BootMin(data, deepcopy(kdargs), weights) for weights in weightlist]
 
 
 def make_graph_agg(reactions):
@@ -893,18 +947,13 @@ class KDmodel:
     def MakeFitGrid(self):
         kdargs = self.kdargs
         # kdargs.kds=[1E-8,1.0E-7,1.0E-5]
-        out = [MinFree(kdargs.pconc[i], kdargs.lconc[i], kdargs.ureact, kdargs.nprottab, kdargs.nligtab, kdargs.paths,
-                       kdargs.kds, kdargs.pfrees[i], kdargs.lfrees[i], kdargs.nfactors) for i in
-               range(0, len(kdargs.lconc))]
-        out = np.array(out)
+        out = MinFreeAll(kdargs.pconc, kdargs.lconc, kdargs.ureact, kdargs.nprottab, kdargs.nligtab, kdargs.paths,
+                         kdargs.kds, kdargs.pfrees, kdargs.lfrees, kdargs.nfactors)
         kdargs.pfrees = out[:, 0]
         kdargs.lfrees = out[:, 1]
         if np.any(kdargs.pfrees == 0) or np.any(kdargs.lfrees[1:] == 0):
-            out = [
-                MinFree(kdargs.pconc[i], kdargs.lconc[i], kdargs.ureact, kdargs.nprottab, kdargs.nligtab, kdargs.paths,
-                        kdargs.kds, kdargs.pfrees[i], kdargs.lfrees[i], kdargs.nfactors) for i in
-                range(0, len(kdargs.lconc))]
-            out = np.array(out)
+            out = MinFreeAll(kdargs.pconc, kdargs.lconc, kdargs.ureact, kdargs.nprottab, kdargs.nligtab, kdargs.paths,
+                             kdargs.kds, kdargs.pfrees, kdargs.lfrees, kdargs.nfactors)
             kdargs.pfrees = out[:, 0]
             kdargs.lfrees = out[:, 1]
 
@@ -942,32 +991,18 @@ class KDmodel:
         # TODO: Fix parallel processing in built version
 
         try:
-            self.randfit = []
-            queue = multiprocessing.Queue()
-            results_queue = multiprocessing.Queue()
-            [queue.put((self.data, self.kdargs, hists[i])) for i in range(0, numpts)]
-            workers = [multiprocessing.Process(target=BootMinWorker, args=(queue, results_queue)) for i in
-                       range(0, multiprocessing.cpu_count())]
-            for p in workers:
-                p.start()
-            count = 0
-            while True:
-                if count == numpts:
-                    break
-                try:
-                    out = results_queue.get(False)
-                    self.randfit.append(out)
-                    count += 1
-                except Exception as e:
-                    pass
-            for p in workers:
-                p.join()
-            self.randfit = np.array(self.randfit)
+            # Split the resamples into a few chunks per worker to limit pickling overhead
+            nworkers = min(multiprocessing.cpu_count(), numpts)
+            chunksize = int(np.ceil(numpts / (nworkers * 4.)))
+            chunks = [hists[i:i + chunksize] for i in range(0, numpts, chunksize)]
+            with ProcessPoolExecutor(max_workers=nworkers) as executor:
+                futures = [executor.submit(BootMinChunk, self.data, self.kdargs, chunk) for chunk in chunks]
+                self.randfit = np.array([r for fut in futures for r in fut.result()])
 
         except Exception as e:
             print("Parallel Failed, using sequential...", e)
 
-            self.randfit = np.array([BootMin(self.data, self.kdargs, hists[i]) for i in range(0, numpts)])
+            self.randfit = np.array(BootMinChunk(self.data, self.kdargs, hists))
 
         print("Evaluation Time: ", time.perf_counter() - startt)
         if self.outlierflag:
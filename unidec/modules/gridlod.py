@@ -0,0 +1,140 @@
+import numpy as np
+
+__author__ = 'Michael.Marty'
+
+'''
+Level of detail for drawing large 2D grids.
+
+Grids are reduced by factors of 2 along the x and y axes until they are close to the resolution of the screen. The
+reduced levels are cached in a GridPyramid, so zooming only computes each level once. When zoomed in, only the visible
+part of the finest level needed is drawn.
+'''
+
+
+def lod_level(n, target):
+    """
+    Number of times to halve an axis of length n so that it is still at least target long.
+    :param n: Number of points on the axis
+    :param target: Number of points needed, such as the number of pixels. None or 0 to never reduce.
+    :return: Number of halvings
+    """
+    if target is None or target <= 0 or n < 2 * target:
+        return 0
+    return int(np.floor(np.log2(n / float(target))))
+
+
+def pool_axis(values):
+    """
+    Halve an axis by averaging neighboring pairs. An odd last value is kept.
+    :param values: Axis values
+    :return: Reduced axis values
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values) // 2 * 2
+    out = (values[:n:2] + values[1:n:2]) / 2.
+    if len(values) % 2 == 1:
+        out = np.append(out, values[-1])
+    return out
+
+
+def pool_grid(grid, axis=0, mode="max"):
+    """
+    Halve a grid along one axis. An odd last slice is kept.
+    :param grid: Grid of values
+    :param axis: Axis to halve
+    :param mode: "max" for the max of each pair, "mean" for the mean, or "decimate" for the first of each pair
+    :return: Reduced grid
+    """
+    grid = np.moveaxis(np.asarray(grid), axis, 0)
+    n = len(grid) // 2 * 2
+    if mode == "max":
+        out = np.maximum(grid[:n:2], grid[1:n:2])
+    elif mode == "mean":
+        out = (grid[:n:2] + grid[1:n:2]) / 2.
+    else:
+        out = grid[:n:2]
+    if len(grid) % 2 == 1:
+        out = np.concatenate((out, grid[-1:]))
+    return np.moveaxis(out, 0, axis)
+
+
+def pool_to(axisvals, grid, targets, mode="max"):
+    """
+    Reduce the first axes of a grid and their axis values to about the target lengths.
+    :param axisvals: List of axis values for the first axes of grid
+    :param grid: Grid of values
+    :param targets: List of target lengths for each axis. None to leave an axis alone.
+    :param mode: Pooling mode, see pool_grid
+    :return: List of reduced axis values, reduced grid
+    """
+    axisvals = list(axisvals)
+    for i, target in enumerate(targets):
+        for k in range(lod_level(len(axisvals[i]), target)):
+            axisvals[i] = pool_axis(axisvals[i])
+            grid = pool_grid(grid, axis=i, mode=mode)
+    return axisvals, grid
+
+
+class GridPyramid:
+    def __init__(self, xvals, yvals, grid, mode="max"):
+        """
+        Cache of reduced versions of a grid for drawing at screen resolution.
+        :param xvals: x axis values, sorted ascending
+        :param yvals: y axis values, sorted ascending
+        :param grid: Grid with x and y as the first two axes. More axes, such as color layers, are kept as is.
+        :param mode: Pooling mode, see pool_grid. "max" keeps narrow peaks visible.
+        """
+        self.mode = mode
+        self.levels = {(0, 0): (np.asarray(xvals, dtype=float), np.asarray(yvals, dtype=float), np.asarray(grid))}
+        self.sorted = all(np.all(np.diff(a) > 0) for a in self.levels[(0, 0)][:2])
+
+    def level(self, kx, ky):
+        """
+        Get a level of the pyramid, computing it from the next finer level if it is not cached.
+        :param kx: Number of times the x axis is halved
+        :param ky: Number of times the y axis is halved
+        :return: x values, y values, grid
+        """
+        if (kx, ky) not in self.levels:
+            if kx > 0:
+                x, y, grid = self.level(kx - 1, ky)
+                self.levels[(kx, ky)] = (pool_axis(x), y, pool_grid(grid, axis=0, mode=self.mode))
+            else:
+                x, y, grid = self.level(kx, ky - 1)
+                self.levels[(kx, ky)] = (x, pool_axis(y), pool_grid(grid, axis=1, mode=self.mode))
+        return self.levels[(kx, ky)]
+
+    def view(self, width, height, xlim=None, ylim=None):
+        """
+        Get the part of the grid inside the limits at about the given resolution.
+        :param width: Number of points needed along x, such as the width of the axes in pixels
+        :param height: Number of points needed along y
+        :param xlim: (min, max) of the x range to show. None for all.
+        :param ylim: (min, max) of the y range to show. None for all.
+        :return: x values, y values, grid, and a key that is the same for the same view
+        """
+        x, y, grid = self.levels[(0, 0)]
+        if not self.sorted:
+            return x, y, grid, (0, 0, 0, len(x), 0, len(y))
+        xs, xe = self.visible(x, xlim)
+        ys, ye = self.visible(y, ylim)
+        kx = lod_level(xe - xs, width)
+        ky = lod_level(ye - ys, height)
+        x, y, grid = self.level(kx, ky)
+        xs, xe = self.visible(x, xlim)
+        ys, ye = self.visible(y, ylim)
+        return x[xs:xe], y[ys:ye], grid[xs:xe, ys:ye], (kx, ky, xs, xe, ys, ye)
+
+    @staticmethod
+    def visible(values, lim):
+        """
+        Index range of the axis values inside the limits, with one extra point on each side
+        """
+        if lim is None:
+            return 0, len(values)
+        start = max(np.searchsorted(values, min(lim), side="left") - 1, 0)
+        end = min(np.searchsorted(values, max(lim), side="right") + 1, len(values))
+        if end - start < 2:
+            start = max(min(start, len(values) - 2), 0)
+            end = min(start + 2, len(values))
+        return int(start), int(end)
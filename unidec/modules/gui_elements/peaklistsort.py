@@ -163,8 +163,7 @@ class PeakListCtrlPanel(wx.Panel, listmix.ColumnSorterMixin):
                 self.list_ctrl.InsertItem(i, p.textmarker)
                 # self.list_ctrl.SetItem(i, 1, str(p.mass))
                 if p.mass == round(p.mass):
-                    p.mass = int(p.mass)
-                    self.list_ctrl.SetItem(i, 1, f'{p.mass:,}')
+                    self.list_ctrl.SetItem(i, 1, f'{int(p.mass):,}')
                 else:
                     self.list_ctrl.SetItem(i, 1, f'{float(str(p.mass)):,}')
 
@@ -623,8 +622,7 @@ class PeakListCtrlPanel(wx.Panel, listmix.ColumnSorterMixin):
             p = self.pks.peaks[i]
             # self.list_ctrl.SetItem(i, 1, str(p.mass))
             if p.mass == round(p.mass):
-                p.mass = int(p.mass)
-                self.list_ctrl.SetItem(i, 1, f'{p.mass:,}')
+                self.list_ctrl.SetItem(i, 1, f'{int(p.mass):,}')
             else:
                 self.list_ctrl.SetItem(i, 1, f'{float(str(p.mass)):,}')
             self.list_ctrl.SetItem(i, 3, str(p.area))
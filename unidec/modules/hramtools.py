@@ -7,6 +7,11 @@ lipidsearchspace = [["1H", 54, 184], ["12C", 29, 93], ["14N", 0, 1], ["16O", 8,
 lipidsearchspace = [["1H", 0, 184], ["12C", 0, 93], ["14N", 0, 1], ["16O", 0, 17], ["31P", 0, 1]]#, ["13C", 0, 3]]
 smallmolsearch = [["1H", 0, 100], ["12C", 0, 100], ["14N", 0, 5], ["16O", 0, 5], ["31P", 0, 1]]
 
+# Valences used for the ring and double bond equivalents
+valences = {"H": 1, "D": 1, "C": 4, "N": 3, "O": 2, "P": 3, "S": 2, "F": 1, "Cl": 1, "Br": 1, "I": 1, "Si": 4,
+            "B": 3, "Se": 2, "Na": 1, "K": 1, "Li": 1}
+
+
 class HRAMResult:
     def __init__(self):
         self.match_masses = None
@@ -44,8 +49,8 @@ class HRAMSearchSpace:
         # Set up a few key arrays, get the mass of each isotope
         self.isotopes = searchspace[:, 0]
         self.isomasses = np.array([self.edict[e] for e in searchspace[:, 0]])
-        self.starts = searchspace[:, 1]
-        self.ends = searchspace[:, 2]
+        self.starts = searchspace[:, 1].astype(int)
+        self.ends = searchspace[:, 2].astype(int)
         # Empty out positions for some results
         self.result = None
         self.indexes = None
@@ -86,21 +91,84 @@ class HRAMSearchSpace:
     def filter_indexes(self):
         pass
 
-    def generate_masses(self):
+    def generate_masses(self, minmass=None, maxmass=None, tolerance=0, rdbe_range=None, nitrogen_rule=False):
+        """
+        Enumerate all compositions in the search space and store their masses sorted for binary search.
+
+        Compositions are built up one isotope at a time. After each isotope, partial compositions that can no longer
+        reach the mass range, even with the smallest or largest counts of the remaining isotopes, are dropped.
+        :param minmass: Minimum mass to keep. None for no limit.
+        :param maxmass: Maximum mass to keep. None for no limit.
+        :param tolerance: Tolerance in ppm added to the mass limits
+        :param rdbe_range: [min, max] ring and double bond equivalents to keep. None to keep all.
+        :param nitrogen_rule: If True, only keep compositions with integer RDBE, which is the nitrogen rule for
+        neutral molecules.
+        :return: None
+        """
         lens = self.ends - self.starts + 1
         print("Generating combinations:", lens, np.prod(lens))
-        self.indexes = np.array(list(np.ndindex(tuple(lens))))
-        self.massvals = np.array([np.sum(self.isomasses * (i + self.starts)) for i in self.indexes])
+        lowlimit = -np.inf if minmass is None else minmass * (1 - tolerance * 1e-6)
+        highlimit = np.inf if maxmass is None else maxmass * (1 + tolerance * 1e-6)
+        # Smallest and largest mass that the isotopes after each position can add
+        restmin = np.append(np.cumsum((self.starts * self.isomasses)[::-1])[::-1][1:], 0)
+        restmax = np.append(np.cumsum((self.ends * self.isomasses)[::-1])[::-1][1:], 0)
+
+        masses = np.zeros(1)
+        indexes = np.zeros((1, 0), dtype=int)
+        for i, m in enumerate(self.isomasses):
+            counts = np.arange(self.starts[i], self.ends[i] + 1)
+            masses = np.add.outer(masses, counts * m).ravel()
+            parents = np.repeat(np.arange(len(indexes)), len(counts))
+            steps = np.tile(counts - self.starts[i], len(indexes))
+            b1 = (masses + restmin[i] <= highlimit) & (masses + restmax[i] >= lowlimit)
+            masses = masses[b1]
+            indexes = np.column_stack((indexes[parents[b1]], steps[b1]))
+
+        if rdbe_range is not None or nitrogen_rule:
+            comp = indexes + self.starts
+            elements = [re.sub(r'\d', '', isoname) for isoname in self.isotopes]
+            doublerdbe = 2 + np.dot(comp, [valences[e] - 2 for e in elements])
+            b1 = np.ones(len(masses), dtype=bool)
+            if nitrogen_rule:
+                b1 &= doublerdbe % 2 == 0
+            if rdbe_range is not None:
+                b1 &= (doublerdbe >= 2 * rdbe_range[0]) & (doublerdbe <= 2 * rdbe_range[1])
+            masses = masses[b1]
+            indexes = indexes[b1]
+
+        order = np.argsort(masses, kind="stable")
+        self.massvals = masses[order]
+        self.indexes = indexes[order]
+        print("Kept combinations:", len(self.massvals))
 
     def match_to_target(self, target, tolerance=5, silent=True):
-        self.result = HRAMResult()
         deltamz = tolerance * 1e-6 * target
-        b1 = np.abs(self.massvals - target) < deltamz
-        if np.any(b1):
-            self.result.match_masses = self.massvals[b1]
+        # Masses are sorted, so the matches are the block strictly within the tolerance
+        lo = np.searchsorted(self.massvals, target - deltamz, side="right")
+        hi = np.searchsorted(self.massvals, target + deltamz, side="left")
+        return self.make_result(target, lo, hi, silent=silent)
+
+    def match_to_targets(self, targets, tolerance=5, silent=True):
+        """
+        Match many targets at once with a binary search of the sorted masses.
+        :param targets: List of target masses
+        :param tolerance: Tolerance in ppm
+        :param silent: If False, print each result
+        :return: List of HRAMResult objects, one for each target
+        """
+        targets = np.asarray(targets, dtype=float)
+        deltamz = tolerance * 1e-6 * targets
+        los = np.searchsorted(self.massvals, targets - deltamz, side="right")
+        his = np.searchsorted(self.massvals, targets + deltamz, side="left")
+        return [self.make_result(t, lo, hi, silent=silent) for t, lo, hi in zip(targets, los, his)]
+
+    def make_result(self, target, lo, hi, silent=True):
+        self.result = HRAMResult()
+        if hi > lo:
+            self.result.match_masses = self.massvals[lo:hi]
             self.result.match_errors = self.result.match_masses - target
             self.result.match_ppm = self.result.match_errors / target * 1e6
-            self.result.match_comp = self.indexes[b1] + self.starts
+            self.result.match_comp = self.indexes[lo:hi] + self.starts
             self.result.match_formulas = np.array(["" for m in self.result.match_comp])
             for i, isoname in enumerate(self.isotopes):
                 self.result.iso_keys.append(isoname)
@@ -121,10 +189,9 @@ def calc_fromula_from_mass(targets, Searcher=None, tolerance=5):
     st = time.perf_counter()
     if Searcher is None:
         Searcher = HRAMSearchSpace()
-    Searcher.limit_search_space(np.amin(targets), np.amax(targets), tolerance=tolerance)
-    Searcher.generate_masses()
+    Searcher.generate_masses(np.amin(targets), np.amax(targets), tolerance=tolerance)
     print("Generated Masses:", time.perf_counter() - st)
-    results = [Searcher.match_to_target(target, tolerance=tolerance) for target in targets]
+    results = Searcher.match_to_targets(targets, tolerance=tolerance)
     print("Search Complete:", time.perf_counter() - st)
     return results
 
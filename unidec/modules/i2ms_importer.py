@@ -3,26 +3,77 @@ import numpy as np
 
 
 class I2MSImporter:
-    def __init__(self, file):
+    def __init__(self, file, threshold=None, scanrange=None, mzrange=None, chunksize=1000000):
+        """
+        Reads the ion table from an i2MS or DMT sqlite file.
+
+        Only the m/z, slope, scan, and inverse injection time columns are read. Rows are streamed in chunks into a
+        preallocated array rather than fetched all at once. Optional filters are applied in SQL before reading.
+        :param file: Path to the .i2MS or .dmt file
+        :param threshold: Only read ions with slope above this value. None to read all.
+        :param scanrange: [min, max] scan numbers to read, inclusive. None to read all.
+        :param mzrange: [min, max] m/z range to read, inclusive. None to read all.
+        :param chunksize: Number of rows to fetch at a time
+        """
+        self.file = file
         conn = sqlite3.connect(file)
         cursor = conn.cursor()
-        cursor.execute('SELECT * from main.Ion')
-        data = cursor.fetchall()
-        self.data = np.array(data)
         cursor.execute('PRAGMA table_info(Ion)')
         keys = cursor.fetchall()
         self.keys = np.array(keys)
-        self.mzkey = np.where(self.keys[:, 1] == "Mz")[0][0]
-        self.scankey = np.where(self.keys[:, 1] == "ScanNumber")[0][0]
-        self.slopekey = np.where(self.keys[:, 1] == "Slope")[0][0]
-        self.scans = self.data[:,self.scankey]
-        self.iitkey = np.where(self.keys[:, 1] == "InverseInjectionTimeSeconds")[0][0]
-        self.invinjtime = self.data[:, self.iitkey]
-        '''
-        try:
-            self.invinjtime = np.where(self.keys[:, 1] == "InverseInjectionTimeSeconds")[0][0]
-        except:
-            self.invinjtime = None'''
+        names = list(self.keys[:, 1])
+
+        # Columns to read, in the order of the columns of self.data
+        self.columns = ["Mz", "Slope", "ScanNumber"]
+        if "InverseInjectionTimeSeconds" in names:
+            self.columns.append("InverseInjectionTimeSeconds")
+        for c in self.columns:
+            if c not in names:
+                raise KeyError("Column " + c + " not found in Ion table of " + str(file))
+        self.mzkey = 0
+        self.slopekey = 1
+        self.scankey = 2
+
+        # Build the WHERE clause
+        conditions = []
+        params = []
+        if threshold is not None and threshold >= 0:
+            conditions.append("Slope > ?")
+            params.append(float(threshold))
+        if scanrange is not None:
+            conditions.append("ScanNumber BETWEEN ? AND ?")
+            params.extend([float(scanrange[0]), float(scanrange[1])])
+        if mzrange is not None:
+            conditions.append("Mz BETWEEN ? AND ?")
+            params.extend([float(mzrange[0]), float(mzrange[1])])
+        where = ""
+        if len(conditions) > 0:
+            where = " WHERE " + " AND ".join(conditions)
+
+        cursor.execute('SELECT COUNT(*) FROM main.Ion' + where, params)
+        n = cursor.fetchone()[0]
+
+        # Stream the rows into a preallocated array
+        self.data = np.empty((n, len(self.columns)), dtype=float)
+        cursor.execute('SELECT ' + ", ".join(self.columns) + ' FROM main.Ion' + where, params)
+        start = 0
+        while start < n:
+            rows = cursor.fetchmany(chunksize)
+            if len(rows) == 0:
+                break
+            end = start + len(rows)
+            self.data[start:end] = rows
+            start = end
+        self.data = self.data[:start]
+        conn.close()
+
+        self.scans = self.data[:, self.scankey]
+        if "InverseInjectionTimeSeconds" in self.columns:
+            self.iitkey = 3
+            self.invinjtime = self.data[:, self.iitkey]
+        else:
+            self.iitkey = None
+            self.invinjtime = None
 
     def grab_data(self, threshold=-1):
         slopes = self.data[:, self.slopekey]
@@ -44,8 +95,8 @@ if __name__ == "__main__":
     print(i2ms.keys)
     import matplotlib.pyplot as plt
 
-    x = i2ms.data[:,7]
-    y = i2ms.data[:,10]
+    x = i2ms.data[:, i2ms.mzkey]
+    y = i2ms.data[:, i2ms.slopekey]
 
     mzbins = 1000
     zbins = 0.1
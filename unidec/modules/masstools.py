@@ -569,8 +569,10 @@ class MassSelection(wx.Dialog):
         """
         wx.Dialog.__init__(self, style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER, *args, **kwargs)
         self.matchtype = None
-        self.oligoindexes = None
         self.basemass = 0
+        self.sitepvals = None
+        self.sitemvals = None
+        self.altmatches = None
         self.sdf = None
         self.SetSize((1200, 700))
         self.SetTitle("Mass and Oligomer Tools")
@@ -861,12 +863,11 @@ class MassSelection(wx.Dialog):
         self.sdf = self.sdf.astype(typedict)
         print("Site Data Frame:", self.sdf)
 
-    def get_site_masses_names(self):
+    def get_site_values(self):
         self.get_site_df()
-        indexes, masses, probs, names = matchtools.get_sitematch_list(self.sdf, sites=self.get_site_headers(),
-                                                                      masscolumn="Mass", namecolumn="Name", sort=None)
-        oligomasslist = masses + self.basemass
-        return oligomasslist, indexes, names
+        pvals, mvals, names = matchtools.get_site_values(self.sdf, sites=self.get_site_headers(), masscolumn="Mass",
+                                                         namecolumn="Name")
+        return pvals, mvals, names
 
     def get_site_headers(self):
         col_labels = self.ss.ss.get_col_headers()
@@ -1013,32 +1014,47 @@ class MassSelection(wx.Dialog):
         elif type == "isolated":
             self.oligomasslist, self.oligonames = ud.make_isolated_match(self.oligos)
         elif type == "site":
-            self.oligomasslist, self.oligoindexes, self.oligonames = self.get_site_masses_names()
+            # The site combinations are not built. They are searched directly from the species at each site.
+            self.sitepvals, self.sitemvals, self.oligonames = self.get_site_values()
+            if np.all([len(m) == 0 for m in self.sitemvals]):
+                print("ERROR: Need to specify the Site Species")
+                return
         else:
             print("Match type not recognized")
             return
-        if ud.isempty(self.oligomasslist):
-            print("ERROR: Need to specify the Potential Oligomers")
-            return
         if type != "site":
+            if ud.isempty(self.oligomasslist):
+                print("ERROR: Need to specify the Potential Oligomers")
+                return
             self.matchlist = ud.match(self.pks, self.oligomasslist, self.oligonames, self.oligos,
                                       tolerance=self.tolerance)
         else:
-            self.matchlist = matchtools.site_match(self.pks, self.oligomasslist, self.oligoindexes, self.oligonames,
-                                                   self.get_site_headers(), tolerance=self.tolerance)
+            self.matchlist = matchtools.site_match(self.pks, self.sitepvals, self.sitemvals, self.oligonames,
+                                                   self.get_site_headers(), basemass=self.basemass,
+                                                   tolerance=self.tolerance)
         self.matchlistbox.populate(self.matchlist[0], self.matchlist[1], self.matchlist[2], self.matchlist[3])
         self.matchlistbox.mode = 0
         self.diffmatrix = None
+        self.altmatches = None
 
     def on_check_for_alt_match(self, e=None):
         self.matchlistbox.populate(self.matchlist[0], self.matchlist[1], self.matchlist[2], self.matchlist[3])
         self.matchlistbox.mode = 0
         self.read_tolerance()
-        peakmasses = [p.mass for p in self.pks.peaks]
-        if self.oligomasslist is None:
-            self.on_match()
-        self.diffmatrix = np.subtract.outer(peakmasses, self.oligomasslist)
-        matchcount = np.sum(np.abs(self.diffmatrix) < self.tolerance, axis=1)
+        peakmasses = np.array([p.mass for p in self.pks.peaks])
+        if self.matchtype == "site":
+            if self.sitemvals is None:
+                self.on_match(type="site")
+            # Matches within the tolerance for each peak, with the differences kept per peak
+            self.altmatches = matchtools.sitematch_to_targets(peakmasses - self.basemass, self.sitepvals,
+                                                              self.sitemvals, tolerance=self.tolerance)
+            self.diffmatrix = [peakmasses[i] - (m[1] + self.basemass) for i, m in enumerate(self.altmatches)]
+            matchcount = [len(d) for d in self.diffmatrix]
+        else:
+            if self.oligomasslist is None:
+                self.on_match()
+            self.diffmatrix = np.subtract.outer(peakmasses, self.oligomasslist)
+            matchcount = np.sum(np.abs(self.diffmatrix) < self.tolerance, axis=1)
         for i, c in enumerate(matchcount):
             if c == 0:
                 color = [1, 0, 0]
@@ -1060,19 +1076,21 @@ class MassSelection(wx.Dialog):
 
             self.peakindex = index
             self.peakmass = self.pks.peaks[index].mass
-            b1 = np.abs(self.diffmatrix[index]) < self.tolerance
-            l = np.sum(b1)
-            peakmass = [self.peakmass for i in range(l)]
-            self.diffs = self.diffmatrix[index][b1]
-            self.mmasses = np.array(self.oligomasslist)[b1]
             if self.matchtype != "site":
+                b1 = np.abs(self.diffmatrix[index]) < self.tolerance
+                self.diffs = self.diffmatrix[index][b1]
+                self.mmasses = np.array(self.oligomasslist)[b1]
                 indexes = np.array(self.oligonames)[b1]
                 self.mnames = np.array(
                     [ud.index_to_oname(i, self.oligos[:, 2].astype(int), self.oligos[:, 4]) for i in indexes])
             else:
-                indexes = self.oligoindexes[b1]
+                indexes, masses, probs = self.altmatches[index]
+                self.diffs = self.diffmatrix[index]
+                self.mmasses = masses + self.basemass
                 self.mnames = np.array(
                     [matchtools.index_to_sname(i, self.oligonames, self.get_site_headers()) for i in indexes])
+            l = len(self.diffs)
+            peakmass = [self.peakmass for i in range(l)]
 
             self.matchlistbox.populate(peakmass, self.mmasses, self.diffs, self.mnames)
 
@@ -1212,8 +1230,8 @@ class MassSelection(wx.Dialog):
         :return: None
         """
         self.notebook.SetSelection(1)
-        self.oligomasslist, self.oligoindexes, self.oligonames = self.get_site_masses_names()
-        self.masslistbox.populate(np.unique(self.oligomasslist))
+        pvals, mvals, names = self.get_site_values()
+        self.masslistbox.populate(matchtools.site_unique_masses(mvals) + self.basemass)
 
     def on_clear_masslist(self, e):
         """
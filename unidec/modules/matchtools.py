@@ -38,6 +38,76 @@ def sort_sitematches_by(indexes, masses, probs, type="mass"):
     return sindex, smasses, sprobs
 
 
+def get_site_values(gdf, sites=None, probs_cutoff=0, masscolumn="Monoisotopic mass", namecolumn="Glycan",
+                    percent=True):
+    """
+    Get the probabilities, masses, and names of the species at each site from a DataFrame.
+    See get_sitematch_list for the format of the DataFrame.
+    :param gdf: A pandas DataFrame with the species as rows and the mass, name, and probabilities for each site as columns
+    :param sites: A list of the column names for each of the sites.
+    :param probs_cutoff: Cutoff to remove probabilities below a certain value. Specified in percent.
+    :param masscolumn: The name of the mass
+    :param namecolumn: The name of the column in the DF specifying the species. Default is "Glycan".
+    :param percent: True/False, specifies whether to assume probabilities are provided in percent and thus to divide by 100.
+    :return: pvals, mvals, names. Lists with an array for each site of the probabilities, masses, and names.
+    """
+    # Make data frames for each site with only the glycans with non-zero probability
+    if sites is None:
+        sites = ["S1", "S1", "S2", "S2", "S3", "S3"]
+    dfs = [gdf[gdf[s] > probs_cutoff] for s in sites]
+    # Extract the probs and masses to make it faster
+    if percent:
+        pvals = [dfs[i][s].to_numpy() / 100 for i, s in enumerate(sites)]
+    else:
+        pvals = [dfs[i][s].to_numpy() for i, s in enumerate(sites)]
+    mvals = [dfs[i][masscolumn].to_numpy() for i, s in enumerate(sites)]
+    names = [dfs[i][namecolumn].to_numpy() for i, s in enumerate(sites)]
+    return pvals, mvals, names
+
+
+def site_combinations(pvals, mvals, min_prob=0, maxrest=1):
+    """
+    Build the combinations of species across sites one site at a time.
+    The combinations are in the same order as np.ndindex over the number of species at each site.
+    :param pvals: List of arrays of probabilities for each site
+    :param mvals: List of arrays of masses for each site
+    :param min_prob: Drop partial combinations that cannot reach this probability,
+    even with the most likely species at the remaining sites
+    :param maxrest: Largest probability that any other sites not in pvals can add to a combination
+    :return: indexes, masses, probs for all of the combinations above min_prob
+    """
+    indexes = np.zeros((1, 0), dtype=int)
+    masses = np.zeros(1)
+    probs = np.ones(1)
+    # Largest probability the sites after each site can add
+    maxvals = [np.amax(p) if len(p) > 0 else 0 for p in pvals]
+    restmax = np.append(np.cumprod(maxvals[::-1])[::-1][1:], 1) * maxrest
+    for i in range(0, len(pvals)):
+        n = len(pvals[i])
+        probs = np.multiply.outer(probs, pvals[i]).ravel()
+        masses = np.add.outer(masses, mvals[i]).ravel()
+        parents = np.repeat(np.arange(len(indexes)), n)
+        steps = np.tile(np.arange(n), len(indexes))
+        if min_prob > 0:
+            b1 = probs * restmax[i] >= min_prob
+            probs, masses, parents, steps = probs[b1], masses[b1], parents[b1], steps[b1]
+        indexes = np.column_stack((indexes[parents], steps))
+    return indexes, masses, probs
+
+
+def site_unique_masses(mvals):
+    """
+    Get the unique masses of the combinations of species across sites.
+    Duplicate masses are removed after each site, so only the unique masses are ever combined.
+    :param mvals: List of arrays of masses for each site
+    :return: Sorted array of the unique masses
+    """
+    masses = np.zeros(1)
+    for m in mvals:
+        masses = np.unique(np.add.outer(masses, m))
+    return masses
+
+
 # Function to generate the brute force lists needed for matching
 def get_sitematch_list(gdf, sites=None, probs_cutoff=0,
                        masscolumn="Monoisotopic mass", namecolumn="Glycan", percent=True, sort="mass"):
@@ -47,6 +117,7 @@ def get_sitematch_list(gdf, sites=None, probs_cutoff=0,
     A second column with the mass of the species, specified by masscolumn.
     A third or more columns specifying the probabilities of finding a particular species at that site.
     The names of the columns specifying each site are specified by the sites parameter.
+    For many sites, use sitematch_to_targets, which does not build every combination.
     :param gdf: A pandas DataFrame with the species as rows and the mass, name, and probabilities for each site as columns
     :param sites: A list of the column names for each of the sites.
     Probabilites are provided in each column for each species row at that site.
@@ -61,33 +132,13 @@ def get_sitematch_list(gdf, sites=None, probs_cutoff=0,
     Probs is the probability of that possible combination based on the product of each site.
     Names is the list of names in each site.
     """
-    # Make data frames for each site with only the glycans with non-zero probability
-    if sites is None:
-        sites = ["S1", "S1", "S2", "S2", "S3", "S3"]
-    dfs = [gdf[gdf[s] > probs_cutoff] for s in sites]
-    lens = [len(df) for df in dfs]
-    lsites = len(sites)
-    # Extract the probs and masses to make it faster
-    if percent:
-        pvals = [dfs[i][s].to_numpy() / 100 for i, s in enumerate(sites)]
-    else:
-        pvals = [dfs[i][s].to_numpy() for i, s in enumerate(sites)]
-    mvals = [dfs[i][masscolumn].to_numpy() for i, s in enumerate(sites)]
-    names = [dfs[i][namecolumn].to_numpy() for i, s in enumerate(sites)]
+    pvals, mvals, names = get_site_values(gdf, sites=sites, probs_cutoff=probs_cutoff, masscolumn=masscolumn,
+                                          namecolumn=namecolumn, percent=percent)
 
-    print("Starting to brute force combine...", lens)
+    print("Starting to brute force combine...", [len(p) for p in pvals])
     # Get all possible combinations of each
-    indexes = np.array(list(np.ndindex(tuple(lens))))
+    indexes, masses, probs = site_combinations(pvals, mvals)
     print("Total combinations: ", len(indexes))
-    # Loop through the sites to calculate the probabilities and masses for all indexes
-    probs = np.empty((lsites, len(indexes)))
-    masses = np.empty((lsites, len(indexes)))
-    for i, s in enumerate(sites):
-        inds = indexes[:, i]
-        probs[i] = pvals[i][inds]
-        masses[i] = mvals[i][inds]
-    probs = np.prod(probs, axis=0)
-    masses = np.sum(masses, axis=0)
 
     if sort is not None:
         print("Sorting")
@@ -102,6 +153,199 @@ def get_sitematch_list(gdf, sites=None, probs_cutoff=0,
     return indexes, masses, probs, names
 
 
+def table_max(table, starts, ends):
+    """
+    Maximum of values[start:end] for many ranges at once from a sparse table of the values.
+
+    Level j of the table holds the maximum of each run of 2**j values. Levels are added to the table as longer ranges
+    need them, so the table can be reused for later ranges.
+    :param table: List of levels, starting as [values]. Changed in place.
+    :param starts: Array of start indexes (inclusive)
+    :param ends: Array of end indexes (exclusive). Ranges must not be empty.
+    :return: Array of maximum values for each range
+    """
+    levels = np.frexp(ends - starts)[1] - 1
+    top = np.amax(levels) if len(levels) > 0 else 0
+    while len(table) <= top:
+        step = 1 << (len(table) - 1)
+        table.append(np.maximum(table[-1][:-step], table[-1][step:]))
+    out = np.empty(len(starts))
+    for j in np.unique(levels):
+        sel = levels == j
+        out[sel] = np.maximum(table[j][starts[sel]], table[j][ends[sel] - (1 << j)])
+    return out
+
+
+def keep_top(kept, topn, ntargets, min_prob=0):
+    """
+    Keep the topn most probable matches for each target.
+    :param kept: List of arrays of (target, first half, second half, probability) for each match
+    :param topn: Number of matches to keep for each target
+    :param ntargets: Number of targets
+    :param min_prob: Minimum probability of a match
+    :return: Kept matches, the probability a new match must reach for each target, and whether each target is full
+    """
+    order = np.lexsort((-kept[3], kept[0]))
+    kept = [k[order] for k in kept]
+    ranks = np.arange(len(kept[0])) - np.searchsorted(kept[0], kept[0], side="left")
+    kept = [k[ranks < topn] for k in kept]
+    full = np.bincount(kept[0], minlength=ntargets) >= topn
+    thresholds = np.full(ntargets, float(min_prob))
+    if len(kept[0]) > 0:
+        lasts = np.clip(np.searchsorted(kept[0], np.arange(ntargets), side="right") - 1, 0, None)
+        thresholds = np.where(full, kept[3][lasts], min_prob)
+    return kept, thresholds, full
+
+
+def split_halves(pvals, mvals, min_prob=0):
+    """
+    Build the combinations of the first and second halves of the sites, pruned by min_prob.
+    The first half is sorted by decreasing probability and the second half by mass.
+    :param pvals: List of arrays of probabilities for each site
+    :param mvals: List of arrays of masses for each site
+    :param min_prob: Minimum probability of a full combination
+    :return: (indexes, masses, probs) for each half
+    """
+    split = len(pvals) // 2
+    maxvals = [np.amax(p) if len(p) > 0 else 0 for p in pvals]
+    amaxp = np.prod(maxvals[:split])
+    bmaxp = np.prod(maxvals[split:])
+    aidx, am, ap = site_combinations(pvals[:split], mvals[:split], min_prob=min_prob, maxrest=bmaxp)
+    bidx, bm, bp = site_combinations(pvals[split:], mvals[split:], min_prob=min_prob, maxrest=amaxp)
+    print("Half combinations:", len(ap), len(bp))
+    order = np.argsort(-ap, kind="stable")
+    aidx, am, ap = aidx[order], am[order], ap[order]
+    order = np.argsort(bm, kind="stable")
+    bidx, bm, bp = bidx[order], bm[order], bp[order]
+    return (aidx, am, ap), (bidx, bm, bp)
+
+
+def sitematch_to_targets(targetmasses, pvals, mvals, tolerance=5, topn=None, min_prob=0, maxpairs=1000000):
+    """
+    Match many target masses to combinations of species across sites without building every combination.
+
+    The sites are split into two halves, and the combinations of each half are built separately (pruned by min_prob).
+    The second half is sorted by mass, so the matches for each combination of the first half are a block of the second
+    half found by binary search. The first half is taken in order of decreasing probability. With topn, blocks that
+    cannot beat the topn matches already kept for their target are skipped from the largest probability in the block,
+    and targets drop out once nothing left can beat their topn matches.
+
+    The memory is bounded by maxpairs. At most maxpairs blocks are searched and at most maxpairs matches are expanded
+    at a time, and with topn only the topn matches for each target are kept between them.
+    :param targetmasses: List of target masses
+    :param pvals: List of arrays of probabilities for each site, from get_site_values
+    :param mvals: List of arrays of masses for each site, from get_site_values
+    :param tolerance: Tolerance (in mass units) of the match.
+    :param topn: Number of most probable matches to keep for each target. None to keep all.
+    :param min_prob: Minimum probability of a match
+    :param maxpairs: Largest number of blocks or matches to handle at a time
+    :return: List with (indexes, masses, probs) for each target, sorted by decreasing probability.
+    """
+    targets = np.ravel(np.asarray(targetmasses, dtype=float))
+    ntargets = len(targets)
+    (aidx, am, ap), (bidx, bm, bp) = split_halves(pvals, mvals, min_prob=min_prob)
+    bmax = np.amax(bp) if len(bp) > 0 else 0
+    table = [bp]
+
+    # Matches kept so far as (target, first half, second half, probability)
+    kept = [np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0)]
+    thresholds = np.full(ntargets, float(min_prob))
+    full = np.zeros(ntargets, dtype=bool)
+    start = 0
+    while start < len(ap) and len(bp) > 0:
+        # Skip targets that already have topn matches better than anything left
+        bound = ap[start] * bmax
+        active = np.nonzero((bound > thresholds) | (~full & (bound >= thresholds)))[0]
+        if len(active) == 0:
+            break
+        end = min(start + max(maxpairs // len(active), 1), len(ap))
+        # Block of second half matches for each (first half, target) pair, in order of the first half
+        deltas = targets[np.newaxis, active] - am[start:end, np.newaxis]
+        lo = np.searchsorted(bm, deltas - tolerance, side="right").ravel()
+        hi = np.searchsorted(bm, deltas + tolerance, side="left").ravel()
+        pairs = np.nonzero(hi > lo)[0]
+        aa = start + pairs // len(active)
+        tt = active[pairs % len(active)]
+        lo, hi = lo[pairs], hi[pairs]
+        blockmax = ap[aa] * table_max(table, lo, hi)
+        # Split blocks longer than maxpairs so each piece fits
+        nsplit = (hi - lo - 1) // maxpairs + 1
+        if np.any(nsplit > 1):
+            sub = np.arange(np.sum(nsplit)) - np.repeat(np.cumsum(nsplit) - nsplit, nsplit)
+            aa, tt, blockmax = np.repeat(aa, nsplit), np.repeat(tt, nsplit), np.repeat(blockmax, nsplit)
+            lo, hi = np.repeat(lo, nsplit) + sub * maxpairs, np.repeat(hi, nsplit)
+            hi = np.minimum(hi, lo + maxpairs)
+
+        first = 0
+        while first < len(lo):
+            # Take blocks in order until they hold maxpairs matches, dropping those that cannot beat their target
+            window = slice(first, first + maxpairs)
+            good = blockmax[window] >= thresholds[tt[window]]
+            counts = np.where(good, hi[window] - lo[window], 0)
+            last = first + max(np.searchsorted(np.cumsum(counts), maxpairs, side="right"), 1)
+            counts = counts[:last - first]
+            total = np.sum(counts)
+            if total > 0:
+                blocks = np.repeat(np.arange(first, last), counts)
+                bb = lo[blocks] + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                pp = ap[aa[blocks]] * bp[bb]
+                b1 = pp >= thresholds[tt[blocks]]
+                new = [tt[blocks][b1], aa[blocks][b1], bb[b1], pp[b1]]
+                kept = [np.concatenate((k, v)) for k, v in zip(kept, new)]
+                if topn is not None:
+                    kept, thresholds, full = keep_top(kept, topn, ntargets, min_prob=min_prob)
+            first = last
+        start = end
+
+    results = []
+    order = np.lexsort((-kept[3], kept[0]))
+    kept = [k[order] for k in kept]
+    bounds = np.searchsorted(kept[0], np.arange(ntargets + 1), side="left")
+    for i in range(0, ntargets):
+        aa = kept[1][bounds[i]:bounds[i + 1]]
+        bb = kept[2][bounds[i]:bounds[i + 1]]
+        indexes = np.column_stack((aidx[aa], bidx[bb])).astype(int)
+        results.append((indexes, am[aa] + bm[bb], kept[3][bounds[i]:bounds[i + 1]]))
+    return results
+
+
+def nearest_site_combinations(targetmasses, pvals, mvals, maxpairs=1000000):
+    """
+    Find the combination of species across sites with the mass nearest to each target, without building every
+    combination. As in sitematch_to_targets, the nearest second half combination to each target minus each first half
+    combination is found by binary search, for at most maxpairs pairs at a time.
+    :param targetmasses: List of target masses
+    :param pvals: List of arrays of probabilities for each site, from get_site_values
+    :param mvals: List of arrays of masses for each site, from get_site_values
+    :param maxpairs: Largest number of (first half, target) pairs to search at a time
+    :return: Indexes (targets x sites), masses, and probabilities of the nearest combination for each target.
+    None if there are no combinations.
+    """
+    targets = np.ravel(np.asarray(targetmasses, dtype=float))
+    ntargets = len(targets)
+    (aidx, am, ap), (bidx, bm, bp) = split_halves(pvals, mvals)
+    if len(am) == 0 or len(bm) == 0:
+        return None
+    besterr = np.full(ntargets, np.inf)
+    besta = np.zeros(ntargets, dtype=int)
+    bestb = np.zeros(ntargets, dtype=int)
+    step = max(maxpairs // max(ntargets, 1), 1)
+    for start in range(0, len(am), step):
+        deltas = targets[np.newaxis, :] - am[start:start + step, np.newaxis]
+        right = np.clip(np.searchsorted(bm, deltas), 0, len(bm) - 1)
+        left = np.clip(right - 1, 0, len(bm) - 1)
+        bb = np.where(np.abs(bm[left] - deltas) <= np.abs(bm[right] - deltas), left, right)
+        errs = np.abs(bm[bb] - deltas)
+        rows = np.argmin(errs, axis=0)
+        cols = np.arange(ntargets)
+        better = errs[rows, cols] < besterr
+        besterr = np.where(better, errs[rows, cols], besterr)
+        besta = np.where(better, start + rows, besta)
+        bestb = np.where(better, bb[rows, cols], bestb)
+    indexes = np.column_stack((aidx[besta], bidx[bestb])).astype(int)
+    return indexes, am[besta] + bm[bestb], ap[besta] * bp[bestb]
+
+
 def sitematch_to_target(targetmass, indexes, masses, probs, tolerance=5):
     """
     Function to match a particular target mass to combinations provided
@@ -127,36 +371,37 @@ def index_to_sname(index, names, sitenames):
     return fullname
 
 
-def site_match(pks, oligomasslist, oligoindexes, onames, sitenames, tolerance=None):
+def site_match(pks, pvals, mvals, onames, sitenames, basemass=0, tolerance=None):
+    """
+    Match each peak to the combination of species across sites with the nearest mass.
+    :param pks: Peaks object. The label, match, and matcherror of each peak are set.
+    :param pvals: List of arrays of probabilities for each site, from get_site_values
+    :param mvals: List of arrays of masses for each site, from get_site_values
+    :param onames: List of arrays of names for each site, from get_site_values
+    :param sitenames: List of names of the sites
+    :param basemass: Mass added to every combination
+    :param tolerance: Largest error for a peak to be labeled with its match. None for no limit.
+    :return: Array of the peak masses, matched masses, errors, and names
+    """
     print("Starting Match")
     starttime = time.perf_counter()
-    matches = []
-    errors = []
-    peaks = []
+    peaks = pks.get_values("mass")
+    nearest = nearest_site_combinations(peaks - basemass, pvals, mvals)
+    if nearest is None:
+        print("No site combinations to match")
+        return np.array([[], [], [], []])
+    indexes, matches, probs = nearest
+    matches = matches + basemass
+    errors = peaks - matches
     names = []
-    # print(len(oligomasslist), oligomasslist)
-    # print(len(oligoindexes), oligoindexes)
-    # print(onames)
-
-    for i in range(0, pks.plen):
-        p = pks.peaks[i]
-        target = p.mass
-        nearpt = nearestunsorted(oligomasslist, target)
-        match = oligomasslist[nearpt]
-        error = target - match
-
-        if tolerance is None or np.abs(error) < tolerance:
-            name = index_to_sname(oligoindexes[nearpt], onames, sitenames)
+    for i in range(0, len(peaks)):
+        if tolerance is None or np.abs(errors[i]) < tolerance:
+            names.append(index_to_sname(indexes[i], onames, sitenames))
         else:
-            name = ""
-
-        p.label = name
-        p.match = match
-        p.matcherror = error
-        matches.append(match)
-        errors.append(error)
-        peaks.append(target)
-        names.append(name)
+            names.append("")
+    pks.set_values("label", names)
+    pks.set_values("match", matches)
+    pks.set_values("matcherror", errors)
 
     matchlist = [peaks, matches, errors, names]
     endtime = time.perf_counter()
@@ -164,27 +409,27 @@ def site_match(pks, oligomasslist, oligoindexes, onames, sitenames, tolerance=No
     return np.array(matchlist)
 
 
-def sitematch_to_excel(indexes, masses, probs, names, peakmasses, protmass, sites, outfile):
+def sitematch_to_excel(pvals, mvals, names, peakmasses, protmass, sites, outfile, tolerance=5, topn=None, min_prob=0):
     """
-    Write out an Excel file with the potential matches for each peak
-    :param indexes: Indexes list from get_sitematch_list
-    :param masses: Masses list from get_sitematch_list
-    :param probs: Probs list from get_sitematch_list
-    :param names: Names list from get_sitematch_list
+    Write out an Excel file with the potential matches for each peak.
+    The matches for all peaks are found together with sitematch_to_targets, without building every combination.
+    :param pvals: List of arrays of probabilities for each site, from get_site_values
+    :param mvals: List of arrays of masses for each site, from get_site_values
+    :param names: List of arrays of names for each site, from get_site_values
     :param peakmasses: List of peak masses to match against. Each will have its own sheet of potential masses in the excel file
     :param protmass: Mass of the constant protein to add to each possible mod to
-    :param sites: List of site names to output. Doesn't need to match the get_sitematch_list above.
+    :param sites: List of site names to output. Doesn't need to match the get_site_values above.
     :param outfile: Excel file path to write to.
+    :param tolerance: Tolerance (in mass units) of the match.
+    :param topn: Number of most probable matches to write for each peak. None to write all.
+    :param min_prob: Minimum probability of a match
     :return: None
     """
+    peakdeltas = np.asarray(peakmasses, dtype=float) - protmass
+    results = sitematch_to_targets(peakdeltas, pvals, mvals, tolerance=tolerance, topn=topn, min_prob=min_prob)
     with pd.ExcelWriter(outfile) as writer:
         # Loop through all peaks
-        for mass in peakmasses:
-            # Calculate the difference in mass between the measured peak and the protein mass
-            peakdelta = mass - protmass
-            # Match the glycan masses to the delta mass
-            matchindexes, matchmasses, matchprobs = sitematch_to_target(peakdelta, indexes, masses, probs)
-
+        for mass, peakdelta, (matchindexes, matchmasses, matchprobs) in zip(peakmasses, peakdeltas, results):
             # Create DataFrame and load with key data
             matchdf = pd.DataFrame()
             matchdf["Measured Delta Mass"] = np.zeros_like(matchmasses) + peakdelta
@@ -493,9 +738,9 @@ def UPP_check_peaks(row, pks, tol, vmoddf=None, fmoddf=None, favor="Closest", in
     # Get Peak Masses and Heights
     peakmasses = pks.masses
     if integrate:
-        peakheights = [p.integral for p in pks.peaks]
+        peakheights = pks.get_values("integral")
     else:
-        peakheights = [p.height for p in pks.peaks]
+        peakheights = pks.get_values("height")
 
 
     # Get the favored match
@@ -699,11 +944,11 @@ def dar_calc(pks, protein_mass, drug_mass, min_drugs, max_drugs, tolerance, inte
     :return: The DAR
     """
     # Get the peaks
-    peak_masses = np.array([p.mass for p in pks.peaks])
+    peak_masses = pks.get_values("mass")
     if integrate:
-        peak_heights = np.array([p.integral for p in pks.peaks])
+        peak_heights = pks.get_values("integral")
     else:
-        peak_heights = np.array([p.height for p in pks.peaks])
+        peak_heights = pks.get_values("height")
     # Set all peaks to yellow
     for p in pks.peaks:
         p.color = [1, 1, 0]
@@ -9,6 +9,7 @@ from wx.lib.agw import ultimatelistctrl as ulc
 from unidec import tools as ud
 from unidec.modules import PlottingWindow
 from unidec.modules import MassFitter
+from unidec.modules import nativeztools as nzt
 
 __author__ = 'Michael.Marty'
 
@@ -356,16 +357,8 @@ class NativeZ(wx.Dialog):
         :param zwidth: Tolerance window for the offset to be summed.
         :return: None
         """
-        frange = np.arange(minval, maxval, 0.5)
-        mgrid, zgrid = np.meshgrid(self.massaxis, self.chargeaxis, indexing='ij')
-        self.offset_grid = ud.get_z_offset(mgrid, zgrid)
-        ftot = []
-        for f in frange:
-            bool1 = self.offset_grid >= f - zwidth
-            bool2 = self.offset_grid < f + zwidth
-            bool3 = np.all([bool1, bool2], axis=0)
-            ftot.append([f, np.sum(self.igrid[bool3])])
-        self.offset_totals = np.array(ftot)
+        self.offset_grid = nzt.make_offset_grid(self.massaxis, self.chargeaxis)
+        self.offset_totals = nzt.offset_totals(self.offset_grid, self.igrid, minval, maxval, zwidth=zwidth)
 
     def fast_extract(self, f, width, eshape):
         """
@@ -375,18 +368,9 @@ class NativeZ(wx.Dialog):
         :param eshape: Shape of the extraction
         0 = Box (+/- is a hard cutoff)
         1 = Gaussian (+/- is std deviation of Gaussian)
-        :return: masked intensity values from self.igrid for a specific charge offset
-        """
-        if eshape == 1:
-            width *= 3.
-        bool1 = self.offset_grid >= f - width
-        bool2 = self.offset_grid < f + width
-        bool3 = np.all([bool1, bool2], axis=0)
-        out = self.igrid * bool3
-        if eshape == 1:
-            wgrid = np.exp(-((self.offset_grid - f) ** 2.) / (2. * width * width))
-            out = out * wgrid
-        return out
+        :return: Intensity values from self.igrid for a specific charge offset, summed over charge
+        """
+        return nzt.extract_offsets(self.offset_grid, self.igrid, [f], [width], eshape=eshape)[0]
 
     def get_maxima(self):
         """
@@ -422,10 +406,11 @@ class NativeZ(wx.Dialog):
         self.massoffset = float(self.ctlmassoffset.GetValue())
 
         tstart = time.perf_counter()
+        # Extract mass v. intensity values for the offsets in self.zoffs
+        extracts = nzt.extract_offsets(self.offset_grid, self.igrid, [z.offset for z in self.zoffs],
+                                       [z.extractwidth for z in self.zoffs], eshape=eshape)
         for i, z in enumerate(self.zoffs):
-            # Extract mass v. intensity values for the offsets in self.zoffs
-            intensity = self.fast_extract(z.offset, z.extractwidth, eshape)
-            z.extract = np.transpose([self.massaxis + z.nstate * self.massoffset, np.sum(intensity, axis=1)])
+            z.extract = np.transpose([self.massaxis + z.nstate * self.massoffset, extracts[i]])
             # Update plot2
             if not self.plot2.flag:
                 self.plot2.plotrefreshtop(z.extract[:, 0], z.extract[:, 1], title="Extracted Intensities",
@@ -451,9 +436,6 @@ class NativeZ(wx.Dialog):
         :return: None
         """
         # TODO: Add extra peaks here to compensate for shifts in the peaks.
-        peakextracts = np.zeros((len(self.zoffs), self.pks.plen))
-        peakextractsarea = np.zeros((len(self.zoffs), self.pks.plen))
-
         try:
             xvals = self.pks.masses
         except AttributeError:
@@ -462,15 +444,10 @@ class NativeZ(wx.Dialog):
 
         if xvals is not None:
             # Extraction
-            for i, z in enumerate(self.zoffs):
-                for j, p in enumerate(self.pks.peaks):
-                    x = z.extract[:, 0]
-                    y = z.extract[:, 1]
-                    index = ud.nearest(x, p.mass)
-                    peakextracts[i, j] = ud.localmax2(y, index, int(self.config.peakwindow / self.config.massbins))
-                    if not ud.isempty(p.integralrange):
-                        integral, intdat = ud.integrate(z.extract, p.integralrange[0], p.integralrange[1])
-                        peakextractsarea[i, j] = integral
+            peakextracts, peakextractsarea = nzt.peak_extract(
+                self.massaxis, [z.extract[:, 1] for z in self.zoffs], [z.nstate * self.massoffset for z in self.zoffs],
+                self.pks.get_values("mass"), int(self.config.peakwindow / self.config.massbins),
+                [p.integralrange for p in self.pks.peaks])
 
             # Switch to subunit numbers
             if self.massoffset > 0:
@@ -0,0 +1,124 @@
+import numpy as np
+from unidec import tools as ud
+
+__author__ = 'Michael.Marty'
+
+
+def make_offset_grid(massaxis, chargeaxis):
+    """
+    Calculate the charge offset at each point on a mass and charge grid.
+    :param massaxis: Mass axis values
+    :param chargeaxis: Charge axis values
+    :return: Grid of charge offsets (mass x charge)
+    """
+    mgrid, zgrid = np.meshgrid(massaxis, chargeaxis, indexing='ij')
+    return ud.get_z_offset(mgrid, zgrid)
+
+
+def offset_totals(offsetgrid, igrid, minval, maxval, zwidth=1, step=0.5):
+    """
+    Calculate the total intensity for each charge offset value +/- zwidth.
+
+    The grid is binned once with np.bincount between the edges of all of the windows, and each window is then the sum
+    of the bins between its edges.
+    :param offsetgrid: Grid of charge offsets from make_offset_grid
+    :param igrid: Intensities at each point on the grid
+    :param minval: Minimum charge offset value
+    :param maxval: Maximum charge offset value
+    :param zwidth: Tolerance window for the offset to be summed
+    :param step: Spacing of the charge offset values
+    :return: Array of charge offset values and total intensities (N x 2)
+    """
+    frange = np.arange(minval, maxval, step)
+    lows = frange - zwidth
+    highs = frange + zwidth
+    edges = np.unique(np.concatenate((lows, highs)))
+    # Bin k holds the points with edges[k] <= offset < edges[k + 1]
+    bins = np.searchsorted(edges, np.ravel(offsetgrid), side="right") - 1
+    b1 = bins >= 0
+    binsums = np.bincount(bins[b1], weights=np.ravel(igrid)[b1], minlength=len(edges))
+    totals = ud.range_sum(binsums, np.searchsorted(edges, lows), np.searchsorted(edges, highs))
+    return np.transpose([frange, totals])
+
+
+def extract_offsets(offsetgrid, igrid, offsets, widths, eshape=0):
+    """
+    Extract the intensity at each mass for several charge offsets, summed over charge.
+    :param offsetgrid: Grid of charge offsets from make_offset_grid
+    :param igrid: Intensities at each point on the grid (mass x charge)
+    :param offsets: List of charge offsets
+    :param widths: List of widths of the extraction (+/- from each charge offset)
+    :param eshape: Shape of the extraction
+    0 = Box (+/- is a hard cutoff)
+    1 = Gaussian (+/- is std deviation of Gaussian)
+    :return: Extracted intensities (offsets x mass)
+
+    As in offset_totals, the grid is binned once between the edges of all of the windows. Box extracts are the sums of
+    the bins of each mass between the edges of each window. Gaussian extracts weight only the points in the bins of
+    each window, which are found in one sort of the grid by bin.
+    """
+    offsets = np.asarray(offsets, dtype=float)
+    widths = np.asarray(widths, dtype=float)
+    if eshape == 1:
+        widths = widths * 3.
+    lows = offsets - widths
+    highs = offsets + widths
+    edges = np.unique(np.concatenate((lows, highs)))
+    starts = np.searchsorted(edges, lows)
+    ends = np.searchsorted(edges, highs)
+    nmass = len(igrid)
+    ivals = np.ravel(igrid)
+    rows = np.repeat(np.arange(nmass), np.shape(igrid)[1])
+    # Bin k holds the points with edges[k] <= offset < edges[k + 1]
+    bins = np.searchsorted(edges, np.ravel(offsetgrid), side="right") - 1
+    b1 = bins >= 0
+
+    if eshape != 1:
+        binsums = np.bincount(rows[b1] * len(edges) + bins[b1], weights=ivals[b1], minlength=nmass * len(edges))
+        return np.transpose(ud.range_sum(np.reshape(binsums, (nmass, len(edges))), starts, ends))
+
+    extracts = np.zeros((len(offsets), nmass))
+    order = np.argsort(bins, kind="stable")
+    sortedbins = bins[order]
+    firsts = np.searchsorted(sortedbins, starts)
+    lasts = np.searchsorted(sortedbins, ends)
+    offvals = np.ravel(offsetgrid)
+    for i, (f, width) in enumerate(zip(offsets, widths)):
+        points = order[firsts[i]:lasts[i]]
+        if len(points) > 0:
+            wvals = np.exp(-((offvals[points] - f) ** 2.) / (2. * width * width))
+            extracts[i] = np.bincount(rows[points], weights=ivals[points] * wvals, minlength=nmass)
+    return extracts
+
+
+def peak_extract(massaxis, extracts, shifts, peakmasses, window, integralranges=None):
+    """
+    Extract the local max (height) and area of each peak from each extracted mass distribution.
+    :param massaxis: Mass axis values
+    :param extracts: Extracted intensities (offsets x mass) from extract_offsets
+    :param shifts: Mass shift added to the mass axis for each extract
+    :param peakmasses: Peak masses
+    :param window: Window for the local max in number of data points (+/- from the nearest point)
+    :param integralranges: List of [min, max] integration ranges for each peak. Empty ranges give an area of 0.
+    :return: Heights and areas (offsets x peaks)
+    """
+    peakmasses = np.asarray(peakmasses, dtype=float)
+    heights = np.zeros((len(extracts), len(peakmasses)))
+    areas = np.zeros((len(extracts), len(peakmasses)))
+    if integralranges is None:
+        integralranges = [[] for p in peakmasses]
+    hasrange = np.array([not ud.isempty(r) for r in integralranges], dtype=bool)
+    ranges = np.array([r if h else [0, 0] for r, h in zip(integralranges, hasrange)], dtype=float).reshape(-1, 2)
+
+    for i, (y, shift) in enumerate(zip(extracts, shifts)):
+        x = massaxis + shift
+        # Heights from the local max around the nearest point to each peak
+        index = ud.nearest_array(x, peakmasses)
+        starts = np.clip(index - window, 0, len(x))
+        ends = np.clip(index + window, 0, len(x))
+        vals = ud.range_max(y, starts, ends)
+        heights[i] = np.where(ends > starts, vals, 0)
+        # Areas from the trapezoid integral over the points strictly inside each integration range
+        if np.any(hasrange):
+            areas[i] = np.where(hasrange, ud.integrate_array(np.transpose([x, y]), ranges[:, 0], ranges[:, 1]), 0)
+    return heights, areas
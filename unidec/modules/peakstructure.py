@@ -1,86 +1,174 @@
 from __future__ import unicode_literals
 import string
-import math
 # import matplotlib.cm as cm
 import matplotlib as mpl
 from matplotlib.colors import Normalize
 import numpy as np
 from unidec import tools as ud
 import pandas as pd
-from io import StringIO
 
 __author__ = 'Michael.Marty'
 
 
+# Attributes of each peak, as (dtype, default). Numeric attributes are stored as NumPy columns in Peaks. Others are
+# stored in object columns. A numeric column is promoted if a value that does not fit is set. Float columns with an
+# integer default start as integer columns, so integer values are written as integers, as they were set.
+peak_columns = {
+    "mass": (float, 0), "height": (float, 0), "ccs": (float, 0), "centroid": (float, 0), "area": (float, 0),
+    "color": (object, [1, 1, 1]), "label": (object, ""), "marker": (object, "."), "textmarker": (object, "."),
+    "ignore": (np.int64, 0), "match": (float, 0), "matcherror": (float, 0), "altmatches": (object, []),
+    "altmatcherrors": (object, []), "numberalts": (np.int64, 0), "integral": (float, 0),
+    "integralrange": (object, []), "mztab": (object, []), "mztab2": (object, []), "stickdat": (object, []),
+    "kendricknum": (float, 0), "kendrickdefect": (float, 0), "kmass": (float, 0), "score": (float, 0),
+    "mztabi": (object, []), "massavg": (float, 0), "masserr": (float, 0), "peakmasses": (object, []),
+    "diff": (float, 0), "extracts": (object, []), "errorFWHM": (float, 0), "intervalFWHM": (object, [0, 0]),
+    "badFWHM": (bool, False), "errormean": (float, -1), "errorreplicate": (float, 0), "avgcharge": (float, 0),
+    "zstack": (object, []), "mzstack": (object, []), "mscore": (float, 0), "uscore": (float, 0),
+    "cs_score": (float, 0), "rsquared": (float, 0), "fscore": (float, 0), "dscore": (float, 0), "lscore": (float, 0),
+    "mdist": (object, None), "zdist": (object, None), "estimatedarea": (float, 0), "index": (np.int64, 0),
+    "sdnum": (float, 0), "sdval": (float, 0), "filename": (object, ""), "filenumber": (np.int64, -1)}
+
+# Columns written by Peaks.copy and Peaks.to_df as (header, attribute, position in the attribute or None)
+full_outputs = [("Symbol", "textmarker", None), ("Mass", "mass", None), ("Centroid", "centroid", None),
+                ("Height", "height", None), ("Integral", "integral", None), ("Match", "match", None),
+                ("Matcherror", "matcherror", None), ("Label", "label", None), ("Fit Area", "area", None),
+                ("Diff", "diff", None), ("Avgcharge", "avgcharge", None), ("Dscore", "dscore", None),
+                ("FWHM", "errorFWHM", None), ("LowValFWHM", "intervalFWHM", 0), ("HighValFWHM", "intervalFWHM", 1),
+                ("ErrorMean", "errormean", None), ("ErrorReplicate", "errorreplicate", None),
+                ("NumMatches", "numberalts", None), ("AltMatches", "altmatches", None)]
+output_columns = {"Full": full_outputs,
+                  "Basic": [("Mass", "mass", None), ("Height", "height", None), ("Integral", "integral", None)],
+                  "FullFiles": full_outputs + [("FileName", "filename", None), ("FileNumber", "filenumber", None)]}
+
+# Strings that pandas.read_csv reads as missing, which to_df writes as empty strings
+na_strings = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
+              'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+value_kinds = "bifO"
+
+# Types of the values that can be stored in a column of each kind without promoting it
+kind_types = {"b": (bool, np.bool_), "i": (bool, np.bool_, int, np.integer),
+              "f": (bool, np.bool_, int, np.integer, float, np.floating), "O": object}
+
+
+def value_kind(value):
+    """
+    Get the kind of a single value: b for bool, i for int, f for float, and O for anything else.
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return "b"
+    if isinstance(value, (int, np.integer)):
+        return "i"
+    if isinstance(value, (float, np.floating)):
+        return "f"
+    return "O"
+
+
+def object_column(values):
+    """
+    Make an object array with one element for each item in values, even if the items are lists or arrays.
+    """
+    out = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        out[i] = v
+    return out
+
+
+def storage_dtype(name):
+    """
+    Get the dtype that a column starts with before any values are set
+    """
+    dtype, default = peak_columns[name]
+    if dtype is float and value_kind(default) == "i":
+        return np.int64
+    return dtype
+
+
+def default_column(name, n):
+    """
+    Make a column of n default values for a peak attribute. Mutable defaults are copied for each peak.
+    """
+    dtype, default = peak_columns[name]
+    if isinstance(default, list):
+        return object_column([list(default) for i in range(n)])
+    return np.full(n, default, dtype=storage_dtype(name))
+
+
+def round_value(o, rounding=3):
+    if rounding is not None:
+        try:
+            o = round(o, rounding)
+        except:
+            pass
+    return o
+
+
+def format_value(o, rounding=3):
+    """
+    Format a peak value as a string for line_out. Lists and arrays are written with a space after each item.
+    """
+    if isinstance(o, (list, np.ndarray)):
+        return "".join(str(round_value(oo, rounding)) + " " for oo in o)
+    return str(round_value(o, rounding))
+
+
+def format_column(values, default, rounding=3):
+    """
+    Format a column of peak values as strings, giving the same strings as format_value for each value.
+    Values equal to the default are written the way the default is written.
+    :param values: Array of values
+    :param default: Default value of the column
+    :param rounding: Number of decimal places to round to, or None
+    :return: Object array of strings
+    """
+    if values.dtype == object:
+        return object_column([v if type(v) is str else
+                              format_value(default if value_kind(v) != "O" and v == default else v, rounding)
+                              for v in values])
+    strings = values
+    if rounding is not None and values.dtype.kind == "f":
+        strings = np.round(values, rounding)
+    strings = strings.astype(str).astype(object)
+    strings[values == default] = format_value(default, rounding)
+    return strings
+
+
 class Peak:
     """
     Class for a single peak. Contains all key parameters for describing and plotting the peak.
+
+    The values are stored in the columns of a Peaks object, and each Peak is a view of one row.
+    A Peak made on its own is the only row of its own Peaks. A Peak belongs to one Peaks at a time.
     """
 
-    def __init__(self):
+    def __init__(self, pks=None, index=0):
         """
         Initialize all parameters for the peak to defaults
+        :param pks: Peaks object holding the values. None to make a new one for this peak.
+        :param index: Row of this peak in pks
         """
-        self.mass = 0
-        self.height = 0
-        self.ccs = 0
-        self.centroid = 0
-        self.area = 0
-        self.color = [1, 1, 1]
-        self.label = ""
-        self.marker = "."
-        self.textmarker = "."
-        self.ignore = 0
-        self.match = 0
-        self.matcherror = 0
-        self.altmatches = []
-        self.altmatcherrors = []
-        self.numberalts = 0
-        self.integral = 0
-        self.integralrange = []
-        self.mztab = []
-        self.mztab2 = []
-        self.stickdat = []
-        self.kendricknum = 0
-        self.kendrickdefect = 0
-        self.kmass = 0
-        self.score = 0
-        # self.corrint = 0
-        # self.correrr = 0
-        self.mztabi = []
-        self.massavg = 0
-        self.masserr = 0
-        # self.tval = 0
-        self.peakmasses = []
-        # self.fitmassavg = 0
-        # self.fitmasserr = 0
-        # self.fitarea = 0
-        # self.fitareaerr = 0
-        self.diff = 0
-        self.extracts = []
-        self.errorFWHM = 0
-        self.intervalFWHM = [0, 0]
-        self.badFWHM = False
-        self.errormean = -1
-        self.errorreplicate = 0
-        self.avgcharge = 0
-        self.zstack = []
-        self.mzstack = []
-        self.mscore = 0
-        self.uscore = 0
-        self.cs_score = 0
-        self.rsquared = 0
-        self.fscore = 0
-        self.dscore = 0
-        self.lscore = 0
-        self.mdist = None
-        self.zdist = None
-        self.estimatedarea = 0
-        self.index = 0
-        self.sdnum = 0
-        self.sdval = 0
-        self.filename = ""
-        self.filenumber = -1
+        if pks is None:
+            pks = Peaks()
+            pks.add_rows(1)
+            pks.set_views([self])
+        self._pks = pks
+        self._index = index
+
+    def __setattr__(self, name, value):
+        if name not in peak_columns:
+            object.__setattr__(self, name, value)
+            return
+        pks = self._pks
+        if pks.dirty or len(pks.pending) > 0:
+            pks.sync()
+            pks = self._pks
+        col = pks.columns.get(name)
+        if col is not None and isinstance(value, kind_types.get(col.dtype.kind, ())):
+            col[self._index] = value
+        else:
+            pks.set_value(name, self._index, value)
+            col = pks.columns[name]
+        self.__dict__[name] = col[self._index]
 
     def line_out(self, type="Full", rounding=3):
         if type == "Full":
@@ -100,31 +188,82 @@ class Peak:
             outputs = [self.mass, self.height]
         outstring = ""
         for o in outputs:
-            # Check if o is a list or array
-            if isinstance(o, (list, np.ndarray)):
-                for oo in o:
-                    if rounding is not None:
-                        try:
-                            oo = round(oo, rounding)
-                        except:
-                            pass
-                    outstring += str(oo) + " "
-                outstring += "\t"
-            else:
-                if rounding is not None:
-                    try:
-                        o=round(o, rounding)
-                    except:
-                        pass
-                outstring += str(o) + "\t"
+            outstring += format_value(o, rounding) + "\t"
         return outstring
 
 
+class PeakColumn:
+    """
+    Attribute of Peak that reads one column of the Peaks that holds the peak.
+    The value read is kept on the Peak, so later reads are plain attribute lookups until the column is set again.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, peak, owner=None):
+        if peak is None:
+            return self
+        pks = peak._pks
+        if pks.dirty or len(pks.pending) > 0:
+            # Syncing may move this peak to a new row or detach it to a new Peaks
+            pks.sync()
+            pks = peak._pks
+        col = pks.columns.get(self.name)
+        if col is None:
+            value = pks.get_value(self.name, peak._index)
+        else:
+            value = col[peak._index]
+        peak.__dict__[self.name] = value
+        return value
+
+
+for _name in peak_columns:
+    setattr(Peak, _name, PeakColumn(_name))
+
+
+class PeakList(list):
+    """
+    List of the Peak views of a Peaks object. Changes to the list are synced to the columns the next time they are used.
+    """
+
+    def __init__(self, owner, views=()):
+        list.__init__(self, views)
+        self.owner = owner
+
+
+def list_mutator(name):
+    method = getattr(list, name)
+
+    def mutate(self, *args, **kwargs):
+        # Unpickling fills the list before the owner is set, so there is nothing to flag yet
+        owner = self.__dict__.get("owner")
+        if owner is None:
+            return method(self, *args, **kwargs)
+        # Flag after the change, and sync before a sort, so that reads during a sort use the current rows
+        if name == "sort":
+            owner.sync()
+        out = method(self, *args, **kwargs)
+        owner.dirty = True
+        return out
+
+    mutate.__name__ = name
+    return mutate
+
+
+for _name in ["append", "extend", "insert", "pop", "remove", "sort", "reverse", "clear", "__setitem__", "__delitem__",
+              "__iadd__", "__imul__"]:
+    setattr(PeakList, _name, list_mutator(_name))
+
+
 class Peaks:
     """
     Class containing all useful data about peaks.
 
-    The peaks themselves are of the Peak class and contained within the self.peaks list.
+    The values for the peaks are stored as columns, with one NumPy array for each attribute in peak_columns.
+    Bulk operations work on the columns. Use get_values and set_values to get and set a column for all peaks.
+    The self.peaks list holds a Peak view of each row for code that works with one peak at a time.
+    It is only made when it is first used, and any changes to the list are synced back to the columns.
     """
 
     def __init__(self):
@@ -132,8 +271,12 @@ class Peaks:
         Initialize Peaks class and set empty values
         :return: None
         """
-        self.peaks = []
-        self.plen = 0
+        self.length = 0
+        self.columns = {}
+        self.pending = []
+        self.views = None
+        self.bound = []
+        self.dirty = False
         self.changed = 0
         self.masses = []
         self.heights = []
@@ -151,6 +294,207 @@ class Peaks:
         self.norm = 1
         self.uniscore = 0
 
+    @property
+    def peaks(self):
+        """
+        List of Peak views for each row
+        """
+        self.sync()
+        if self.views is None:
+            self.set_views([Peak(self, i) for i in range(0, self.length)])
+        return self.views
+
+    @peaks.setter
+    def peaks(self, peaks):
+        self.rebuild(list(peaks))
+
+    @property
+    def plen(self):
+        """
+        Number of peaks
+        """
+        self.sync()
+        return self.length
+
+    def set_views(self, views):
+        self.views = PeakList(self, views)
+        self.bound = list(views)
+
+    def sync(self):
+        """
+        Add any pending rows to the columns, and rebuild the columns from the list of peaks if the list was changed
+        :return: None
+        """
+        self.flush()
+        if self.dirty:
+            self.dirty = False
+            self.rebuild(list(self.views))
+
+    def flush(self):
+        """
+        Join any pending rows from add_rows onto the columns
+        :return: None
+        """
+        if len(self.pending) > 0:
+            parts = [(self.columns, self.length - sum(n for c, n in self.pending))] + self.pending
+            self.pending = []
+            for name in set(k for c, n in parts for k in c):
+                cols = [c[name] if name in c else default_column(name, n) for c, n in parts]
+                if any(c.dtype == object for c in cols):
+                    cols = [c.astype(object) for c in cols]
+                self.columns[name] = np.concatenate(cols)
+
+    def rebuild(self, views):
+        """
+        Rebuild the columns from a list of Peak views, which may come from other Peaks objects.
+        Peaks that were in this object but are not in the list are detached with a copy of their values.
+        :param views: List of Peak objects
+        :return: None
+        """
+        self.flush()
+        self.dirty = False
+        owners = {}
+        for v in views:
+            if v._pks is not self:
+                owners[id(v._pks)] = v._pks
+        for o in owners.values():
+            o.sync()
+        owners[id(self)] = self
+        # Positions in the new list and rows in the owner for the views from each owner
+        groups = {}
+        for pos, v in enumerate(views):
+            group = groups.setdefault(id(v._pks), ([], []))
+            group[0].append(pos)
+            group[1].append(v._index)
+        groups = [(owners[k], np.array(g[0], dtype=int), np.array(g[1], dtype=int)) for k, g in groups.items()]
+
+        columns = {}
+        names = set(k for o, pos, rows in groups for k in o.columns)
+        for name in names:
+            parts = [o.columns[name] for o, pos, rows in groups if name in o.columns]
+            if any(c.dtype == object for c in parts):
+                col = default_column(name, len(views)).astype(object)
+            else:
+                col = default_column(name, len(views))
+                col = col.astype(np.result_type(col.dtype, *[c.dtype for c in parts]))
+            for o, pos, rows in groups:
+                if name in o.columns:
+                    col[pos] = o.columns[name][rows]
+            columns[name] = col
+
+        kept = set(id(v) for v in views)
+        for v in self.bound:
+            if id(v) not in kept and v._pks is self:
+                single = Peaks()
+                single.add_rows(1, {k: c[[v._index]] for k, c in self.columns.items()})
+                single.set_views([v])
+                v._pks = single
+                v._index = 0
+
+        self.columns = columns
+        self.length = len(views)
+        for pos, v in enumerate(views):
+            v._pks = self
+            v._index = pos
+        self.set_views(views)
+
+    def add_rows(self, n, columns=None):
+        """
+        Add rows to the end of the columns. Columns not given are filled with defaults.
+        The rows are held until the columns are next used, so that many additions are joined in one step.
+        :param n: Number of rows to add
+        :param columns: Dictionary of arrays of length n for each attribute
+        :return: None
+        """
+        if self.dirty:
+            self.sync()
+        if columns is None:
+            columns = {}
+        self.pending.append((columns, n))
+        start = self.length
+        self.length += n
+        if self.views is not None:
+            views = [Peak(self, i) for i in range(start, self.length)]
+            list.extend(self.views, views)
+            self.bound.extend(views)
+
+    def column(self, name):
+        """
+        Get the stored column for an attribute, filling it with defaults if it has not been set yet
+        """
+        if name not in self.columns:
+            self.columns[name] = default_column(name, self.length)
+        return self.columns[name]
+
+    def get_value(self, name, index):
+        self.flush()
+        if name not in self.columns:
+            default = peak_columns[name][1]
+            if not isinstance(default, list):
+                return default
+        return self.column(name)[index]
+
+    def set_value(self, name, index, value):
+        self.flush()
+        col = self.column(name)
+        kind = value_kind(value)
+        if col.dtype != object and value_kinds.index(kind) > value_kinds.index(col.dtype.kind):
+            col = col.astype({"i": np.int64, "f": float, "O": object}[kind])
+            self.columns[name] = col
+        col[index] = value
+        if self.views is not None and not self.dirty:
+            list.__getitem__(self.views, index).__dict__.pop(name, None)
+
+    def get_values(self, name):
+        """
+        Get the values of an attribute for all peaks
+        :param name: Name of the attribute, such as "mass" or "height"
+        :return: Array of values for each peak
+        """
+        values = self.stored_values(name)
+        if peak_columns[name][0] is float and values.dtype.kind in "biu":
+            return values.astype(float)
+        return values.copy()
+
+    def stored_values(self, name):
+        """
+        Get the column for an attribute as it is stored, which may be an integer column for a float attribute.
+        The column is not copied, so it should not be changed.
+        """
+        self.sync()
+        if name not in self.columns:
+            return default_column(name, self.length)
+        return self.columns[name]
+
+    def set_values(self, name, values):
+        """
+        Set the values of an attribute for all peaks
+        :param name: Name of the attribute, such as "mass" or "height"
+        :param values: Array or list of values for each peak, or a single value for all peaks
+        :return: None
+        """
+        self.sync()
+        dtype = storage_dtype(name)
+        if isinstance(values, (list, tuple)) and dtype is not object:
+            values = np.asarray(values)
+        if isinstance(values, np.ndarray) and values.ndim == 1:
+            if dtype is not object and values.dtype.kind in "biuf":
+                col = values.astype(np.result_type(dtype, values.dtype))
+            else:
+                col = values.astype(object)
+        elif value_kind(values) != "O" and dtype is not object:
+            col = np.full(self.length, values, dtype=np.result_type(dtype, np.asarray(values).dtype))
+        elif value_kind(values) != "O" or values is None or isinstance(values, str):
+            col = np.full(self.length, values, dtype=object)
+        else:
+            col = object_column(values)
+        if len(col) != self.length:
+            raise ValueError("Got " + str(len(col)) + " values for " + str(self.length) + " peaks")
+        self.columns[name] = col
+        # Drop the values the views have kept for this attribute
+        for v in self.bound:
+            v.__dict__.pop(name, None)
+
     def add_peaks(self, parray, massbins=0, scores_included=False):
         """
         Create peak objects from an array
@@ -158,30 +502,37 @@ class Peaks:
         :param massbins: Describes the precision of the mass inputs by describing the bin size on the mass axis.
         :return: None
         """
-        for p in parray:
-            newpeak = Peak()
-            newpeak.mass = p[0]
-            newpeak.height = p[1]
+        parray = np.asarray(parray)
+        n = len(parray)
+        columns = {}
+        if n > 0:
+            columns["mass"] = parray[:, 0].copy()
+            columns["height"] = parray[:, 1].copy()
             if scores_included:
-                newpeak.dscore = p[2]
-            self.peaks.append(newpeak)
-        self.masses = np.array([p.mass for p in self.peaks])
-        self.heights = np.array([p.height for p in self.peaks])
-        self.plen = len(self.peaks)
+                columns["dscore"] = parray[:, 2].copy()
+        self.add_rows(n, columns)
+        self.masses = self.get_values("mass")
+        self.heights = self.get_values("height")
         self.convolved = False
         self.composite = None
         self.massbins = massbins
 
     def merge_in_peaks(self, pks, filename=None, filenumber=None):
-        for p in pks.peaks:
-            if filename is not None:
-                p.filename = filename
-            if filenumber is not None:
-                p.filenumber = filenumber
-            self.peaks.append(p)
+        """
+        Add copies of the peaks from another Peaks object to the end of this one
+        :param pks: Peaks object to merge in
+        :param filename: File name to set for the merged peaks
+        :param filenumber: File number to set for the merged peaks
+        :return: self
+        """
+        pks.sync()
+        if filename is not None:
+            pks.set_values("filename", filename)
+        if filenumber is not None:
+            pks.set_values("filenumber", filenumber)
+        self.add_rows(pks.length, {k: c.copy() for k, c in pks.columns.items()})
         return self
 
-
     def default_params(self, cmap="rainbow"):
         """
         Set default parameters for peaks, such as color, label, and marker
@@ -195,33 +546,32 @@ class Peaks:
         except:
             pass
 
-        # self.colormap = cm.get_cmap(cmap, len(self.peaks))
-        self.colormap = mpl.colormaps[cmap].resampled(len(self.peaks))
+        n = self.plen
+        # self.colormap = cm.get_cmap(cmap, n)
+        self.colormap = mpl.colormaps[cmap].resampled(n)
         if self.colormap is None:
-            # self.colormap = cm.get_cmap(u"rainbow", len(self.peaks))
-            self.colormap = mpl.colormaps[u"rainbow"].resampled(len(self.peaks))
-        self.peakcolors = self.colormap(np.arange(len(self.peaks)))
+            # self.colormap = cm.get_cmap(u"rainbow", n)
+            self.colormap = mpl.colormaps[u"rainbow"].resampled(n)
+        self.peakcolors = self.colormap(np.arange(n))
         self.markers = ['o', 'v', '^', '>', 's', 'd', '*']
         self.textmarkers = ['\u25CB', '\u25BD', '\u25B3', '\u25B7', '\u25A2', '\u2662', '\u2606']
         self.marklen = len(self.markers)
-        for i in range(0, len(self.peaks)):
-            self.peaks[i].marker = self.markers[i % self.marklen]
-            self.peaks[i].textmarker = self.textmarkers[i % self.marklen]
-            self.peaks[i].color = self.peakcolors[i]
-            if i >= 26:
-                self.peaks[i].label = string.ascii_uppercase[i % 26] + str(int(math.floor(i / 26) + 1))
-            else:
-                self.peaks[i].label = string.ascii_uppercase[i % 26]
+        indexes = np.arange(n)
+        self.set_values("marker", np.array(self.markers, dtype=object)[indexes % self.marklen])
+        self.set_values("textmarker", np.array(self.textmarkers, dtype=object)[indexes % self.marklen])
+        self.set_values("color", self.peakcolors)
+        letters = np.array(list(string.ascii_uppercase))[indexes % 26]
+        labels = np.where(indexes >= 26, np.char.add(letters, (indexes // 26 + 1).astype(str)), letters)
+        self.set_values("label", labels.astype(object))
 
     def color_by_score(self, e=0):
-        scores = np.array([p.dscore for p in self.peaks])
+        scores = self.get_values("dscore")
         # colormap = cm.get_cmap('RdYlGn')
         colormap = mpl.colormaps['RdYlGn']
         norm = Normalize(vmin=0, vmax=1)
         colors = colormap(norm(scores))
         self.peakcolors = colors
-        for i in range(0, len(self.peaks)):
-            self.peaks[i].color = self.peakcolors[i]
+        self.set_values("color", self.peakcolors)
 
     def get_mass_defects(self, kendrickmass, mode=0):
         """
@@ -230,59 +580,57 @@ class Peaks:
         :param mode: Select range of defects 1=(0,1), 0=(-0.5,0.5)
         :return: None
         """
-        for p in self.peaks:
-            p.kmass = p.mass / float(kendrickmass)
-            if mode == 1:
-                p.kendricknum = np.floor(p.kmass)
-                p.kendrickdefect = p.kmass - np.floor(p.kmass)
-            else:
-                p.kendricknum = np.round(p.kmass)
-                p.kendrickdefect = p.kmass - np.round(p.kmass)
+        kmass = self.get_values("mass") / float(kendrickmass)
+        if mode == 1:
+            kendricknum = np.floor(kmass)
+        else:
+            kendricknum = np.round(kmass)
+        self.set_values("kmass", kmass)
+        self.set_values("kendricknum", kendricknum)
+        self.set_values("kendrickdefect", kmass - kendricknum)
 
     def get_bool(self):
-        boo1 = []
-        for p in self.peaks:
-            if p.ignore == 0:
-                boo1.append(True)
-            else:
-                boo1.append(False)
-        return np.array(boo1)
+        return np.array(self.get_values("ignore") == 0, dtype=bool)
 
     def diffs_from(self, target):
-        for p in self.peaks:
-            p.diff = p.mass - target
-        return np.array([p.diff for p in self.peaks])
+        diffs = self.get_values("mass") - target
+        self.set_values("diff", diffs)
+        return diffs
 
     def diffs_consecutive(self):
         b1 = self.get_bool()
-        pmasses = np.array([p.mass for p in self.peaks])[b1]
+        pmasses = self.get_values("mass")[b1]
         peakdiff = np.zeros(len(pmasses))
         peakdiff[1:] = np.diff(pmasses)
-        for i, p in enumerate(self.peaks):
-            p.diff = 0
-        for i, p in enumerate(np.array(self.peaks)[b1]):
-            p.diff = peakdiff[i]
-        return np.array([p.diff for p in self.peaks])
+        diffs = np.zeros(self.plen)
+        diffs[b1] = peakdiff
+        self.set_values("diff", diffs)
+        return diffs
 
     def integrate(self, data, lb=None, ub=None):
-        self.areas = []
-        for p in self.peaks:
+        """
+        Integrate each peak over the range from mass + lb to mass + ub
+        :param data: Data array (N x 2), sorted by mass
+        :param lb: Lower bound relative to each peak mass.
+        If None, twice the distance to the lower side of the FWHM interval of the first peak.
+        :param ub: Upper bound relative to each peak mass.
+        If None, twice the distance to the upper side of the FWHM interval of the first peak.
+        :return: None
+        """
+        masses = self.get_values("mass")
+        if len(masses) > 0 and (lb is None or ub is None):
+            interval = self.get_value("intervalFWHM", 0)
+            if len(interval) != 2:
+                print("ERROR IN INTEGRATION. Need to calc FWHM first.")
             if lb is None:
-                if len(p.intervalFWHM) == 2:
-                    lb = (p.intervalFWHM[0] - p.mass) * 2
-                else:
-                    print("ERROR IN INTEGRATION. Need to calc FWHM first.")
-                    lb = 0
+                lb = (interval[0] - masses[0]) * 2 if len(interval) == 2 else 0
             if ub is None:
-                if len(p.intervalFWHM) == 2:
-                    ub = (p.intervalFWHM[1] - p.mass) * 2
-                else:
-                    print("ERROR IN INTEGRATION. Need to calc FWHM first.")
-                    ub = 0
-            p.integralrange = [p.mass + lb, p.mass + ub]
-            p.integral = ud.integrate(data, p.integralrange[0], p.integralrange[1])[0]
-            self.areas.append(p.integral)
-        self.areas = np.array(self.areas)
+                ub = (interval[1] - masses[0]) * 2 if len(interval) == 2 else 0
+        lows = masses + lb if lb is not None else masses
+        highs = masses + ub if ub is not None else masses
+        self.set_values("integralrange", [[low, high] for low, high in zip(lows, highs)])
+        self.areas = ud.integrate_array(np.asarray(data), lows, highs)
+        self.set_values("integral", self.areas)
 
     def auto_format(self):
 
@@ -294,8 +642,10 @@ class Peaks:
         # self.markers = ['o', 'v', '^', '>', 's', 'd', '*']
         # self.textmarkers = [u'\u25CB', u'\u25BD', u'\u25B3', u'\u25B7', u'\u25A2', u'\u2662', u'\u2606']
 
-        for p in self.peaks:
-            n = p.label
+        newcolors = []
+        newmarkerlist = []
+        newtextmarkers = []
+        for n in self.get_values("label"):
             splits = n.split("[")
 
             try:
@@ -316,33 +666,47 @@ class Peaks:
                 newmarker = self.markers[6]
                 newtextmarker = self.textmarkers[6]
 
-            p.color = newcolor
-            p.marker = newmarker
-            p.textmarker = newtextmarker
+            newcolors.append(newcolor)
+            newmarkerlist.append(newmarker)
+            newtextmarkers.append(newtextmarker)
             # print n1, n2, newcolor, newmarker, newtextmarker
+        self.set_values("color", newcolors)
+        self.set_values("marker", newmarkerlist)
+        self.set_values("textmarker", newtextmarkers)
+
+    def output_strings(self, type="Full", rounding=3):
+        """
+        Format the output columns for copy and to_df
+        :param type: "Full", "Basic", or "FullFiles". Anything else gives the mass and height.
+        :param rounding: Number of decimal places to round to
+        :return: List of headers and list of object arrays of strings for each column
+        """
+        outputs = output_columns.get(type, [("Mass", "mass", None), ("Height", "height", None)])
+        headers = []
+        strings = []
+        for header, name, position in outputs:
+            default = peak_columns[name][1]
+            values = self.stored_values(name)
+            if position is not None:
+                default = default[position]
+                values = np.array([v[position] for v in values])
+                if values.dtype.kind not in "biuf":
+                    values = values.astype(object)
+            headers.append(header)
+            strings.append(format_column(values, default, rounding))
+        return headers, strings
 
     def copy(self, type="Full"):
-        if type == "Full":
-            outstring = "Symbol\tMass\tCentroid\tHeight\tIntegral\tMatch\tMatcherror\tLabel" \
-                        "\tFit Area\tDiff\tAvgcharge\tDscore\tFWHM\tLowValFWHM\tHighValFWHM\tErrorMean\t" \
-                        "ErrorReplicate\tNumMatches\tAltMatches\n"
-        elif type == "Basic":
-            outstring = "Mass\tHeight\tIntegral\n"
-        elif type == "FullFiles":
-            outstring = "Symbol\tMass\tCentroid\tHeight\tIntegral\tMatch\tMatcherror\tLabel" \
-                        "\tFit Area\tDiff\tAvgcharge\tDscore\tFWHM\tLowValFWHM\tHighValFWHM\tErrorMean\t" \
-                        "ErrorReplicate\tNumMatches\tAltMatches\tFileName\tFileNumber\n"
+        headers, strings = self.output_strings(type=type)
+        outstring = "\t".join(headers) + "\n"
         # print("Columns:", outstring)
-
-        for p in self.peaks:
-            outstring += p.line_out(type=type) + "\n"
+        outstring += "".join("\t".join(row) + "\t\n" for row in zip(*strings))
         return outstring
 
     def to_df(self, type="Full", drop_zeros=True):
-        outstring = self.copy(type=type)
-        # print(outstring)
-        df = pd.read_csv(StringIO(outstring), sep="\t", index_col=False, na_values="", dtype=str)
-        df.fillna("", inplace=True)
+        headers, strings = self.output_strings(type=type)
+        df = pd.DataFrame({h: s for h, s in zip(headers, strings)}, columns=headers, dtype=object)
+        df = df.where(~df.isin(na_strings), "")
         if drop_zeros:
             df = df.loc[:, (df != "0").any(axis=0)]
             df = df.loc[:, (df != "-1").any(axis=0)]
@@ -9,6 +9,7 @@ import scipy.ndimage.filters as filt
 
 from unidec import tools as ud
 from unidec.modules.PlotBase import PlotBase
+from unidec.modules import gridlod
 
 __author__ = 'Michael.Marty'
 
@@ -134,30 +135,6 @@ class Plot2dBase(PlotBase):
         # Plot
         # speedplot=0
         if speedplot == 0:
-            # Slow contour plot that interpolates grid
-            b1 = newgrid > 0.01 * np.amax(newgrid)
-            # If the data is sparse, use the tricontourf, otherwise, use the regular contourf
-            if np.sum(b1) / len(newgrid.ravel()) < 0.1:
-                try:
-                    b1 = b1.astype(float)
-                    b1 = filt.uniform_filter(b1, size=3) > 0
-                    b1[0, 0] = True
-                    b1[0, -1] = True
-                    b1[-1, 0] = True
-                    b1[-1, -1] = True
-                    X2, Y2 = np.meshgrid(xvals, yvals, indexing="ij")
-                    X2 = np.ravel(X2[b1])
-                    Y2 = np.ravel(Y2[b1])
-                    Z2 = np.ravel(newgrid[b1].transpose())
-                    cax = self.subplot1.tricontourf(X2 / self.kdnorm, Y2, Z2, 100, cmap=self.cmap, norm=norm)
-                except Exception as e:
-                    print("Error with fast tricontourf plot", e)
-                    cax = self.subplot1.contourf(xvals / self.kdnorm, yvals, np.transpose(newgrid), 100, cmap=self.cmap,
-                                                 norm=norm)
-            else:
-                cax = self.subplot1.contourf(xvals / self.kdnorm, yvals, np.transpose(newgrid), 100, cmap=self.cmap,
-                                             norm=norm)
-
             datalims = [np.amin(xvals) / self.kdnorm, np.amin(yvals), np.amax(xvals) / self.kdnorm, np.amax(yvals)]
         else:
             # Fast discrete plot using imshow
@@ -169,21 +146,61 @@ class Plot2dBase(PlotBase):
                 ydiff = 1
             extent = (np.amin(xvals) / self.kdnorm - 0.5 * xdiff, np.amax(xvals) / self.kdnorm + 0.5 * xdiff,
                       np.amin(yvals) - 0.5 * ydiff, np.amax(yvals) + 0.5 * ydiff)
+            datalims = [extent[0], extent[2], extent[1], extent[3]]
 
+        gridmax = np.amax(newgrid)
 
-            try:
-                ax = self.subplot1
-                im = NonUniformImage(ax, interpolation="nearest", extent=extent, cmap=self.cmap, norm=norm, )
-                im.set_data(xvals / self.kdnorm, yvals, np.transpose(newgrid))
-                ax.add_image(im)
-                ax.set_xlim(extent[0], extent[1])
-                ax.set_ylim(extent[2], extent[3])
-                cax = im
-            except Exception as e:
-                print("Error in NonUniformImage:", e)
-                cax = self.subplot1.imshow(np.transpose(newgrid), origin="lower", cmap=self.cmap, extent=extent,
-                                           aspect='auto', norm=norm, interpolation='nearest')
-            datalims = [extent[0], extent[2], extent[1], extent[3]]
+        def draw(xvals, yvals, newgrid):
+            if speedplot == 0:
+                # Slow contour plot that interpolates grid
+                b1 = newgrid > 0.01 * gridmax
+                # If the data is sparse, use the tricontourf, otherwise, use the regular contourf
+                if np.sum(b1) / len(newgrid.ravel()) < 0.1:
+                    try:
+                        b1 = b1.astype(float)
+                        b1 = filt.uniform_filter(b1, size=3) > 0
+                        b1[0, 0] = True
+                        b1[0, -1] = True
+                        b1[-1, 0] = True
+                        b1[-1, -1] = True
+                        X2, Y2 = np.meshgrid(xvals, yvals, indexing="ij")
+                        X2 = np.ravel(X2[b1])
+                        Y2 = np.ravel(Y2[b1])
+                        Z2 = np.ravel(newgrid[b1].transpose())
+                        cax = self.subplot1.tricontourf(X2 / self.kdnorm, Y2, Z2, 100, cmap=self.cmap, norm=norm)
+                    except Exception as e:
+                        print("Error with fast tricontourf plot", e)
+                        cax = self.subplot1.contourf(xvals / self.kdnorm, yvals, np.transpose(newgrid), 100,
+                                                     cmap=self.cmap, norm=norm)
+                else:
+                    cax = self.subplot1.contourf(xvals / self.kdnorm, yvals, np.transpose(newgrid), 100,
+                                                 cmap=self.cmap, norm=norm)
+            else:
+                try:
+                    ax = self.subplot1
+                    im = NonUniformImage(ax, interpolation="nearest", extent=extent, cmap=self.cmap, norm=norm, )
+                    im.set_data(xvals / self.kdnorm, yvals, np.transpose(newgrid))
+                    ax.add_image(im)
+                    cax = im
+                except Exception as e:
+                    print("Error in NonUniformImage:", e)
+                    cax = self.subplot1.imshow(np.transpose(newgrid), origin="lower", cmap=self.cmap, extent=extent,
+                                               aspect='auto', norm=norm, interpolation='nearest')
+            return [cax]
+
+        if speedplot != 0:
+            self.subplot1.set_xlim(extent[0], extent[1])
+            self.subplot1.set_ylim(extent[2], extent[3])
+        # Draw large grids at screen resolution, with finer levels drawn on zoom
+        width, height = self.lod_size()
+        if self.lod and (xlen >= 2 * width or ylen >= 2 * height):
+            self.subplot1.set_xlim(datalims[0], datalims[2])
+            self.subplot1.set_ylim(datalims[1], datalims[3])
+            self.setup_lod(gridlod.GridPyramid(xvals, yvals, newgrid), draw)
+            # The drawn artists are replaced on zoom, so the colorbar gets its own mappable
+            cax = cm.ScalarMappable(norm=norm, cmap=self.cmap)
+        else:
+            cax = draw(xvals, yvals, newgrid)[0]
         # Set X and Y axis labels
         self.subplot1.set_xlabel(self.xlabel)
         self.subplot1.set_ylabel(self.ylabel)
@@ -192,12 +209,12 @@ class Plot2dBase(PlotBase):
             self.subplot1.set_title(title)
         # Set colorbar
         if normflag == 1:
-            self.cbar = self.figure.colorbar(cax, ax=None, use_gridspec=True,
+            self.cbar = self.figure.colorbar(cax, ax=self.subplot1, use_gridspec=True,
                                              ticks=[0, np.amax(newgrid) / 2, np.amax(newgrid)])
             self.cbar.ax.get_yaxis().set_tick_params(direction='out')
             self.cbar.ax.set_yticklabels(["0", "%", "100"])
         else:
-            self.cbar = self.figure.colorbar(cax, ax=None, use_gridspec=True)
+            self.cbar = self.figure.colorbar(cax, ax=self.subplot1, use_gridspec=True)
         # Change tick colors
         if nticks is not None:
             self.subplot1.xaxis.set_major_locator(MaxNLocator(nbins=nticks))
@@ -280,7 +297,7 @@ class Plot2dBase(PlotBase):
         # Set Title
         self.subplot1.set_title(title)
         # Set colorbar
-        # self.cbar = self.figure.colorbar(cax, ax=None, use_gridspec=True)
+        # self.cbar = self.figure.colorbar(cax, ax=self.subplot1, use_gridspec=True)
         # Change tick colors
         if nticks is not None:
             self.subplot1.xaxis.set_major_locator(MaxNLocator(nbins=nticks))
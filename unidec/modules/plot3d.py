@@ -4,6 +4,7 @@ from matplotlib.ticker import MaxNLocator
 
 from unidec.modules.PlottingWindow import PlottingWindowBase
 from unidec.tools import interp_pos
+from unidec.modules.gridlod import pool_to
 
 __author__ = 'Michael.Marty'
 
@@ -52,6 +53,14 @@ class CubePlot(PlottingWindowBase):
 
         self.make_isomatrices()
 
+        # Reduce large faces to about the resolution of the plot
+        if self.lod:
+            n = max(self.lod_size())
+            (x, y), C = pool_to([xaxis, yaxis], C, [n, n])
+            (x, z), C2 = pool_to([xaxis, zaxis], C2, [n, n])
+            (y, z), C3 = pool_to([yaxis, zaxis], C3, [n, n])
+            xaxis, yaxis, zaxis = x, y, z
+
         self.xlen = len(xaxis)
         self.ylen = len(yaxis)
         self.zlen = len(zaxis)
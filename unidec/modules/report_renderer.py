@@ -0,0 +1,318 @@
+import os
+import copy
+import pickle
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+import numpy as np
+import matplotlib as mpl
+
+__author__ = 'Michael.Marty'
+
+'''
+Render the figures for HTML reports in worker processes, with a cache of rendered figures.
+
+Each figure is described by a spec, a dictionary with:
+method: Name of the engine plotting method, such as "makeplot2"
+kwargs: Keyword arguments for the method, such as data, pks, and config
+is2d: True for 2D plots, which are rendered as PNG. 1D plots are rendered as SVG.
+Specs only hold copies of the data, so the engine can move on to the next file while the figures render.
+The rendered figures are cached on a hash of the spec, so the same figure is only rendered once.
+'''
+
+worker_engine = None
+
+# Peak attributes used by the report plots
+plot_columns = ["mass", "height", "ignore", "color", "marker", "mztab", "mztab2", "stickdat"]
+
+
+def init_engine():
+    """
+    Create the engine used for plotting in this process.
+    :return: None
+    """
+    global worker_engine
+    from unidec.modules.unidec_enginebase import UniDecEngine
+    worker_engine = UniDecEngine(silent=True)
+
+
+def init_worker():
+    """
+    Set the non-interactive backend and create the plotting engine in a worker process.
+    :return: None
+    """
+    mpl.use("Agg")
+    init_engine()
+
+
+def plot_peaks(pks, names=None):
+    """
+    Copy only the columns of a Peaks object that are needed for plotting.
+    :param pks: Peaks object
+    :param names: List of peak attributes to copy. Default is plot_columns.
+    :return: New Peaks object
+    """
+    from unidec.modules.peakstructure import Peaks
+    if names is None:
+        names = plot_columns
+    out = Peaks()
+    out.add_rows(pks.plen, {name: pks.get_values(name) for name in names})
+    out.flush()
+    return out
+
+
+def make_spec(method, is2d=False, **kwargs):
+    """
+    Make a figure spec for a plotting method of the engine, with copies of the data, peaks, and config.
+    :param method: Name of the engine plotting method, such as "makeplot2"
+    :param is2d: True for 2D plots
+    :param kwargs: Keyword arguments for the method
+    :return: Spec dictionary
+    """
+    from unidec.modules.peakstructure import Peaks
+    args = {}
+    for k, v in kwargs.items():
+        if isinstance(v, np.ndarray):
+            v = v.copy()
+        elif isinstance(v, Peaks):
+            v = plot_peaks(v)
+        elif k == "config":
+            v = copy.deepcopy(v)
+        args[k] = v
+    return {"method": method, "kwargs": args, "is2d": is2d}
+
+
+def spec_key(spec, maxpoints=None):
+    """
+    Hash of a spec and render settings, used as the cache key.
+    :param spec: Spec dictionary
+    :param maxpoints: Decimation setting used for rendering
+    :return: Hex digest string
+    """
+    from unidec.modules.peakstructure import Peaks
+    h = hashlib.sha1()
+    h.update(repr((spec["method"], spec["is2d"], maxpoints)).encode())
+    for k in sorted(spec["kwargs"]):
+        v = spec["kwargs"][k]
+        h.update(k.encode())
+        if isinstance(v, Peaks):
+            for name in sorted(v.columns):
+                h.update(pickle.dumps((name, v.get_values(name)), protocol=4))
+        elif k == "config":
+            # get_config_dict changes empty values to 0 and then to 0.0, so compare numbers as floats
+            items = [(n, float(x) if isinstance(x, (int, float, np.number)) else x)
+                     for n, x in sorted(v.get_config_dict().items())]
+            h.update(repr(items).encode())
+        else:
+            h.update(pickle.dumps(v, protocol=4))
+    return h.hexdigest()
+
+
+def decimate_indexes(y, maxpoints):
+    """
+    Pick the points to keep so that a line keeps its shape with at most about maxpoints points.
+    The data is split into bins, and the min and max of each bin are kept, along with the first and last points.
+    :param y: Array of y values
+    :param maxpoints: Maximum number of points
+    :return: Sorted array of indexes to keep
+    """
+    n = len(y)
+    nbins = max(int(maxpoints) // 2, 1)
+    if n <= maxpoints:
+        return np.arange(n)
+    size = int(np.ceil(n / float(nbins)))
+    nbins = int(np.ceil(n / float(size)))
+    padded = np.concatenate((y, np.full(nbins * size - n, y[-1])))
+    blocks = np.reshape(padded, (nbins, size))
+    offsets = np.arange(nbins) * size
+    keep = np.concatenate(([0, n - 1], offsets + np.argmin(blocks, axis=1), offsets + np.argmax(blocks, axis=1)))
+    return np.unique(np.clip(keep, 0, n - 1))
+
+
+def decimate_lines(figure, maxpoints):
+    """
+    Decimate all lines in a figure with more than maxpoints points. Markers without lines are left alone.
+    :param figure: Matplotlib Figure
+    :param maxpoints: Maximum number of points for each line
+    :return: None
+    """
+    for ax in figure.get_axes():
+        for line in ax.get_lines():
+            x, y = line.get_data()
+            if len(x) <= maxpoints or line.get_linestyle() in ["None", " ", ""]:
+                continue
+            x = np.asarray(x)
+            y = np.asarray(y)
+            index = decimate_indexes(y, maxpoints)
+            line.set_data(x[index], y[index])
+
+
+def render_spec(spec, maxpoints=None):
+    """
+    Render a figure spec with the engine of this process.
+    :param spec: Spec dictionary
+    :param maxpoints: If not None, decimate lines to this number of points
+    :return: SVG bytes for 1D plots, PNG bytes for 2D plots, or None if nothing was plotted
+    """
+    from unidec.modules import plot1d, plot2d
+    if worker_engine is None:
+        init_engine()
+    if spec["is2d"]:
+        plot = plot2d.Plot2dBase()
+    else:
+        plot = plot1d.Plot1dBase()
+    getattr(worker_engine, spec["method"])(plot=plot, **spec["kwargs"])
+    if not plot.flag:
+        return None
+    if spec["is2d"]:
+        return plot.get_png()
+    if maxpoints is not None:
+        decimate_lines(plot.figure, maxpoints)
+    return plot.get_svg()
+
+
+def figure_html(result, is2d):
+    """
+    Convert rendered figure bytes to the HTML used in the report grid
+    """
+    from unidec.modules.html_writer import png_to_html
+    if result is None:
+        return "<p></p>"
+    if is2d:
+        return png_to_html(result)
+    return result
+
+
+class ReportRenderer:
+    def __init__(self, nworkers=None, cachedir=None, maxpoints=None):
+        """
+        Renders report figures in a pool of worker processes, with a cache of rendered figures.
+        :param nworkers: Number of worker processes. Default is the number of CPUs. If 1, renders in this process.
+        :param cachedir: Directory to cache rendered figures on disk. None to only cache in memory.
+        :param maxpoints: If not None, decimate lines in 1D plots to about this many points.
+        """
+        if nworkers is None:
+            nworkers = multiprocessing.cpu_count()
+        self.nworkers = nworkers
+        self.cachedir = cachedir
+        self.maxpoints = maxpoints
+        self.cache = {}
+        self.executor = None
+        if cachedir is not None and not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def cache_path(self, key, is2d):
+        return os.path.join(self.cachedir, key + (".png" if is2d else ".svg"))
+
+    def lookup(self, key, is2d):
+        """
+        Get a rendered figure from the memory or disk cache
+        :return: Figure bytes, or None if not cached
+        """
+        if key in self.cache:
+            return self.cache[key]
+        if self.cachedir is not None and os.path.isfile(self.cache_path(key, is2d)):
+            with open(self.cache_path(key, is2d), "rb") as f:
+                self.cache[key] = f.read()
+            return self.cache[key]
+        return None
+
+    def store(self, key, is2d, result):
+        self.cache[key] = result
+        if self.cachedir is not None and result is not None:
+            with open(self.cache_path(key, is2d), "wb") as f:
+                f.write(result)
+
+    def submit(self, specs):
+        """
+        Start rendering a list of figure specs.
+        :param specs: List of spec dictionaries from make_spec
+        :return: List of jobs to pass to result
+        """
+        jobs = []
+        for spec in specs:
+            key = spec_key(spec, self.maxpoints)
+            cached = self.lookup(key, spec["is2d"])
+            if cached is not None or key in self.cache:
+                future = Future()
+                future.set_result(cached)
+            elif self.nworkers <= 1:
+                future = Future()
+                future.set_result(render_spec(spec, maxpoints=self.maxpoints))
+            else:
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(max_workers=self.nworkers, initializer=init_worker)
+                future = self.executor.submit(render_spec, spec, self.maxpoints)
+            jobs.append((key, spec["is2d"], future))
+        return jobs
+
+    def result(self, job):
+        """
+        Wait for a job from submit and get the HTML for its figure
+        """
+        key, is2d, future = job
+        result = future.result()
+        if key not in self.cache:
+            self.store(key, is2d, result)
+        return figure_html(result, is2d)
+
+    def render(self, specs):
+        """
+        Render a list of figure specs and wait for them
+        :return: List of HTML strings for each figure
+        """
+        return [self.result(job) for job in self.submit(specs)]
+
+
+class ReportJob:
+    def __init__(self, outfile, head, grid, tail, renderer=None, end=""):
+        """
+        An HTML report whose figures may still be rendering.
+        :param outfile: Report file to write
+        :param head: HTML before the figure grid
+        :param grid: Rows of figures. Each is an HTML string or a job from ReportRenderer.submit.
+        :param tail: HTML after the figure grid that is written to the file
+        :param renderer: ReportRenderer that the jobs came from
+        :param end: HTML added after tail in the returned string but not written to the file
+        """
+        self.outfile = outfile
+        self.head = head
+        self.grid = grid
+        self.tail = tail
+        self.renderer = renderer
+        self.end = end
+        self.html_str = None
+
+    def done(self):
+        """
+        Check whether all figures are rendered
+        """
+        return all(isinstance(c, (str, bytes)) or c[2].done() for row in self.grid for c in row)
+
+    def finish(self):
+        """
+        Wait for the figures, then write the report file.
+        :return: HTML string of the report
+        """
+        from unidec.modules.html_writer import wrap_to_grid, html_open, html_close, write_to_html
+        if self.html_str is not None:
+            return self.html_str
+        grid = [[c if isinstance(c, (str, bytes)) else self.renderer.result(c) for c in row] for row in self.grid]
+        grid = [row for row in grid if any(c != "<p></p>" for c in row)]
+        html_str = self.head + wrap_to_grid(grid) + self.tail
+        html_open(self.outfile)
+        write_to_html(html_str, self.outfile)
+        html_close(self.outfile)
+        self.html_str = html_str + self.end
+        return self.html_str
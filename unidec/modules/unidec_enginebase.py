@@ -1,4 +1,4 @@
-from unidec.modules import unidecstructure, peakstructure, plot1d, plot2d
+from unidec.modules import unidecstructure, peakstructure, plot1d, plot2d, report_renderer
 from unidec import tools as ud
 import numpy as np
 import os
@@ -9,9 +9,41 @@ from unidec.modules.html_writer import *
 version = "7.0.2"
 
 
+# Marks a config attribute that did not exist in a history state
+missing = object()
+
+# Number of the latest undo steps that keep references to the data arrays
+data_history_length = 10
+
+
 def copy_config(config):
-    # return deepcopy(config)
-    return type("UniDecConfig", (object,), dict(config.__dict__))
+    """
+    Copy the config attributes for the undo history. Values are shared rather than copied.
+    :param config: UniDecConfig object
+    :return: Dictionary of attributes
+    """
+    return dict(config.__dict__)
+
+
+def config_diff(old, new):
+    """
+    Find the config attributes that changed between two states from copy_config.
+    :param old: Earlier state
+    :param new: Later state
+    :return: Dictionary of (old value, new value) for each changed attribute. Attributes not in old get missing.
+    """
+    diff = {}
+    for k, v in new.items():
+        v0 = old.get(k, missing)
+        if v0 is v:
+            continue
+        try:
+            changed = v0 is missing or not np.array_equal(v0, v)
+        except Exception:
+            changed = True
+        if changed:
+            diff[k] = (v0, v)
+    return diff
 
 
 class UniDecEngine:
@@ -36,6 +68,8 @@ class UniDecEngine:
         self.config = None
         self.config_history = []
         self.config_count = 0
+        self.config_state = {}
+        self.data_history = []
         self.data = None
         self.pks = None
         self.olg = None
@@ -117,50 +151,88 @@ class UniDecEngine:
         # self.data.read_hdf5(self.config.hdf_file)
 
     def update_history(self):
-        # print "Update"
+        """
+        Add the current config to the undo history if it changed since the last state in the history. The history
+        stores only the attributes that changed at each step.
+
+        Each step also keeps a snapshot of the data, which holds references to the arrays rather than copies. The
+        snapshots of the steps before the latest data_history_length are dropped.
+        :return: None
+        """
         try:
-            if self.config_count > 0 and self.config.check_new(self.config_history[len(self.config_history) - 1]):
-                self.config_history.append(copy_config(self.config))
-                self.config_count = len(self.config_history)
-                # print "Updated History", self.config_count
-            elif self.config_count == 0:
+            if self.config_count > 0:
+                new = copy_config(self.config)
+                diff = config_diff(self.history_state(len(self.config_history)), new)
+                if len(diff) > 0:
+                    self.config_history.append(diff)
+                    self.data_history.append(self.data_snapshot())
+                    for i in range(len(self.data_history) - data_history_length):
+                        self.data_history[i] = None
+                    self.config_count = len(self.config_history)
+                    self.config_state = new
+            else:
                 self.clear_history()
-                # else:
-                # print "No changes"
         except Exception as e:
             self.clear_history()
-        # print self.config_count
-        pass
 
     def clear_history(self):
-        self.config_history = [copy_config(self.config)]
+        self.config_history = [{}]
+        self.data_history = [self.data_snapshot()]
+        self.config_state = copy_config(self.config)
         self.config_count = 1
-        pass
 
-    def undo(self):
+    def data_snapshot(self):
+        """
+        Get a snapshot of the data for the undo history. If the data has not changed since the last snapshot, the last
+        snapshot is used again.
+        :return: Snapshot from DataContainer.snapshot, or None if the data cannot be versioned
+        """
+        if not hasattr(self.data, "snapshot"):
+            return None
+        for snap in reversed(self.data_history):
+            if snap is not None:
+                if snap[0] == self.data.version and all(self.data.__dict__.get(k) is v for k, v in snap[1].items()):
+                    return snap
+                break
+        return self.data.snapshot()
+
+    def history_state(self, count):
+        """
+        Get the config attributes at a step of the undo history from the current step and the changes in between.
+        :param count: Step of the history, starting at 1
+        :return: Dictionary of attributes
+        """
+        state = dict(self.config_state)
+        for diff in self.config_history[self.config_count:count]:
+            state.update({k: v[1] for k, v in diff.items()})
+        for diff in reversed(self.config_history[count:self.config_count]):
+            for k, v in diff.items():
+                if v[0] is missing:
+                    state.pop(k, None)
+                else:
+                    state[k] = v[0]
+        return state
+
+    def set_history(self, count, data=False):
+        """
+        Set the config to a step of the undo history
+        :param count: Step of the history, starting at 1
+        :param data: If True, also set the data arrays back to the snapshot of that step, if it is still kept
+        :return: None
+        """
+        self.config_state = self.history_state(count)
+        self.config_count = count
+        self.config.__dict__.update(self.config_state)
+        if data and count <= len(self.data_history) and self.data_history[count - 1] is not None:
+            self.data.restore(self.data_history[count - 1])
+
+    def undo(self, data=False):
         if self.config_count > 1:
-            self.config_count -= 1
-            new = self.config_history[self.config_count - 1]
-            old = self.config
-            for item in new.__dict__:
-                try:
-                    old.__dict__[item] = new.__dict__[item]
-                except KeyError as e:
-                    print(e)
-        pass
+            self.set_history(self.config_count - 1, data=data)
 
-    def redo(self):
-        # print(self.config_count, len(self.config_history))
+    def redo(self, data=False):
         if self.config_count < len(self.config_history):
-            self.config_count += 1
-            new = self.config_history[self.config_count - 1]
-            old = self.config
-            for item in new.__dict__:
-                try:
-                    old.__dict__[item] = new.__dict__[item]
-                except KeyError as e:
-                    print(e)
-        pass
+            self.set_history(self.config_count + 1, data=data)
 
     def get_auto_peak_width(self, set_it=True):
         try:
@@ -382,7 +454,7 @@ class UniDecEngine:
 
         else:
             # If alts are not considered, just use the matches and assume they have all the peak height
-            intensities = np.array([p.height for p in self.pks.peaks])
+            intensities = self.pks.get_values("height")
             snumbers = self.matchindexes[:, index]
             sunique = np.unique(snumbers)
 
@@ -487,11 +559,14 @@ class UniDecEngine:
             plot = plot2d.Plot2dBase()
         if config is None:
             config = self.config
-        if data is None:
-            data = self.data.mzgrid
         if config.batchflag == 0:
             tstart = time.perf_counter()
-            plot.contourplot(data, config)
+            if data is None and len(self.data.mzgrid2d) > 0:
+                plot.contourplot(xvals=self.data.mzaxis, yvals=self.data.ztab, zgrid=self.data.mzgrid2d, config=config)
+            else:
+                if data is None:
+                    data = self.data.mzgrid
+                plot.contourplot(data, config)
             print("Plot 3: %.2gs" % (time.perf_counter() - tstart))
         return plot
 
@@ -619,7 +694,7 @@ class UniDecEngine:
             return plot
 
     def gen_html_report(self, event=None, outfile=None, plots=None, interactive=False, open_in_browser=True,
-                        results_string=None, del_columns=None, findex=None):
+                        results_string=None, del_columns=None, findex=None, renderer=None):
         """
         Generate an HTML report of the current UniDec run.
         :param event: Unused Event
@@ -629,78 +704,110 @@ class UniDecEngine:
         :param open_in_browser: If True, will open the report in the default browser. Default is True.
         :param results_string: String to include in the report. Default is None.
         :param del_columns: List of columns to delete from the report. Default is None.
+        :param renderer: ReportRenderer to render the default plots with. Default is None, which plots here.
         :return: None
         """
+        job = self.start_html_report(outfile=outfile, plots=plots, interactive=interactive,
+                                     results_string=results_string, del_columns=del_columns, findex=findex,
+                                     renderer=renderer)
+        self.html_str = job.finish()
+        outfile = job.outfile
+
+        if open_in_browser:
+            webbrowser.open_new_tab(outfile)
+            # os.system(self.config.opencommand + "\"" + outfile + "\"")
+
+        return outfile
+
+    def start_html_report(self, outfile=None, plots=None, interactive=False, results_string=None,
+                          del_columns=None, findex=None, renderer=None):
+        """
+        Start an HTML report of the current UniDec run. The report file is written by finish on the returned job.
+
+        If a renderer is given and plots is None, the default plots are sent to the renderer, so they can render while
+        the engine moves on. The job only holds copies of the data, so the engine can be changed before it finishes.
+        :param outfile: Output file name. Default is None, which will use the default name.
+        :param plots: List of plots to include in the report. Must be 2D with row and column format.
+        :param interactive: If True, will include interactive plots. Default is False.
+        :param results_string: String to include in the report. Default is None.
+        :param del_columns: List of columns to delete from the report. Default is None.
+        :param findex: File index added to the output file name. Default is None.
+        :param renderer: ReportRenderer from unidec.modules.report_renderer. Default is None, which plots here.
+        :return: ReportJob
+        """
         if outfile is None:
             outfile = self.config.reportfile
         if findex is not None:
             outfile = outfile.replace(".html", "_" + str(findex) + ".html")
-        html_open(outfile)
-        self.html_str = ""
-        self.html_str += html_title(self.config.filename, outfile)
+        head = html_title(self.config.filename)
 
         peaks_df = self.pks.to_df()
-        colors = [p.color for p in self.pks.peaks]
+        colors = self.pks.get_values("color")
 
         if del_columns is not None and len(peaks_df) != 0:
             peaks_df = peaks_df.drop(del_columns, axis=1)
 
         if len(peaks_df) > 0:
-            self.html_str += df_to_html(peaks_df, outfile, colors=colors)
+            head += df_to_html(peaks_df, colors=colors)
 
         # array_to_html(np.transpose(self.matchlist), outfile,
         #              cols=["Measured Mass", "Theoretical Mass", "Error", "Match Name"])
 
-        if plots is None:
-            plot = self.makeplot2(silent=True)
-            plot2 = self.makeplot4(silent=True)
-            # plot5 = self.makeplot5()
-            # plot3 = self.makeplot3()
-            # plot6 = self.makeplot6()
-            plots = [[plot, plot2]]  # , [plot5, plot3], [plot6, None]]
-        if len(np.shape(plots)) != 2 and len(plots) > 0:
-            try:
-                # Reshape 1D array to 2D with 2 columns
-                plots = np.reshape(plots, (int(len(plots) / 2), 2))
-            except Exception:
-                plots = np.reshape(plots[:-1], (int(len(plots[:-1]) / 2), 2))
-                lastrow = np.array([plots[-1], None])
-                plots = np.vstack((plots, lastrow))
-
-        svg_grid = []
         figure_list = []
-        for row in plots:
-            svg_row = []
-            goodrow = False
-            for c in row:
-                if c is not None and c.flag:
-                    goodrow = True
-                    if c.is2d:
-                        png_str = c.get_png()
-                        png_html = png_to_html(png_str)
-                        svg_row.append(png_html)
+        if plots is None and renderer is not None and not interactive:
+            specs = [report_renderer.make_spec("makeplot2", data=self.data.massdat, pks=self.pks,
+                                               config=self.config, silent=True),
+                     report_renderer.make_spec("makeplot4", data=self.data.data2, pks=self.pks,
+                                               config=self.config, silent=True)]
+            svg_grid = [renderer.submit(specs)]
+        else:
+            if plots is None:
+                plot = self.makeplot2(silent=True)
+                plot2 = self.makeplot4(silent=True)
+                # plot5 = self.makeplot5()
+                # plot3 = self.makeplot3()
+                # plot6 = self.makeplot6()
+                plots = [[plot, plot2]]  # , [plot5, plot3], [plot6, None]]
+            if len(np.shape(plots)) != 2 and len(plots) > 0:
+                try:
+                    # Reshape 1D array to 2D with 2 columns
+                    plots = np.reshape(plots, (int(len(plots) / 2), 2))
+                except Exception:
+                    plots = np.reshape(plots[:-1], (int(len(plots[:-1]) / 2), 2))
+                    lastrow = np.array([plots[-1], None])
+                    plots = np.vstack((plots, lastrow))
+
+            svg_grid = []
+            for row in plots:
+                svg_row = []
+                goodrow = False
+                for c in row:
+                    if c is not None and c.flag:
+                        goodrow = True
+                        if c.is2d:
+                            png_str = c.get_png()
+                            png_html = png_to_html(png_str)
+                            svg_row.append(png_html)
+                        else:
+                            svg_row.append(c.get_svg())
+                        figure_list.append(c.figure)
                     else:
-                        svg_row.append(c.get_svg())
-                    figure_list.append(c.figure)
-                else:
-                    svg_row.append("<p></p>")
-            if goodrow:
-                svg_grid.append(svg_row)
-
-        svg_grid_string = wrap_to_grid(svg_grid, outfile)
-        self.html_str += svg_grid_string
+                        svg_row.append("<p></p>")
+                if goodrow:
+                    svg_grid.append(svg_row)
 
+        tail = ""
         if interactive:
             for f in figure_list:
                 try:
-                    self.html_str += fig_to_html_mpld3(f, outfile)
+                    tail += fig_to_html_mpld3(f)
                 except Exception as e:
                     print("Unable to create interactive figures", e)
                     pass
 
         # Write results string paragraph
         if results_string is not None:
-            self.html_str += to_html_paragraph(results_string, outfile)
+            tail += to_html_paragraph(results_string)
 
         try:
             spectra_df = self.data.attrs_to_df()
@@ -708,19 +815,11 @@ class UniDecEngine:
                 spectra_df.drop(["beta", "error", "iterations", "psig", "rsquared", "zsig", "mzsig", "length_mass",
                                  "length_mz", "time"], axis=1, inplace=True)
                 colors2 = self.data.get_colors()
-                self.html_str += df_to_html(spectra_df, outfile, colors=colors2)
+                tail += df_to_html(spectra_df, colors=colors2)
         except Exception:
             pass
 
         config_dict = self.config.get_config_dict()
         config_htmlstring = dict_to_html(config_dict)
-        self.html_str += to_html_collapsible(config_htmlstring, title="UniDec Parameters", outfile=outfile,
-                                             htmltext=True)
-        self.html_str += html_pagebreak()
-        html_close(outfile)
-
-        if open_in_browser:
-            webbrowser.open_new_tab(outfile)
-            # os.system(self.config.opencommand + "\"" + outfile + "\"")
-
-        return outfile
+        tail += to_html_collapsible(config_htmlstring, title="UniDec Parameters", htmltext=True)
+        return report_renderer.ReportJob(outfile, head, svg_grid, tail, renderer=renderer, end=html_pagebreak())
@@ -452,8 +452,8 @@ class UniDecPres(object):
 
         b1 = pks.get_bool()
 
-        pmasses = np.array([p.mass for p in pks.peaks])[b1]
-        peakdiff = np.array([p.diff for p in pks.peaks])[b1]
+        pmasses = pks.get_values("mass")[b1]
+        peakdiff = pks.get_values("diff")[b1]
         mval = np.amax(massdat[:, 1])
         # print peakdiff
 
@@ -483,8 +483,8 @@ class UniDecPres(object):
             dataobj = self.eng.data
 
         peaksel = peakpanel.selection2
-        pmasses = np.array([p.mass for p in pks.peaks])
-        pint = np.array([p.height for p in pks.peaks])
+        pmasses = pks.get_values("mass")
+        pint = pks.get_values("height")
         mval = np.amax(dataobj.massdat[:, 1])
 
         if isinstance(dataobj, MetaDataSet):
@@ -523,15 +523,15 @@ class UniDecPres(object):
             dataobj = self.eng.data
 
         if int_success:
-            pintegral = np.array([p.integral for p in pks.peaks])
+            pintegral = pks.get_values("integral")
         else:
-            pintegral = np.array([p.height for p in pks.peaks])
+            pintegral = pks.get_values("height")
 
         peaksel = peakpanel.selection2
-        pmasses = np.array([p.mass for p in pks.peaks])
+        pmasses = pks.get_values("mass")
         if ud.isempty(peaksel):
             peaksel = pmasses
-        pint = np.array([p.height for p in pks.peaks])
+        pint = pks.get_values("height")
         mval = np.amax(dataobj.massdat[:, 1])
 
         if isinstance(dataobj, MetaDataSet):
@@ -564,10 +564,10 @@ class UniDecPres(object):
         pnames = np.array([p.label for p in pks.peaks])
 
         peaksel = peakpanel.selection2
-        pmasses = np.array([p.mass for p in pks.peaks])
+        pmasses = pks.get_values("mass")
         if ud.isempty(peaksel):
             peaksel = pmasses
-        pint = np.array([p.height for p in pks.peaks])
+        pint = pks.get_values("height")
         mval = np.amax(dataobj.massdat[:, 1])
 
         if isinstance(dataobj, MetaDataSet):
@@ -1565,11 +1565,21 @@ class OligomerContainer:
 
 
 class DataContainer:
+    # Attributes used for versioning rather than data
+    meta = ("version", "versions", "shared")
+
     def __init__(self):
         """
         Initialize DataContainer with empty arrays.
+
+        Arrays are copy-on-write. Copies and snapshots of the container share the arrays rather than copying them, and
+        every assignment of a new value increases the version of the container. To change an array in place, get it
+        from writable, which copies it first if it is shared.
         :return: None
         """
+        self.__dict__["version"] = 0  # Increases on every assignment
+        self.__dict__["versions"] = {}  # Version at which each attribute was last assigned
+        self.__dict__["shared"] = set()  # Attributes whose arrays may be shared with a copy or snapshot
         self.fitdat = np.array([])  # Fit of m/z data from deconvolution
         self.baseline = np.array([])  # Baseline of the m/z data
         self.fitdat2d = np.array([])  # Fit of 2D data from deconvolution
@@ -1578,7 +1588,9 @@ class DataContainer:
         self.data2 = np.array([])  # Processed m/z data
         self.data3 = np.array([])  # Processed IMMS data
         self.massdat = np.array([])  # Deconvolved 1D mass data
-        self.mzgrid = np.array([])  # Deconvolved 2D m/z vs charge grid
+        self.mzgrid2d = np.array([])  # Deconvolved 2D m/z vs charge grid as intensities only (N x Z)
+        self.mzaxis = np.array([])  # m/z axis of mzgrid2d
+        self._mzgrid = np.array([])  # Explicitly set N x 3 m/z vs charge grid
         self.massgrid = np.array([])  # Deconvolved 2D mass vs charge grid
         self.mzmassgrid = np.array([])  # Deconvolved 2D m/z vs mass grid
         self.ztab = np.array([])  # Charge state table
@@ -1587,6 +1599,117 @@ class DataContainer:
         self.ccsdata = np.array([])  # CCS data in 1D
         self.tscore = 0
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name not in DataContainer.meta:
+            self.__dict__["version"] += 1
+            self.versions[name] = self.version
+            self.shared.discard(name)
+
+    def data_names(self):
+        """
+        Names of the data attributes, excluding the versioning attributes
+        """
+        return [k for k in self.__dict__ if k not in DataContainer.meta]
+
+    def copy(self):
+        """
+        Copy the container without copying the arrays. The arrays are shared until either container changes them with
+        writable.
+        :return: New DataContainer
+        """
+        new = DataContainer.__new__(DataContainer)
+        new.__dict__.update(self.__dict__)
+        new.__dict__["versions"] = dict(self.versions)
+        new.__dict__["shared"] = set(self.data_names())
+        self.shared.update(self.data_names())
+        return new
+
+    def snapshot(self):
+        """
+        Get references to the current arrays. The arrays are shared, so later changes through writable do not affect
+        the snapshot.
+        :return: Version of the container and a dictionary of the data attributes
+        """
+        names = self.data_names()
+        self.shared.update(names)
+        return self.version, {k: self.__dict__[k] for k in names}
+
+    def restore(self, snapshot):
+        """
+        Set the data attributes back to a snapshot
+        :param snapshot: Snapshot from snapshot()
+        :return: None
+        """
+        for k, v in snapshot[1].items():
+            setattr(self, k, v)
+        self.shared.update(snapshot[1].keys())
+
+    def writable(self, name):
+        """
+        Get an array to change in place, copying it first if it is shared with a copy or snapshot.
+        :param name: Name of the attribute
+        :return: Array that is only held by this container
+        """
+        value = getattr(self, name)
+        if name in self.shared and isinstance(value, np.ndarray):
+            value = np.array(value)
+            setattr(self, name, value)
+        return value
+
+    @property
+    def mzgrid(self):
+        """
+        Deconvolved 2D m/z vs charge grid as an N*Z x 3 array of (m/z, charge, intensity).
+
+        If the grid was stored compactly with set_mzgrid, the 3-column array is built on demand.
+        Use mzgrid2d, mzaxis, and ztab directly to avoid the copy.
+        :return: N*Z x 3 array
+        """
+        if len(self.mzgrid2d) > 0:
+            zv, mzv = np.meshgrid(self.ztab, self.mzaxis)
+            return np.c_[np.ravel(mzv), np.ravel(zv), np.ravel(self.mzgrid2d)]
+        return self._mzgrid
+
+    @mzgrid.setter
+    def mzgrid(self, value):
+        self._mzgrid = value
+        self.mzgrid2d = np.array([])
+        self.mzaxis = np.array([])
+
+    def set_mzgrid(self, grid, mzaxis, ztab=None):
+        """
+        Store the m/z vs charge grid compactly as a 2D intensity array with separate axes.
+        :param grid: Intensity array of shape (len(mzaxis), len(ztab))
+        :param mzaxis: m/z axis
+        :param ztab: Charge axis. If None, uses self.ztab.
+        :return: None
+        """
+        if ztab is not None:
+            self.ztab = ztab
+        self._mzgrid = np.array([])
+        self.mzaxis = np.asarray(mzaxis)
+        self.mzgrid2d = np.reshape(grid, (len(self.mzaxis), len(self.ztab)))
+
+    def has_mzgrid(self):
+        """
+        Check if an m/z vs charge grid is present in either format.
+        :return: True if the grid is present
+        """
+        return len(self.mzgrid2d) > 0 or not ud.isempty(self._mzgrid)
+
+    def get_mzgrid2d(self):
+        """
+        Get the m/z vs charge grid as a 2D array with its axes, without building the 3-column view.
+        :return: mzaxis (N), ztab (Z), grid (N x Z)
+        """
+        if len(self.mzgrid2d) > 0:
+            return self.mzaxis, self.ztab, self.mzgrid2d
+        mzgrid = self._mzgrid
+        xvals = np.unique(mzgrid[:, 0])
+        yvals = np.unique(mzgrid[:, 1])
+        return xvals, yvals, np.reshape(mzgrid[:, 2], (len(xvals), len(yvals)))
+
     def write_hdf5(self, file_name):
         hdf = h5py.File(file_name)
         config_group = hdf.require_group("ms_data")
@@ -0,0 +1,326 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import getopt
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import h5py
+import unidec.tools as ud
+
+__author__ = 'Michael.Marty'
+
+'''
+Deconvolve each MS1 scan of an LC-MS file and write the zero-charge spectra or peak lists to a single HDF5 file.
+
+Scans are streamed from the mzML file and deconvolved in batches by a pool of workers. Each worker keeps one UniDec
+engine and its own working directory, so the configuration is only loaded once per worker. Results are appended in
+scan order to packed datasets in the "scans" group:
+mass, intensity: Concatenated zero-charge spectra or peak lists
+offsets: Start of each scan in mass and intensity, with the total length at the end
+index, id, time: Scan index in the file, scan ID string, and scan time of each scan
+failed: Scan indexes that raised an error when they were deconvolved
+If the output file already exists, scans that are already in it are skipped, so an interrupted run can be resumed.
+Failed scans are not counted as done, so they are tried again when the run is resumed.
+'''
+
+worker_engine = None
+worker_dir = None
+
+
+def iter_ms1_scans(path, threshold=-1, skip=None):
+    """
+    Stream the MS1 scans from an mzML file.
+    :param path: Path to the mzML file
+    :param threshold: Intensity threshold passed to get_data_from_spectrum
+    :param skip: Set of scan indexes to skip
+    :return: Generator of (scan index, scan ID, scan time, data) for each MS1 scan
+    """
+    from unidec.modules.mzMLimporter import mzMLimporter, get_data_from_spectrum
+    importer = mzMLimporter(path)
+    ids = {id: i for i, id in enumerate(importer.ids)}
+    for spec in importer.msrun:
+        try:
+            if spec.ID not in ids or spec.ms_level != 1:
+                continue
+        except Exception:
+            continue
+        index = ids[spec.ID]
+        if skip is not None and index in skip:
+            continue
+        data = get_data_from_spectrum(spec, threshold=threshold)
+        yield index, spec.ID, importer.times[index], data
+
+
+def init_worker(configfile, workdir):
+    """
+    Create the UniDec engine and working directory for a worker process.
+    :param configfile: UniDec config file to load, or None for the defaults
+    :param workdir: Directory in which to make the working directory for this worker
+    :return: None
+    """
+    global worker_engine, worker_dir
+    from unidec.engine import UniDec
+    worker_engine = UniDec(ignore_args=True)
+    if configfile is not None:
+        worker_engine.load_config(configfile)
+    worker_dir = tempfile.mkdtemp(prefix="worker_", dir=workdir)
+
+
+def deconvolve_scan(data, peaks_only=False):
+    """
+    Deconvolve one scan with the engine of this worker.
+    :param data: Scan data (N x 2)
+    :param peaks_only: If True, return the peak list. Otherwise, return the zero-charge mass spectrum.
+    :return: Array of masses and intensities (N x 2), or None if the deconvolution failed
+    """
+    eng = worker_engine
+    if len(ud.dataprep(data, eng.config)) < 2:
+        return np.zeros((0, 2))
+    try:
+        eng.pass_data_in(data, dirname=worker_dir, fname="scan.txt", silent=True, refresh=True)
+        eng.process_data(silent=True)
+        eng.run_unidec(silent=True, efficiency=True)
+        if peaks_only:
+            eng.pick_peaks()
+            out = np.transpose([eng.pks.get_values("mass"), eng.pks.get_values("height")])
+        else:
+            out = eng.data.massdat
+    except Exception as e:
+        print("Error deconvolving scan:", e)
+        return None
+    return np.reshape(np.array(out, dtype=float), (-1, 2))[:, :2]
+
+
+def deconvolve_batch(batch, peaks_only=False):
+    """
+    Deconvolve a batch of scans in a worker.
+    :param batch: List of scan data arrays
+    :param peaks_only: Passed to deconvolve_scan
+    :return: List of results from deconvolve_scan
+    """
+    return [deconvolve_scan(data, peaks_only=peaks_only) for data in batch]
+
+
+def open_output(outfile, source, peaks_only, resume=True):
+    """
+    Open the output HDF5 file, creating the packed datasets if needed.
+    :param outfile: Output HDF5 file path
+    :param source: Path of the input file, stored as an attribute
+    :param peaks_only: Whether the output holds peak lists or zero-charge spectra
+    :param resume: If True, keep scans already in the file. If False, start over.
+    :return: Open h5py File, the "scans" group, and the set of scan indexes already written
+    """
+    hdf = h5py.File(outfile, "a")
+    mode = "peaks" if peaks_only else "mass"
+    if "scans" in hdf and (not resume or hdf["scans"].attrs.get("mode") != mode):
+        del hdf["scans"]
+    if "scans" not in hdf:
+        group = hdf.create_group("scans")
+        group.attrs["source"] = str(source)
+        group.attrs["mode"] = mode
+        for name in ["mass", "intensity"]:
+            group.create_dataset(name, shape=(0,), maxshape=(None,), dtype=float, chunks=(65536,))
+        group.create_dataset("offsets", data=np.zeros(1, dtype=np.int64), maxshape=(None,), chunks=(4096,))
+        group.create_dataset("index", shape=(0,), maxshape=(None,), dtype=np.int64, chunks=(4096,))
+        group.create_dataset("id", shape=(0,), maxshape=(None,), dtype=h5py.string_dtype(), chunks=(4096,))
+        group.create_dataset("time", shape=(0,), maxshape=(None,), dtype=float, chunks=(4096,))
+        group.create_dataset("failed", shape=(0,), maxshape=(None,), dtype=np.int64, chunks=(4096,))
+    group = hdf["scans"]
+    done = set(int(i) for i in group["index"][()])
+    return hdf, group, done
+
+
+def append_dataset(dataset, values):
+    start = len(dataset)
+    dataset.resize((start + len(values),))
+    dataset[start:] = values
+
+
+def write_results(group, scans, results):
+    """
+    Append deconvolved scans to the packed datasets. The scan indexes are written last, so a scan only counts as
+    done once all of its values are in the file. Scans that failed are written to "failed" instead, and scans that
+    are done are removed from it.
+    :param group: HDF5 group from open_output
+    :param scans: List of (scan index, scan ID, scan time) for each result
+    :param results: List of arrays (N x 2) from deconvolve_scan, or None for scans that failed
+    :return: None
+    """
+    if len(results) == 0:
+        return
+    failed = [s[0] for s, r in zip(scans, results) if r is None]
+    scans = [s for s, r in zip(scans, results) if r is not None]
+    results = [r for r in results if r is not None]
+    # Drop anything past the last complete scan, in case an earlier write was interrupted
+    n = len(group["index"])
+    group["offsets"].resize((n + 1,))
+    for name in ["mass", "intensity"]:
+        group[name].resize((group["offsets"][-1],))
+    for name in ["time", "id"]:
+        group[name].resize((n,))
+
+    lengths = np.array([len(r) for r in results], dtype=np.int64)
+    values = np.concatenate(results) if np.sum(lengths) > 0 else np.zeros((0, 2))
+    append_dataset(group["mass"], values[:, 0])
+    append_dataset(group["intensity"], values[:, 1])
+    append_dataset(group["time"], np.array([s[2] for s in scans], dtype=float))
+    append_dataset(group["id"], np.array([str(s[1]) for s in scans], dtype=object))
+    append_dataset(group["offsets"], group["offsets"][-1] + np.cumsum(lengths))
+    indexes = np.array([s[0] for s in scans], dtype=np.int64)
+    append_dataset(group["index"], indexes)
+
+    oldfailed = group["failed"][()]
+    newfailed = np.union1d(np.setdiff1d(oldfailed, indexes), np.array(failed, dtype=np.int64))
+    if not np.array_equal(oldfailed, newfailed):
+        group["failed"].resize((len(newfailed),))
+        group["failed"][:] = newfailed
+    group.file.flush()
+
+
+def deconvolve_scans(path, outfile=None, configfile=None, peaks_only=False, nworkers=None, batchsize=None,
+                     resume=True, threshold=-1):
+    """
+    Deconvolve each MS1 scan in an mzML file and write the results to a single HDF5 file in scan order.
+    :param path: Path to the mzML file
+    :param outfile: Output HDF5 file path. Default is the input file name with _deconvolved.hdf5.
+    :param configfile: UniDec config file to use for every scan. None for the defaults.
+    :param peaks_only: If True, write peak lists. Otherwise, write the zero-charge mass spectra.
+    :param nworkers: Number of worker processes. Default is the number of CPUs.
+    :param batchsize: Number of scans to read before each round of deconvolution. Default is 8 per worker.
+    :param resume: If True, skip scans already in outfile
+    :param threshold: Intensity threshold applied to each scan when it is read
+    :return: Output file path
+    """
+    begin = time.perf_counter()
+    if outfile is None:
+        header = path[:-3] if path.lower().endswith(".gz") else path
+        outfile = os.path.splitext(header)[0] + "_deconvolved.hdf5"
+    if nworkers is None:
+        nworkers = multiprocessing.cpu_count()
+    if batchsize is None:
+        batchsize = 8 * nworkers
+
+    hdf, group, done = open_output(outfile, path, peaks_only, resume=resume)
+    if len(done) > 0:
+        print("Resuming with", len(done), "scans already deconvolved")
+
+    workdir = tempfile.mkdtemp(prefix="scandec_", dir=os.path.dirname(os.path.abspath(outfile)))
+    num = 0
+    try:
+        with ProcessPoolExecutor(max_workers=nworkers, initializer=init_worker,
+                                 initargs=(configfile, workdir)) as executor:
+            scans = []
+            datalist = []
+            for index, id, scantime, data in iter_ms1_scans(path, threshold=threshold, skip=done):
+                scans.append((index, id, scantime))
+                datalist.append(data)
+                if len(datalist) >= batchsize:
+                    num += run_batch(executor, group, scans, datalist, nworkers, peaks_only)
+                    scans, datalist = [], []
+                    print("Deconvolved Scans:", num, "Time: %.2gs" % (time.perf_counter() - begin))
+            num += run_batch(executor, group, scans, datalist, nworkers, peaks_only)
+    finally:
+        hdf.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("Deconvolved", num, "scans to", outfile)
+    print("Total Time:", time.perf_counter() - begin)
+    return outfile
+
+
+def run_batch(executor, group, scans, datalist, nworkers, peaks_only):
+    """
+    Split a batch of scans across the workers, then write the results in order.
+    :return: Number of scans written, including those that failed
+    """
+    if len(datalist) == 0:
+        return 0
+    chunksize = int(np.ceil(len(datalist) / float(nworkers)))
+    chunks = [datalist[i:i + chunksize] for i in range(0, len(datalist), chunksize)]
+    futures = [executor.submit(deconvolve_batch, chunk, peaks_only) for chunk in chunks]
+    results = [r for fut in futures for r in fut.result()]
+    write_results(group, scans, results)
+    return len(results)
+
+
+def read_scans(outfile):
+    """
+    Read the deconvolved scans from an output file.
+    :param outfile: HDF5 file from deconvolve_scans
+    :return: Arrays of scan indexes, scan IDs, and times, and a list of data arrays (N x 2) for each scan, in scan
+    order. Scans that failed are not included. Use read_failed to get their indexes.
+    """
+    hdf = h5py.File(outfile, "r")
+    group = hdf["scans"]
+    mass = group["mass"][()]
+    intensity = group["intensity"][()]
+    offsets = group["offsets"][()]
+    index = group["index"][()]
+    ids = group["id"].asstr()[()]
+    times = group["time"][()]
+    hdf.close()
+    # Ignore anything past the last complete scan
+    n = len(index)
+    ids = ids[:n]
+    times = times[:n]
+    order = np.argsort(index, kind="stable")
+    data = [np.transpose([mass[offsets[i]:offsets[i + 1]], intensity[offsets[i]:offsets[i + 1]]]) for i in order]
+    return index[order], ids[order], times[order], data
+
+
+def read_failed(outfile):
+    """
+    Read the indexes of the scans that failed to deconvolve from an output file.
+    :param outfile: HDF5 file from deconvolve_scans
+    :return: Array of scan indexes
+    """
+    hdf = h5py.File(outfile, "r")
+    failed = hdf["scans/failed"][()]
+    hdf.close()
+    return failed
+
+
+def main(*args, **kwargs):
+    print("Running Scan Deconvolution")
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "f:o:c:n:p", ["file=", "out=", "config=", "workers=", "peaks",
+                                                                "restart"])
+    except getopt.GetoptError as e:
+        print("Error in Argv. Likely unknown option: ", sys.argv, e)
+        print("Known options: -f, -o, -c, -n, -p, --restart")
+        return None
+
+    infile = None
+    outfile = None
+    configfile = None
+    nworkers = None
+    peaks_only = False
+    resume = True
+    for opt, arg in opts:
+        if opt in ("-f", "--file"):
+            infile = arg
+        if opt in ("-o", "--out"):
+            outfile = arg
+        if opt in ("-c", "--config"):
+            configfile = arg
+        if opt in ("-n", "--workers"):
+            nworkers = int(arg)
+        if opt in ("-p", "--peaks"):
+            peaks_only = True
+        if opt == "--restart":
+            resume = False
+    if infile is None and len(args) > 0:
+        infile = args[0]
+    if infile is None:
+        print("No Input File Specified")
+        return None
+    return deconvolve_scans(infile, outfile=outfile, configfile=configfile, peaks_only=peaks_only,
+                            nworkers=nworkers, resume=resume)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
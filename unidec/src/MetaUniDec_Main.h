@@ -16,6 +16,138 @@
 //#include "UniDecLC_Main.h"
 //#include "UD_peak_width.h"
 
+//Checks whether two spectra have the same m/z axis, in which case they can share a peak shape
+int same_mz_axis(const Config config1, const Input inp1, const Config config2, const Input inp2)
+{
+	if (config1.lengthmz != config2.lengthmz) { return 0; }
+	return memcmp(inp1.dataMZ, inp2.dataMZ, config1.lengthmz * sizeof(float)) == 0;
+}
+
+//Deconvolves spectra start to end - 1 concurrently.
+//All reads and writes go through the shared file handle on a single thread, in order. Only the deconvolutions run in parallel.
+void run_metaunidec_batch(int argc, char* argv[], Config config, const int start, const int end, const int num)
+{
+	int n = end - start;
+	Config* configs = calloc(n, sizeof(Config));
+	Input* inps = calloc(n, sizeof(Input));
+	Decon* decons = calloc(n, sizeof(Decon));
+	DeconSetup* setups = calloc(n, sizeof(DeconSetup));
+	float* times = calloc(n, sizeof(float));
+	int* shapeleader = calloc(n, sizeof(int));
+	int* leader = calloc(n, sizeof(int));
+
+	//Read everything up front
+	for (int i = 0; i < n; i++)
+	{
+		configs[i] = config;
+		configs[i].metamode = start + i;
+		// Stop printing every file for large files
+		if (num > 100) {
+			if ((start + i) % (num / 10) == 0) { configs[i].silent = 0; }
+			else { configs[i].silent = 1; }
+		}
+		inps[i] = SetupInputs();
+		SetUpUniDecInputs(argc, argv, &configs[i], &inps[i], 0);
+	}
+
+	//Spectra that share an m/z axis with the previous one share its peak shape.
+	//If the allowed points also match, they share the blur setup as well.
+	for (int i = 0; i < n; i++)
+	{
+		shapeleader[i] = i;
+		leader[i] = i;
+		if (i > 0 && same_mz_axis(configs[i - 1], inps[i - 1], configs[i], inps[i]))
+		{
+			shapeleader[i] = shapeleader[i - 1];
+			int ln = configs[i].lengthmz * configs[i].numz;
+			if (memcmp(inps[i - 1].barr, inps[i].barr, ln * sizeof(char)) == 0) { leader[i] = leader[i - 1]; }
+		}
+	}
+
+	//Deconvolve in rounds that each build at most one setup per thread, so that only a few setups are held at once.
+	//Sharing only runs between consecutive spectra, so the next round can only use the setups of the last spectrum
+	//in a round. Those are kept until they are no longer used, and all others are freed at the end of each round.
+	int nthreads = omp_get_max_threads();
+	char* held = calloc(n, sizeof(char));
+	int r0 = 0;
+	while (r0 < n)
+	{
+		int r1 = r0;
+		int nnew = 0;
+		int nshapes = 0;
+		while (r1 < n && (leader[r1] != r1 || nnew < nthreads))
+		{
+			if (leader[r1] == r1) { nnew++; }
+			if (shapeleader[r1] == r1) { nshapes++; }
+			r1++;
+		}
+		int m = r1 - r0;
+
+		//Only spread the setups and deconvolutions over threads if there are enough of them.
+		//Otherwise, let each one use the inner loops.
+		#pragma omp parallel for schedule(dynamic) if (nshapes >= nthreads)
+		for (int i = r0; i < r1; i++)
+		{
+			if (shapeleader[i] == i) { setups[i] = SetUpDeconvolution(configs[i], inps[i], 1, 0); }
+		}
+		#pragma omp parallel for schedule(dynamic) if (nnew - nshapes >= nthreads)
+		for (int i = r0; i < r1; i++)
+		{
+			if (leader[i] == i && shapeleader[i] != i)
+			{
+				CopyPeakShape(configs[i], &setups[shapeleader[i]], &setups[i]);
+				SetUpBlurs(configs[i], inps[i], &setups[i], 1);
+			}
+		}
+		for (int i = r0; i < r1; i++)
+		{
+			if (leader[i] == i) { held[i] = 1; }
+		}
+
+		//Run the deconvolutions
+		#pragma omp parallel for schedule(dynamic) if (m >= nthreads)
+		for (int i = r0; i < r1; i++)
+		{
+			double t0 = omp_get_wtime();
+			decons[i] = RunDeconvolution(configs[i], inps[i], &setups[leader[i]], 1, 1);
+			times[i] = (float)(omp_get_wtime() - t0);
+		}
+
+		for (int i = 0; i < r1; i++)
+		{
+			if (held[i] && (r1 == n || (leader[r1] != i && shapeleader[r1] != i)))
+			{
+				FreeDeconSetup(setups[i]);
+				held[i] = 0;
+			}
+		}
+		r0 = r1;
+	}
+	free(held);
+
+	//Write the results in order
+	for (int i = 0; i < n; i++)
+	{
+		// Run DoubleDec if it's checked. FFTW planning is not thread safe, so this stays serial.
+		if (configs[i].doubledec) {
+			printf("Running DoubleDec now\n");
+			DoubleDecon(&configs[i], &decons[i]);
+		}
+		WriteUniDecOutputs(configs[i], &decons[i], &inps[i], times[i]);
+		if (configs[i].silent == 0) { printf("Spectrum %d: %d iterations in %f seconds\n", start + i, decons[i].iterations, times[i]); }
+		FreeInputs(inps[i]);
+		FreeDecon(decons[i]);
+	}
+
+	free(configs);
+	free(inps);
+	free(decons);
+	free(setups);
+	free(times);
+	free(shapeleader);
+	free(leader);
+}
+
 int run_metaunidec(int argc, char* argv[], Config config) {
 	clock_t starttime;
 	starttime = clock();
@@ -40,7 +172,7 @@ int run_metaunidec(int argc, char* argv[], Config config) {
 		else if (strcmp(argv[2], "-scanpeaks") == 0) { mode = 10; }
 	}
 
-	if (mode == 1 || mode == 2 || mode == 4 || mode==0)
+	if (mode == 2)
 	{
 		//Iterate through files
 		for (int i = 0; i < num; i++)
@@ -55,23 +187,30 @@ int run_metaunidec(int argc, char* argv[], Config config) {
 					config.silent = 1;
 				}
 			}
-			// Run either deconvolution or processing
+			//printf("Processing\n");
 			config.metamode = i;
-			if (mode == 1)
-			{
-				//printf("Deconvolving\n");
-				run_unidec(argc, argv, config);
-			}
-			else if (mode == 2)
-			{
-				//printf("Processing\n");
-				process_data(argc, argv, config);
-			}
-			else
+			process_data(argc, argv, config);
+		}
+	}
+
+	if (mode == 1 || mode == 4 || mode == 0)
+	{
+		//Deconvolve in batches of spectra, several per thread, to keep memory bounded
+		int batchsize = 4 * omp_get_max_threads();
+		for (int start = 0; start < num; start += batchsize)
+		{
+			int end = start + batchsize;
+			if (end > num) { end = num; }
+			if (mode != 1)
 			{
-				process_data(argc, argv, config);
-				run_unidec(argc, argv, config);
+				for (int i = start; i < end; i++)
+				{
+					config.metamode = i;
+					if (num > 100) { config.silent = (i % (num / 10) != 0); }
+					process_data(argc, argv, config);
+				}
 			}
+			run_metaunidec_batch(argc, argv, config, start, end, num);
 		}
 	}
 	
@@ -67,6 +67,114 @@ void read_ofile(const char* infile, const int olength, float* basemasses, float*
 }
 
 
+typedef struct MatchList MatchList;
+
+struct MatchList {
+	int* matches;
+	unsigned long long* matchindexes;
+	float* errors;
+	int len;
+	int size;
+};
+
+void init_matchlist(MatchList* list, int size)
+{
+	if (size < 1) { size = 1; }
+	list->len = 0;
+	list->size = size;
+	list->matches = calloc(size, sizeof(int));
+	list->matchindexes = calloc(size, sizeof(unsigned long long));
+	list->errors = calloc(size, sizeof(float));
+}
+
+void free_matchlist(MatchList* list)
+{
+	free(list->matches);
+	free(list->matchindexes);
+	free(list->errors);
+}
+
+//Adds a match, doubling the buffers when they are full
+void add_match(MatchList* list, int match, unsigned long long matchindex, float error)
+{
+	if (list->len == list->size)
+	{
+		list->size *= 2;
+		list->matches = realloc(list->matches, list->size * sizeof(int));
+		list->matchindexes = realloc(list->matchindexes, list->size * sizeof(unsigned long long));
+		list->errors = realloc(list->errors, list->size * sizeof(float));
+		if (list->matches == NULL || list->matchindexes == NULL || list->errors == NULL) { printf("Error allocating match buffer\n"); exit(99); }
+	}
+	list->matches[list->len] = match;
+	list->matchindexes[list->len] = matchindex;
+	list->errors[list->len] = error;
+	list->len++;
+}
+
+//Index of the first element of the sorted array that is greater than or equal to value
+int lower_bound(const double* sorted, const int len, const double value)
+{
+	int lo = 0;
+	int hi = len;
+	while (lo < hi)
+	{
+		int mid = lo + (hi - lo) / 2;
+		if (sorted[mid] < value) { lo = mid + 1; }
+		else { hi = mid; }
+	}
+	return lo;
+}
+
+typedef struct MatchSpace MatchSpace;
+
+struct MatchSpace {
+	int olen;
+	int plen;
+	const double* basemasses;
+	const double* monomasses;
+	const int* mins;
+	const int* dims;
+	const unsigned long long* mults;
+	const double* restlow;
+	const double* resthigh;
+	const double* psorted;
+	const int* porder;
+	double tolerance;
+};
+
+//Depth first search over the oligomer dimensions.
+//The mass and linear index are updated incrementally, and a branch is pruned if no peak falls within the range of masses
+//that can still be reached from the partial mass.
+void match_search(const MatchSpace* ms, const int depth, const double partialmass, const unsigned long long partialindex, MatchList* list)
+{
+	if (depth == ms->olen)
+	{
+		int start = lower_bound(ms->psorted, ms->plen, partialmass - ms->tolerance);
+		for (int k = start; k < ms->plen && ms->psorted[k] < partialmass + ms->tolerance; k++)
+		{
+			float abserror = (float) fabs(partialmass - ms->psorted[k]);
+			if (abserror < ms->tolerance) {
+				add_match(list, ms->porder[k], partialindex, abserror);
+			}
+		}
+		return;
+	}
+
+	for (int n = 0; n < ms->dims[depth]; n++)
+	{
+		double mass = partialmass + ms->basemasses[depth] + (double)(ms->mins[depth] + n) * ms->monomasses[depth];
+		double low = mass + ms->restlow[depth + 1] - ms->tolerance;
+		double high = mass + ms->resthigh[depth + 1] + ms->tolerance;
+		int k = lower_bound(ms->psorted, ms->plen, low);
+		if (k == ms->plen || ms->psorted[k] > high) {
+			// If masses increase with n, no later n in this dimension can reach a peak either
+			if (ms->monomasses[depth] >= 0 && k == ms->plen) { break; }
+			continue;
+		}
+		match_search(ms, depth + 1, mass, partialindex + (unsigned long long) n * ms->mults[depth], list);
+	}
+}
+
 int unidec_match(int argc, char* argv[]) 
 {
 	printf("Running Match\n");
@@ -74,12 +182,14 @@ int unidec_match(int argc, char* argv[])
 	//char buffer[1024];
 	//setvbuf(stdout, buffer, _IOLBF, sizeof(buffer));
 
-	clock_t starttime;
-	starttime = clock();
+	double starttime = omp_get_wtime();
 
 	char* ofile = argv[2];
 	char* pfile = argv[3];
 
+	float tolerance = 1000;
+	if (argc > 4) { tolerance = atof(argv[4]); }
+
 	int olen = getfilelength(ofile);
 	int plen = getfilelength(pfile);
 
@@ -93,17 +203,27 @@ int unidec_match(int argc, char* argv[])
 	readfile(pfile, plen, peakmasses, peakints);
 	free(peakints);
 
-	//Sort Peak Masses
-	/*
-	float* psorted = calloc(plen, sizeof(float));
-	memcpy(psorted, peakmasses, sizeof(float) * plen);
-	qsort(psorted, plen, sizeof(float), compare_highest_first);*/
-
 	for (int i = 0; i < plen; i++)
 	{
 		printf("Peak: %f\n", peakmasses[i]);
 	}
 
+	//Sort peak masses, keeping track of the original order
+	double* psorted = calloc(plen, sizeof(double));
+	int* porder = calloc(plen, sizeof(int));
+	for (int i = 0; i < plen; i++)
+	{
+		int k = i;
+		while (k > 0 && psorted[k - 1] > peakmasses[i])
+		{
+			psorted[k] = psorted[k - 1];
+			porder[k] = porder[k - 1];
+			k--;
+		}
+		psorted[k] = peakmasses[i];
+		porder[k] = i;
+	}
+
 	float* basemasses, * monomasses;
 	int* mins, * maxs;
 	char * onames;
@@ -115,19 +235,8 @@ int unidec_match(int argc, char* argv[])
 
 	read_ofile(ofile, olen, basemasses, monomasses, mins, maxs, onames);
 
-	//
-	// Maybe this just would slow things down...
-	// Put in the sorted pfile
-	// Need to sort the ofile
-	// Need to make it skip ahead when it's already too big
-	// Need to take a break first...
-	//
-
 	int* dims;
-	int* nindex;
-
 	dims = calloc(olen, sizeof(int));
-	nindex = calloc(olen, sizeof(int));
 
 	for (int i = 0; i < olen; i++)
 	{
@@ -138,7 +247,6 @@ int unidec_match(int argc, char* argv[])
 	for (int i = 0; i < olen; i++)
 	{
 		maxn *= (unsigned long long) dims[i];
-		//printf("Size: %llu\n", maxn);
 	}
 	printf("Max Number: %llu\n", maxn);
 
@@ -155,89 +263,87 @@ int unidec_match(int argc, char* argv[])
 		mults[i] = mult;
 	}
 
-	float tolerance = 1000;
-
-	int matchindex = 0;
-	int maxmatches = plen * 1000;
-
-	unsigned long long* matchindexes;
-	matchindexes = calloc(maxmatches, sizeof(unsigned long long));
-
-	float* errors;
-	errors = calloc(maxmatches, sizeof(float));
-
-	int* matches;
-	matches = calloc(maxmatches, sizeof(int));
-	
-
-	//#pragma omp parallel for
-	for (unsigned long long i = 0; i < maxn; i++)
-	{		
-		if (i%20000000==0 && i!=0){
-			printf("Iteration: %llu\t",i);
-			float percent = (float) i / (float) maxn;
-			printf("Percent: %f\t", percent*100);
-			clock_t inttime = clock();
-			float intsec = (float)(inttime - starttime) / CLOCKS_PER_SEC;
-			if (percent != 0) {
-				printf("Time Remaining: %f (hrs)\t", intsec / percent / 3600);
-				printf("Time per iteration: %f (us)\n", 1e6 * intsec / (float)i);
-			}
-		}
+	//Lowest and highest mass that can be added by the remaining dimensions from each depth onward
+	double* dbase = calloc(olen, sizeof(double));
+	double* dmono = calloc(olen, sizeof(double));
+	double* restlow = calloc(olen + 1, sizeof(double));
+	double* resthigh = calloc(olen + 1, sizeof(double));
+	for (int i = olen - 1; i >= 0; i--)
+	{
+		dbase[i] = basemasses[i];
+		dmono[i] = monomasses[i];
+		double m1 = dbase[i] + (double)mins[i] * dmono[i];
+		double m2 = dbase[i] + (double)maxs[i] * dmono[i];
+		restlow[i] = restlow[i + 1] + fmin(m1, m2);
+		resthigh[i] = resthigh[i + 1] + fmax(m1, m2);
+	}
 
-		lindex_to_nindex(olen, i, mults, nindex);
-		
-		float value = 0;
-		for (int j = 0; j < olen; j++)
+	MatchSpace ms;
+	ms.olen = olen;
+	ms.plen = plen;
+	ms.basemasses = dbase;
+	ms.monomasses = dmono;
+	ms.mins = mins;
+	ms.dims = dims;
+	ms.mults = mults;
+	ms.restlow = restlow;
+	ms.resthigh = resthigh;
+	ms.psorted = psorted;
+	ms.porder = porder;
+	ms.tolerance = tolerance;
+
+	//Search each value of the outermost dimension in parallel, each with its own growing match list
+	int nouter = 1;
+	if (olen > 0) { nouter = dims[0]; }
+	MatchList* lists = calloc(nouter, sizeof(MatchList));
+
+	#pragma omp parallel for schedule(dynamic)
+	for (int n = 0; n < nouter; n++)
+	{
+		init_matchlist(&lists[n], plen);
+		if (olen == 0) { match_search(&ms, 0, 0, 0, &lists[n]); continue; }
+		double mass = dbase[0] + (double)(mins[0] + n) * dmono[0];
+		double low = mass + restlow[1] - tolerance;
+		double high = mass + resthigh[1] + tolerance;
+		int k = lower_bound(psorted, plen, low);
+		if (k < plen && psorted[k] <= high)
 		{
-			value += basemasses[j] + (float) nindex[j] * monomasses[j];
-		}
-		
-		for (int j=0; j<plen; j++)
-		{
-			float abserror = fabsf(value - peakmasses[j]);
-			//if (error < tolerance)
-			//{continue;}
-			//if (error > tolerance){break;}
-			if (abserror < tolerance) {
-				//printf("%f %d\n", value, j);
-				matches[matchindex] = j;
-				matchindexes[matchindex] = i;
-				errors[matchindex] = abserror;
-				matchindex++;
-				if (matchindex == maxmatches)
-				{
-					matchindex = maxmatches-1;
-				}
-			}
+			match_search(&ms, 1, mass, (unsigned long long) n * mults[0], &lists[n]);
 		}
 	}
+
+	int matchindex = 0;
+	for (int n = 0; n < nouter; n++) { matchindex += lists[n].len; }
 	
-	clock_t end = clock();
-	float totaltime = (float)(end - starttime) / CLOCKS_PER_SEC;
+	double totaltime = omp_get_wtime() - starttime;
 	printf("Done in %f seconds!\n", totaltime);
-	
-	char str1[10000];
+	printf("Matches: %d\n", matchindex);
 
-	//sprintf(str1, "Matchindex: %d\n", matchindex);
-	for(int i=0; i < matchindex; i++)
-	{	
-		sprintf(str1, "%d %llu \n", matches[i], matchindexes[i]);
+	//Output in order of linear index
+	for (int n = 0; n < nouter; n++)
+	{
+		for (int i = 0; i < lists[n].len; i++)
+		{
+			printf("%d %llu %f\n", lists[n].matches[i], lists[n].matchindexes[i], lists[n].errors[i]);
+		}
+		free_matchlist(&lists[n]);
 	}
-	puts(str1);
 
+	free(lists);
 	free(peakmasses);
+	free(psorted);
+	free(porder);
 	free(monomasses);
 	free(basemasses);
+	free(dbase);
+	free(dmono);
+	free(restlow);
+	free(resthigh);
 	free(onames);
 	free(mins);
 	free(maxs);
 	free(dims);
-	free(nindex);
 	free(mults);
-	free(matches);
-	free(matchindexes);
-	free(errors);
 
 	return 0;
-}
\ No newline at end of file
+}
@@ -32,82 +32,76 @@ Decon ExitToBlank(const Config config, Decon decon)
 	return decon;
 }
 
-Decon MainDeconvolution(const Config config, const Input inp, const int silent, const int verbose)
+typedef struct DeconSetup DeconSetup;
+
+//Parameter-independent pieces of a deconvolution: peak shape, blur indexes, and the allowed points.
+//These depend on the data, mzsig, zsig, and msig, but not on beta, psig, or the number of iterations.
+struct DeconSetup {
+	int maxlength;
+	int pslen;
+	int rlen;
+	int* starttab;
+	int* endtab;
+	float* mzdist;
+	float* rmzdist;
+	char* barr;
+	int mlength;
+	int zlength;
+	int numclose;
+	int* mind;
+	int* zind;
+	int* closemind;
+	int* closezind;
+	int* closeind;
+	float* mdist;
+	float* zdist;
+	float* closeval;
+	float* closearray;
+};
+
+void FreeDeconSetup(DeconSetup setup)
 {
-	//Insert time
-	time_t starttime;
-	starttime = clock();
+	free(setup.starttab);
+	free(setup.endtab);
+	free(setup.mzdist);
+	free(setup.rmzdist);
+	free(setup.barr);
+	free(setup.mind);
+	free(setup.zind);
+	free(setup.closemind);
+	free(setup.closezind);
+	free(setup.closeind);
+	free(setup.mdist);
+	free(setup.zdist);
+	free(setup.closeval);
+	free(setup.closearray);
+}
 
-	Decon decon = SetupDecon();
-	char* barr = NULL;
-
-	int mlength, zlength, numclose,
-		* mind = NULL,
-		* zind = NULL,
-		* closemind = NULL,
-		* closezind = NULL,
-		* closeind = NULL;
-	float * mdist = NULL,
-		* zdist = NULL,
-		* oldblur = NULL,
-		* closeval = NULL,
-		* closearray = NULL;
+//Copies the peak shape from one setup to another, for spectra that share an m/z axis
+void CopyPeakShape(const Config config, const DeconSetup* src, DeconSetup* dst)
+{
+	dst->maxlength = src->maxlength;
+	dst->pslen = src->pslen;
+	dst->rlen = src->rlen;
+	dst->starttab = calloc(config.lengthmz, sizeof(int));
+	dst->endtab = calloc(config.lengthmz, sizeof(int));
+	memcpy(dst->starttab, src->starttab, config.lengthmz * sizeof(int));
+	memcpy(dst->endtab, src->endtab, config.lengthmz * sizeof(int));
+	dst->mzdist = calloc(src->pslen, sizeof(float));
+	memcpy(dst->mzdist, src->mzdist, src->pslen * sizeof(float));
+	dst->rmzdist = NULL;
+	if (src->rmzdist != NULL) {
+		dst->rmzdist = calloc(src->rlen, sizeof(float));
+		memcpy(dst->rmzdist, src->rmzdist, src->rlen * sizeof(float));
+	}
+}
 
-	//...................................................................
-	//
-	//     Sets the mzdist with the peak shape
-	//
-	//....................................................................
+//Sets up the neighborhood blur and the allowed points. Depends on the data intensities through inp.barr.
+void SetUpBlurs(const Config config, const Input inp, DeconSetup *setup, const int silent)
+{
 	int ln = config.lengthmz * config.numz;
-	size_t sizelnc = (size_t)ln * sizeof(char);
-	size_t sizelnf = (size_t)ln * sizeof(float);
-	barr = calloc(ln, sizeof(char));
-	memcpy(barr, inp.barr, sizelnc);
-
-	int maxlength = SetUpPeakShape(config, inp, &decon, 0, 1);
-	
-	/*
-	//Create a list of start and end values to box in arrays based on the above threshold
-	starttab = calloc(config.lengthmz, sizeof(int));
-	endtab = calloc(config.lengthmz, sizeof(int));
-	int maxlength = 1;
-	if (config.mzsig != 0) {
-		//Gets maxlength and sets start and endtab
-		maxlength = SetStartsEnds(config, &inp, starttab, endtab);
-
-		//Changes dimensions of the peak shape function. 1D for speedy and 2D otherwise
-		int pslen = config.lengthmz;
-		if (config.speedyflag == 0) { pslen = config.lengthmz * maxlength; }
-		if (verbose == 1) { printf("Maxlength: %d \t Total Size: %zu GB\n", maxlength, pslen*sizeof(float)/1000000000); }
-		mzdist = calloc(pslen, sizeof(float));
-		if (pslen * sizeof(float) / 1000000000 > 4) { printf("Danger: Your data may crash the memory. Consider setting the Peak FWHM to 0.\n"); }
-		int makereverse = 0;
-		if (config.mzsig < 0 || config.beta < 0) { makereverse = 1; rmzdist = calloc(pslen, sizeof(float));
-		//memset(rmzdist, 0, pslen * sizeof(float));
-		}
-		else { rmzdist = calloc(0, sizeof(float)); }
-
-		//Calculates the distance between mz values as a 2D or 3D matrix
-
-		if (config.speedyflag == 0)
-		{
-			if (verbose == 1) { printf("Making Peak Shape 2D\n"); }
-			MakePeakShape2D(config.lengthmz, maxlength, starttab, endtab, inp.dataMZ, fabs(config.mzsig) * config.peakshapeinflate, config.psfun, config.speedyflag, mzdist, rmzdist, makereverse);
-		}
-		else
-		{
-			if (verbose == 1) { printf("Making Peak Shape 1D\n"); }
-			//Calculates peak shape as a 1D list centered at the first element for circular convolutions
-			MakePeakShape1D(inp.dataMZ, config.psmzthresh, config.lengthmz, config.speedyflag, fabs(config.mzsig) * config.peakshapeinflate, config.psfun, mzdist, rmzdist, makereverse);
-		}
-		if (silent == 0) { printf("mzdist set: %f\t maxlength: %d\n", mzdist[0], maxlength); }
-
-	}
-	else
-	{
-		mzdist = calloc(0, sizeof(float));
-		maxlength = 0;
-	}*/
+	setup->barr = calloc(ln, sizeof(char));
+	memcpy(setup->barr, inp.barr, (size_t)ln * sizeof(char));
 
 	//....................................................
 	//
@@ -117,71 +111,149 @@ Decon MainDeconvolution(const Config config, const Input inp, const int silent,
 
 	//sets some parameters regarding the neighborhood blur function
 	if (config.zsig >= 0 && config.msig >= 0) {
-		zlength = 1 + 2 * (int)config.zsig;
-		mlength = 1 + 2 * (int)config.msig;
+		setup->zlength = 1 + 2 * (int)config.zsig;
+		setup->mlength = 1 + 2 * (int)config.msig;
 	}
 	else {
-		if (config.zsig != 0) { zlength = 1 + 2 * (int)(3 * fabs(config.zsig) + 0.5); }
-		else { zlength = 1; }
-		if (config.msig != 0) { mlength = 1 + 2 * (int)(3 * fabs(config.msig) + 0.5); }
-		else { mlength = 1; }
+		if (config.zsig != 0) { setup->zlength = 1 + 2 * (int)(3 * fabs(config.zsig) + 0.5); }
+		else { setup->zlength = 1; }
+		if (config.msig != 0) { setup->mlength = 1 + 2 * (int)(3 * fabs(config.msig) + 0.5); }
+		else { setup->mlength = 1; }
 	}
-	numclose = mlength * zlength;
+	int mlength = setup->mlength;
+	int zlength = setup->zlength;
+	int numclose = mlength * zlength;
+	setup->numclose = numclose;
 
 	//Sets up the blur function in oligomer mass and charge
-	mind = calloc(mlength, sizeof(int));
-	mdist = calloc(mlength, sizeof(float));
+	setup->mind = calloc(mlength, sizeof(int));
+	setup->mdist = calloc(mlength, sizeof(float));
 
 	for (int i = 0; i < mlength; i++)
 	{
-		mind[i] = i - (mlength - 1) / 2;
-		if (config.msig != 0) { mdist[i] = exp(-(pow((i - (mlength - 1) / 2.), 2)) / (2.0 * config.msig * config.msig)); }
-		else { mdist[i] = 1; }
+		setup->mind[i] = i - (mlength - 1) / 2;
+		if (config.msig != 0) { setup->mdist[i] = exp(-(pow((i - (mlength - 1) / 2.), 2)) / (2.0 * config.msig * config.msig)); }
+		else { setup->mdist[i] = 1; }
 	}
 
-	zind = calloc(zlength, sizeof(int));
-	zdist = calloc(zlength, sizeof(float));
+	setup->zind = calloc(zlength, sizeof(int));
+	setup->zdist = calloc(zlength, sizeof(float));
 	for (int i = 0; i < zlength; i++)
 	{
-		zind[i] = i - (zlength - 1) / 2;
-		if (config.zsig != 0) { zdist[i] = exp(-(pow((i - (zlength - 1) / 2.), 2)) / (2.0 * config.zsig * config.zsig)); }
-		else { zdist[i] = 1; }
-		//printf("%f\n", zdist[i]);
+		setup->zind[i] = i - (zlength - 1) / 2;
+		if (config.zsig != 0) { setup->zdist[i] = exp(-(pow((i - (zlength - 1) / 2.), 2)) / (2.0 * config.zsig * config.zsig)); }
+		else { setup->zdist[i] = 1; }
 	}
 
 	//Initializing memory
-	closemind = calloc(numclose, sizeof(int));
-	closezind = calloc(numclose, sizeof(int));
-	closeval = calloc(numclose, sizeof(float));
+	setup->closemind = calloc(numclose, sizeof(int));
+	setup->closezind = calloc(numclose, sizeof(int));
+	setup->closeval = calloc(numclose, sizeof(float));
 	int newlen = numclose * config.lengthmz * config.numz;
-	closeind = calloc(newlen, sizeof(int));
-	closearray = calloc(newlen, sizeof(float));
+	setup->closeind = calloc(newlen, sizeof(int));
+	setup->closearray = calloc(newlen, sizeof(float));
 
 	//Determines the indexes of things that are close as well as the values used in the neighborhood convolution
 	for (int k = 0; k < numclose; k++)
 	{
-		closemind[k] = mind[k % mlength];
-		closezind[k] = zind[(int)k / mlength];
-		closeval[k] = zdist[(int)k / mlength] * mdist[k % mlength];
+		setup->closemind[k] = setup->mind[k % mlength];
+		setup->closezind[k] = setup->zind[(int)k / mlength];
+		setup->closeval[k] = setup->zdist[(int)k / mlength] * setup->mdist[k % mlength];
 	}
-	simp_norm_sum(mlength, mdist);
-	simp_norm_sum(zlength, zdist);
-	simp_norm_sum(numclose, closeval);
+	simp_norm_sum(mlength, setup->mdist);
+	simp_norm_sum(zlength, setup->zdist);
+	simp_norm_sum(numclose, setup->closeval);
 
 	int badness1 = 1;
-	for (int i = 0; i < config.lengthmz * config.numz; i++)
+	for (int i = 0; i < ln; i++)
 	{
-		if (barr[i] == 1) { badness1 = 0; }
+		if (setup->barr[i] == 1) { badness1 = 0; }
 	}
 	if (badness1 == 1) { printf("ERROR:1\n"); exit(10); }
 
 	//Set up blur
-	//MakeBlur(config.lengthmz, config.numz, numclose, barr, closezind, closemind, inp.mtab, config.molig, config.adductmass, inp.nztab, inp.dataMZ, closeind, threshold, config);
-	MakeSparseBlur(numclose, barr, closezind, closemind, inp.mtab, inp.nztab, inp.dataMZ, closeind, closeval, closearray, config);
+	MakeSparseBlur(numclose, setup->barr, setup->closezind, setup->closemind, inp.mtab, inp.nztab, inp.dataMZ, setup->closeind, setup->closeval, setup->closearray, config);
 
 	if (silent == 0) { printf("Charges blurred: %d  Masses blurred: %d\n", zlength, mlength); }
+}
 
-	//IntPrint(closeind, numclose * config.lengthmz * config.numz);
+DeconSetup SetUpDeconvolution(const Config config, const Input inp, const int silent, const int verbose)
+{
+	DeconSetup setup;
+	Decon shape = SetupDecon();
+
+	//...................................................................
+	//
+	//     Sets the mzdist with the peak shape
+	//
+	//....................................................................
+	setup.maxlength = SetUpPeakShape(config, inp, &shape, silent, verbose);
+	setup.starttab = shape.starttab;
+	setup.endtab = shape.endtab;
+	setup.mzdist = shape.mzdist;
+	setup.rmzdist = shape.rmzdist;
+	setup.pslen = 0;
+	setup.rlen = 0;
+	if (config.mzsig != 0) {
+		setup.pslen = config.lengthmz;
+		if (config.speedyflag == 0) { setup.pslen = config.lengthmz * setup.maxlength; }
+		if (config.mzsig < 0 || config.beta < 0) { setup.rlen = setup.pslen; }
+	}
+
+	SetUpBlurs(config, inp, &setup, silent);
+	return setup;
+}
+
+//Runs the deconvolution from a prepared setup.
+//If copyshape is 1, the peak shape is copied so the setup can be reused. Otherwise, the peak shape is handed over to the Decon.
+Decon RunDeconvolution(const Config config, const Input inp, DeconSetup *setup, const int copyshape, const int silent)
+{
+	//Insert time
+	time_t starttime;
+	starttime = clock();
+
+	Decon decon = SetupDecon();
+	float * oldblur = NULL;
+
+	int ln = config.lengthmz * config.numz;
+	size_t sizelnc = (size_t)ln * sizeof(char);
+	size_t sizelnf = (size_t)ln * sizeof(float);
+	char* barr = calloc(ln, sizeof(char));
+	memcpy(barr, setup->barr, sizelnc);
+
+	int maxlength = setup->maxlength;
+	if (copyshape == 1) {
+		decon.starttab = calloc(config.lengthmz, sizeof(int));
+		decon.endtab = calloc(config.lengthmz, sizeof(int));
+		memcpy(decon.starttab, setup->starttab, config.lengthmz * sizeof(int));
+		memcpy(decon.endtab, setup->endtab, config.lengthmz * sizeof(int));
+		decon.mzdist = calloc(setup->pslen, sizeof(float));
+		memcpy(decon.mzdist, setup->mzdist, setup->pslen * sizeof(float));
+		if (setup->rmzdist != NULL) {
+			decon.rmzdist = calloc(setup->rlen, sizeof(float));
+			memcpy(decon.rmzdist, setup->rmzdist, setup->rlen * sizeof(float));
+		}
+	}
+	else {
+		decon.starttab = setup->starttab;
+		decon.endtab = setup->endtab;
+		decon.mzdist = setup->mzdist;
+		decon.rmzdist = setup->rmzdist;
+		setup->starttab = NULL;
+		setup->endtab = NULL;
+		setup->mzdist = NULL;
+		setup->rmzdist = NULL;
+	}
+
+	int mlength = setup->mlength;
+	int zlength = setup->zlength;
+	int numclose = setup->numclose;
+	const int* closemind = setup->closemind;
+	const int* closezind = setup->closezind;
+	const int* closeind = setup->closeind;
+	const float* mdist = setup->mdist;
+	const float* zdist = setup->zdist;
+	const float* closearray = setup->closearray;
 
 	//Determine the maximum intensity in the data
 	float dmax = Max(inp.dataInt, config.lengthmz);
@@ -279,17 +351,9 @@ Decon MainDeconvolution(const Config config, const Input inp, const int silent,
 	if (badness == 1) {
 		if (silent == 0) { printf("ERROR: Setup is bad. No points are allowed.\n Check that either mass smoothing, charge smoothing, manual assignment, or isotope mode are on.\n"); };
 		decon = ExitToBlank(config, decon);
-		free(closeval);
-		free(closearray);
-		free(closemind);
-		free(closezind);
-
-		free(mdist);
-		free(mind);
-		free(zind);
-		free(zdist);
+		free(dataInt2);
+		free(oldblur);
 		free(barr);
-		free(closeind);
 		return(decon);
 	}
 
@@ -582,22 +646,22 @@ Decon MainDeconvolution(const Config config, const Input inp, const int silent,
 	printf("Deconvolution Time: %f\n", (float)(clock() - starttime) / CLOCKS_PER_SEC);
 
 	//Free Memory
-	free(closeval);
-	free(closearray);
-	free(closemind);
-	free(closezind);
-
-	free(mdist);
-	free(mind);
-	free(zind);
-	free(zdist);
 	free(barr);
-	free(closeind);
 	return decon;
 }
 
+Decon MainDeconvolution(const Config config, const Input inp, const int silent, const int verbose)
+{
+	DeconSetup setup = SetUpDeconvolution(config, inp, silent, 1);
+	Decon decon = RunDeconvolution(config, inp, &setup, 0, silent);
+	FreeDeconSetup(setup);
+	return decon;
+}
+
+
 void RunAutotune(Config *config, Input *inp, Decon *decon) {
 	printf("Starting Autotune...\n");
+	double starttime = omp_get_wtime();
 	float start_peakwindow = config->peakwin;
 	float start_peakthresh = config->peakthresh;
 	config->peakwin = 3 * config->massbins;
@@ -607,6 +671,7 @@ void RunAutotune(Config *config, Input *inp, Decon *decon) {
 	config->numit = 10;
 	*decon = MainDeconvolution(*config, *inp, 1, 0);
 	float bestscore = decon->uniscore;
+	FreeDecon(*decon);
 
 	float start_mzsig = config->mzsig;
 	float start_zsig = config->zsig;
@@ -627,33 +692,55 @@ void RunAutotune(Config *config, Input *inp, Decon *decon) {
 	int n_betas = 3;
 	int n_psigs = 3;
 
-	for (int i = 0; i < n_mzsigs; i++)
+	//The peak shape and blur depend only on mzsig and zsig, so set them up once for each pair and share them across beta and psig
+	int n_setups = n_mzsigs * n_zsigs;
+	DeconSetup* setups = calloc(n_setups, sizeof(DeconSetup));
+	for (int s = 0; s < n_setups; s++)
 	{
-		for (int j = 0; j < n_zsigs; j++)
-		{
-			for (int k = 0; k < n_betas; k++)
-			{
-				for (int h = 0; h < n_psigs; h++)
-				{
-					config->mzsig = mz_sigs[i];
-					config->zsig = z_sigs[j];
-					config->beta = betas[k];
-					config->psig = psigs[h];
-
-					*decon = MainDeconvolution(*config, *inp, 1, 0);
-					float newscore = decon->uniscore;
-					if (newscore > bestscore) {
-						start_mzsig = config->mzsig;
-						start_zsig = config->zsig;
-						start_beta = config->beta;
-						start_psig = config->psig;
-						bestscore = newscore;
-					}
-				}
-			}
+		Config c = *config;
+		c.mzsig = mz_sigs[s / n_zsigs];
+		c.zsig = z_sigs[s % n_zsigs];
+		c.beta = 0; //All betas on the grid are positive, so no reverse peak shape is needed
+		setups[s] = SetUpDeconvolution(c, *inp, 1, 0);
+	}
+
+	//Run the grid concurrently. Each run gets its own copy of the peak shape and works serially inside.
+	int n_grid = n_setups * n_betas * n_psigs;
+	float* scores = calloc(n_grid, sizeof(float));
+	#pragma omp parallel for schedule(dynamic)
+	for (int n = 0; n < n_grid; n++)
+	{
+		int s = n / (n_betas * n_psigs);
+		Config c = *config;
+		c.mzsig = mz_sigs[s / n_zsigs];
+		c.zsig = z_sigs[s % n_zsigs];
+		c.beta = betas[(n / n_psigs) % n_betas];
+		c.psig = psigs[n % n_psigs];
+
+		Decon d = RunDeconvolution(c, *inp, &setups[s], 1, 1);
+		scores[n] = d.uniscore;
+		FreeDecon(d);
+	}
+
+	//Pick the best in grid order so that ties resolve the same way as a serial scan
+	for (int n = 0; n < n_grid; n++)
+	{
+		int s = n / (n_betas * n_psigs);
+		printf("mzsig: %f zsig: %f beta: %f psig: %f Score: %f\n", mz_sigs[s / n_zsigs], z_sigs[s % n_zsigs],
+			betas[(n / n_psigs) % n_betas], psigs[n % n_psigs], scores[n]);
+		if (scores[n] > bestscore) {
+			start_mzsig = mz_sigs[s / n_zsigs];
+			start_zsig = z_sigs[s % n_zsigs];
+			start_beta = betas[(n / n_psigs) % n_betas];
+			start_psig = psigs[n % n_psigs];
+			bestscore = scores[n];
 		}
 	}
 
+	for (int s = 0; s < n_setups; s++) { FreeDeconSetup(setups[s]); }
+	free(setups);
+	free(scores);
+
 	config->numit = start_numit;
 	config->mzsig = start_mzsig;
 	config->zsig = start_zsig;
@@ -662,32 +749,13 @@ void RunAutotune(Config *config, Input *inp, Decon *decon) {
 	config->peakthresh = start_peakthresh;
 	config->peakwin = start_peakwindow;
 	printf("Best mzsig: %f zsig: %f beta: %f psig: %f Score:%f\n", start_mzsig, start_zsig, start_beta, start_psig, bestscore);
+	printf("Autotune Time: %f\n", omp_get_wtime() - starttime);
 	*decon = MainDeconvolution(*config, *inp, 0, 0);
 }
 
-int run_unidec(int argc, char *argv[], Config config) {
-	//Initialize
-	clock_t starttime;
-	starttime = clock();
-
-	Input inp = SetupInputs();
-
-	bool autotune = 0;
-	int verbose = 0;
-	if (argc>2)
-	{
-		if (strcmp(argv[2], "-test") == 0)
-		{
-			float testmass = atof(argv[3]);
-			printf("Testing Mass: %f\n", testmass);
-			test_isotopes(testmass, inp.isoparams);
-			exit(0);
-		}
-
-		if (strcmp(argv[2], "-autotune") == 0){autotune = 1;}
-		if (strcmp(argv[2], "-verbose") == 0) { verbose = 1; }
-	}
-
+//Reads the data and sets up the masses, allowed points, limits, manual assignments, and isotopes
+void SetUpUniDecInputs(int argc, char* argv[], Config* config, Input* inp, const int verbose)
+{
 	//..................................
 	//
 	// File Inputs
@@ -696,7 +764,7 @@ int run_unidec(int argc, char *argv[], Config config) {
 
 	if (argc >= 2)
 	{
-		ReadInputs(argc, argv, &config, &inp);
+		ReadInputs(argc, argv, config, inp);
 	}
 	else{ exit(88); }
 	if (verbose == 1) { printf("Read Inputs\n"); }
@@ -708,33 +776,98 @@ int run_unidec(int argc, char *argv[], Config config) {
 	//...............................................................
 
 
-	CalcMasses(&config, &inp);
+	CalcMasses(config, inp);
 
 	//Allocates the memory for the boolean array of whether to test a value
-	int newlen = config.lengthmz * config.numz;
-	inp.barr = calloc(newlen, sizeof(char));
+	int newlen = config->lengthmz * config->numz;
+	inp->barr = calloc(newlen, sizeof(char));
 	//Tells the algorithm to ignore data that are equal to zero
-	ignorezeros(inp.barr, inp.dataInt, config.lengthmz, config.numz);
+	ignorezeros(inp->barr, inp->dataInt, config->lengthmz, config->numz);
 	if (verbose == 1) { printf("Ignored Zeros\n"); }
 
 	//Sets limits based on mass range and any test masses
-	SetLimits(config, &inp);
+	SetLimits(*config, inp);
 	if (verbose == 1) { printf("Set limits\n"); }
 
 	//Manual Assignments
-	if (config.manualflag == 1)
+	if (config->manualflag == 1)
 	{
-		ManualAssign(inp.dataMZ, inp.barr, inp.nztab, config);
+		ManualAssign(inp->dataMZ, inp->barr, inp->nztab, *config);
 		if (verbose == 1) { printf("Setup Manual Assign\n"); }
 	}
 	
 	//Setup Isotope Distributions
-	if (config.isotopemode > 0)
+	if (config->isotopemode > 0)
 	{
-		setup_and_make_isotopes(&config, &inp);
+		setup_and_make_isotopes(config, inp);
 		if (verbose == 1) { printf("Setup Isotopes\n"); }
 	}
-	
+}
+
+//Writes the deconvolution outputs and a set of key parameters such as error and number of significant parameters
+void WriteUniDecOutputs(Config config, Decon* decon, Input* inp, const float totaltime)
+{
+	//Write Everything
+	WriteDecon(config, decon, inp);
+
+	if (config.filetype == 0) {
+		FILE* out_ptr = NULL;
+		char outstring3[1024];
+		sprintf(outstring3, "%s_error.txt", config.outfile);
+		out_ptr = fopen(outstring3, "w");
+		if (out_ptr == 0) { printf("Error Opening %s\n", outstring3); exit(1); }
+		fprintf(out_ptr, "error = %f\n", decon->error);
+		fprintf(out_ptr, "time = %f\n", totaltime);
+		fprintf(out_ptr, "iterations = %d\n", decon->iterations);
+		fprintf(out_ptr, "uniscore = %f\n", decon->uniscore);
+		fprintf(out_ptr, "mzsig = %f\n", config.mzsig);
+		fprintf(out_ptr, "zzsig = %f\n", config.zsig);
+		fprintf(out_ptr, "beta = %f\n", config.beta);
+		fprintf(out_ptr, "psig = %f\n", config.psig);
+		fclose(out_ptr);
+		//printf("Stats and Error written to: %s\n", outstring3);
+	}
+	else {
+		write_attr_float(config.file_id, config.dataset, "error", decon->error);
+		write_attr_int(config.file_id, config.dataset, "iterations", decon->iterations);
+		write_attr_float(config.file_id, config.dataset, "time", totaltime);
+		write_attr_int(config.file_id, config.dataset, "length_mz", config.lengthmz);
+		write_attr_int(config.file_id, config.dataset, "length_mass", decon->mlen);
+		write_attr_float(config.file_id, config.dataset, "uniscore", decon->uniscore);
+		write_attr_float(config.file_id, config.dataset, "rsquared", decon->rsquared);
+		write_attr_float(config.file_id, config.dataset, "mzsig", config.mzsig);
+		write_attr_float(config.file_id, config.dataset, "zsig", config.zsig);
+		write_attr_float(config.file_id, config.dataset, "psig", config.psig);
+		write_attr_float(config.file_id, config.dataset, "beta", config.beta);
+		set_needs_grids(config.file_id);
+		//H5Fclose(config.file_id);
+	}
+}
+
+int run_unidec(int argc, char *argv[], Config config) {
+	//Initialize
+	clock_t starttime;
+	starttime = clock();
+
+	Input inp = SetupInputs();
+
+	bool autotune = 0;
+	int verbose = 0;
+	if (argc>2)
+	{
+		if (strcmp(argv[2], "-test") == 0)
+		{
+			float testmass = atof(argv[3]);
+			printf("Testing Mass: %f\n", testmass);
+			test_isotopes(testmass, inp.isoparams);
+			exit(0);
+		}
+
+		if (strcmp(argv[2], "-autotune") == 0){autotune = 1;}
+		if (strcmp(argv[2], "-verbose") == 0) { verbose = 1; }
+	}
+
+	SetUpUniDecInputs(argc, argv, &config, &inp, verbose);
 
 	//................................................................
 	//
@@ -766,44 +899,10 @@ int run_unidec(int argc, char *argv[], Config config) {
 	//...................................................................
 
 	//Write Everything
-	WriteDecon(config, &decon, &inp);
-	if (verbose == 1) { printf("Write Done\n"); }
-
-	//Writes a file with a number of key parameters such as error and number of significant parameters.
 	clock_t end = clock();
 	float totaltime = (float)(end - starttime) / CLOCKS_PER_SEC;
-	if (config.filetype == 0) {
-		FILE* out_ptr = NULL;
-		char outstring3[1024];
-		sprintf(outstring3, "%s_error.txt", config.outfile);
-		out_ptr = fopen(outstring3, "w");
-		if (out_ptr == 0) { printf("Error Opening %s\n", outstring3); exit(1); }
-		fprintf(out_ptr, "error = %f\n", decon.error);
-		fprintf(out_ptr, "time = %f\n", totaltime);
-		fprintf(out_ptr, "iterations = %d\n", decon.iterations);
-		fprintf(out_ptr, "uniscore = %f\n", decon.uniscore);
-		fprintf(out_ptr, "mzsig = %f\n", config.mzsig);
-		fprintf(out_ptr, "zzsig = %f\n", config.zsig);
-		fprintf(out_ptr, "beta = %f\n", config.beta);
-		fprintf(out_ptr, "psig = %f\n", config.psig);
-		fclose(out_ptr);
-		//printf("Stats and Error written to: %s\n", outstring3);
-	}
-	else {
-		write_attr_float(config.file_id, config.dataset, "error", decon.error);
-		write_attr_int(config.file_id, config.dataset, "iterations", decon.iterations);
-		write_attr_float(config.file_id, config.dataset, "time", totaltime);
-		write_attr_int(config.file_id, config.dataset, "length_mz", config.lengthmz);
-		write_attr_int(config.file_id, config.dataset, "length_mass", decon.mlen);
-		write_attr_float(config.file_id, config.dataset, "uniscore", decon.uniscore);
-		write_attr_float(config.file_id, config.dataset, "rsquared", decon.rsquared);
-		write_attr_float(config.file_id, config.dataset, "mzsig", config.mzsig);
-		write_attr_float(config.file_id, config.dataset, "zsig", config.zsig);
-		write_attr_float(config.file_id, config.dataset, "psig", config.psig);
-		write_attr_float(config.file_id, config.dataset, "beta", config.beta);
-		set_needs_grids(config.file_id);
-		//H5Fclose(config.file_id);
-	}
+	WriteUniDecOutputs(config, &decon, &inp, totaltime);
+	if (verbose == 1) { printf("Write Done\n"); }
 
 	//Free memory
 	FreeInputs(inp);
@@ -297,6 +297,8 @@ def decimal_formatter(a, template):
 
 def round_to_nearest(n, m):
     r = n % m
+    if np.ndim(r) > 0:
+        return np.where(r + r >= m, n + m - r, n - r)
     return n + m - r if r + r >= m else n - r
 
 
@@ -418,6 +420,100 @@ def nearest(array, target):
     return i
 
 
+def nearest_array(array, targets):
+    """
+    Vectorized version of nearest for many targets at once. Gives the same result as calling nearest on each target.
+    :param array: Sorted array
+    :param targets: Array of values
+    :return: Array of indexes of the elements closest to each target
+    """
+    array = np.asarray(array)
+    targets = np.asarray(targets)
+    i = np.searchsorted(array, targets, side="left")
+    i = np.clip(i, 0, len(array) - 1)
+    inner = (i > 0) & (i < len(array) - 1)
+    lower = np.abs(array[i] - targets) > np.abs(array[i - 1] - targets)
+    i[inner & lower] -= 1
+    return i
+
+
+def range_max(values, starts, ends, return_index=False):
+    """
+    Maximum of values[start:end] for many ranges at once.
+
+    Builds a sparse table one doubling level at a time and answers each range from the level that matches its length,
+    so the memory is only a couple of copies of the values and the time is N log(longest range).
+    :param values: Array of values. If 2D (S x N), the ranges are taken along the last axis for every row.
+    :param starts: Array of start indexes (inclusive)
+    :param ends: Array of end indexes (exclusive)
+    :param return_index: If True, also return the index of the first maximum in each range
+    :return: Array of maximum values for each range. Empty ranges give -inf (and an index of -1).
+    """
+    values = np.asarray(values, dtype=float)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    out = np.full(values.shape[:-1] + (len(starts),), -np.inf)
+    index = np.full(out.shape, -1, dtype=np.int64)
+    lengths = ends - starts
+    valid = lengths > 0
+    if not np.any(valid):
+        if return_index:
+            return out, index
+        return out
+    # Level j holds the maximum of 2**j values, the largest power of two that fits in the range
+    levels = np.full(len(starts), -1, dtype=np.int8)
+    levels[valid] = np.frexp(lengths[valid])[1] - 1
+    order = np.argsort(levels, kind="stable")
+    bounds = np.searchsorted(levels[order], np.arange(levels.max() + 2))
+    table = values
+    tindex = np.broadcast_to(np.arange(values.shape[-1]), values.shape)
+    for j in range(0, levels.max() + 1):
+        step = 1 << j
+        sel = order[bounds[j]:bounds[j + 1]]
+        if len(sel) > 0:
+            left = table[..., starts[sel]]
+            right = table[..., ends[sel] - step]
+            if return_index:
+                # Ties go to the left block, which holds the first maximum
+                boo1 = right > left
+                out[..., sel] = np.where(boo1, right, left)
+                index[..., sel] = np.where(boo1, tindex[..., ends[sel] - step], tindex[..., starts[sel]])
+            else:
+                out[..., sel] = np.maximum(left, right)
+        if j < levels.max():
+            if return_index:
+                boo1 = table[..., step:] > table[..., :-step]
+                tindex = np.where(boo1, tindex[..., step:], tindex[..., :-step])
+                table = np.where(boo1, table[..., step:], table[..., :-step])
+            else:
+                table = np.maximum(table[..., :-step], table[..., step:])
+    if return_index:
+        return out, index
+    return out
+
+
+def range_sum(values, starts, ends):
+    """
+    Sum of values[start:end] for many ranges at once, with one reduceat over the values.
+    :param values: Array of values. If 2D (S x N), the ranges are taken along the last axis for every row.
+    :param starts: Array of start indexes (inclusive)
+    :param ends: Array of end indexes (exclusive)
+    :return: Array of sums for each range. Empty ranges give 0.
+    """
+    values = np.asarray(values, dtype=float)
+    length = values.shape[-1]
+    starts = np.clip(np.asarray(starts, dtype=np.int64), 0, length)
+    ends = np.clip(np.asarray(ends, dtype=np.int64), 0, length)
+    if len(starts) == 0:
+        return np.zeros(values.shape[:-1] + (0,))
+    # Pad with a zero so that an end at the last point is a valid index, then sum between interleaved starts and ends
+    padded = np.concatenate((values, np.zeros(values.shape[:-1] + (1,))), axis=-1)
+    bounds = np.ravel(np.transpose([starts, np.maximum(ends, starts)]))
+    out = np.add.reduceat(padded, bounds, axis=-1)[..., ::2]
+    out[..., ends <= starts] = 0
+    return out
+
+
 def get_z_offset(mass, charge):
     """
     For a given mass and charge combination, calculate the charge offset parameter.
@@ -474,6 +570,22 @@ def integrate(data, start, end):
     return integral, intdat
 
 
+def integrate_array(data, starts, ends):
+    """
+    Vectorized integrate for many ranges at once. Gives the same integrals as integrate for data sorted by x.
+    :param data: Data array (N x 2), sorted by x
+    :param starts: Array of range starts (exclusive)
+    :param ends: Array of range ends (exclusive)
+    :return: Array of trapezoid integrals over the points strictly inside each range
+    """
+    x = data[:, 0]
+    y = data[:, 1]
+    lo = np.searchsorted(x, starts, side="right")
+    hi = np.searchsorted(x, ends, side="left")
+    segments = (x[1:] - x[:-1]) * (y[1:] + y[:-1]) / 2.0
+    return range_sum(segments, lo, hi - 1)
+
+
 def center_of_mass(data, start=None, end=None, relative_cutoff=None, power=1.):
     if start is not None and end is not None:
         boo1 = data[:, 0] < end
@@ -750,14 +862,128 @@ def data_extract(data, x, extract_method, window=None, **kwargs):
 
 def data_extract_grid(data, xarray, extract_method=1, window=0):
     igrid = np.zeros_like(xarray)
-    dims = igrid.shape
-    for j in range(0, dims[0]):
-        for k in range(0, dims[1]):
-            x = xarray[j, k]
-            igrid[j, k] = data_extract(data, x, extract_method=extract_method, window=window)
+    igrid[...] = data_extract_array(data, xarray, extract_method=extract_method, window=window)
+    return igrid
+
+
+def data_extract_grid_stack(datalist, xarray, extract_method=1, window=0):
+    """
+    Runs data_extract_grid on each spectrum in datalist. Spectra that share the same x values are extracted together.
+    :param datalist: List of data arrays (N x 2), each sorted in x
+    :param xarray: Array of positions to extract at
+    :param extract_method: Extraction method, as in data_extract
+    :param window: Window around each position, as in data_extract
+    :return: Array of extracted values (S x xarray.shape)
+    """
+    igrid = np.zeros((len(datalist),) + np.shape(xarray), dtype=np.asarray(xarray).dtype)
+    if len(datalist) == 0:
+        return igrid
+    x0 = datalist[0][:, 0]
+    if np.all([len(d) == len(x0) and np.array_equal(d[:, 0], x0) for d in datalist]):
+        igrid[...] = data_extract_array(np.array(datalist), xarray, extract_method=extract_method, window=window)
+    else:
+        for i, data in enumerate(datalist):
+            igrid[i] = data_extract_array(data, xarray, extract_method=extract_method, window=window)
     return igrid
 
 
+def data_extract_array(data, xs, extract_method, window=None):
+    """
+    Vectorized data_extract for many positions at once, giving the same values.
+
+    Assumes a sorted array in data[:,0]. The data can also be a stack of spectra (S x N x 2) that share the same x
+    values, in which case there is one set of outputs per spectrum.
+    Heights, local maxima, integrals, centers of mass, and local max positions (methods 0 to 10) are computed for all
+    positions together from searchsorted windows and cumulative sums. The rest, and methods 2 to 10 without a window,
+    fall back to calling data_extract at each position.
+    :param data: Data array (N x 2) or stack of data arrays (S x N x 2)
+    :param xs: Array of positions to extract at
+    :param extract_method: Extraction method, as in data_extract
+    :param window: Window around each position, as in data_extract
+    :return: Extracted values with the same shape as xs, or (S x xs.shape) for a stack
+    """
+    data = np.asarray(data)
+    stack = data.ndim == 3
+    if not stack:
+        data = data[np.newaxis]
+    xs = np.asarray(xs, dtype=float)
+    t = np.ravel(xs)
+    x = data[0, :, 0]
+    ints = data[:, :, 1]
+    length = len(x)
+
+    # Centers of mass with intensity powers and relative thresholds
+    commethods = {3: (1, None), 5: (1, 0.5), 6: (1, 0.1), 7: (2, None), 8: (3, None), 9: (2, 0.5), 10: (3, 0.5)}
+
+    if extract_method == 0 or (extract_method == 1 and window is not None and window == 0):
+        # Height at the nearest point, zero at the edges
+        index = nearest_array(x, t)
+        vals = ints[:, index]
+        vals[:, (index == 0) | (index == length - 1)] = 0
+
+    elif extract_method == 1 and window is None:
+        # Climb from the nearest point toward the larger neighbor while the values keep increasing
+        index = nearest_array(x, t)
+        vals = np.empty((len(ints), len(t)))
+        positions = np.arange(length)
+        for i, y in enumerate(ints):
+            up = np.append(y[1:] > y[:-1], False)
+            down = np.insert(y[:-1] > y[1:], 0, False)
+            # Last index of the increasing run to the right, and first index of the increasing run to the left
+            rightend = np.minimum.accumulate(np.where(up, length - 1, positions)[::-1])[::-1]
+            leftend = np.maximum.accumulate(np.where(down, 0, positions))
+            goright = y[index + 1] > y[index - 1]
+            left = y[leftend[index]]
+            # Going left from the first point wraps around to the last point, as in stepmax
+            left = np.where(index == 0, np.maximum(y[0], y[-1]), left)
+            vals[i] = np.where(goright, y[rightend[index]], left)
+
+    elif extract_method == 1:
+        # Local max between the nearest points to the window edges
+        starts = nearest_array(x, t - window)
+        ends = nearest_array(x, t + window)
+        vals = range_max(ints, starts, ends)
+        vals[:, ends <= starts] = 0
+
+    elif extract_method == 2 and window is not None:
+        # Trapezoid integral over the points strictly inside the window
+        lo = np.searchsorted(x, t - window, side="right")
+        hi = np.searchsorted(x, t + window, side="left")
+        segments = (x[1:] - x[:-1]) * (ints[:, 1:] + ints[:, :-1]) / 2.0
+        vals = range_sum(segments, lo, hi - 1)
+
+    elif extract_method == 4 and window is not None:
+        # Position of the local max strictly inside the window
+        lo = np.searchsorted(x, t - window, side="right")
+        hi = np.searchsorted(x, t + window, side="left")
+        maxvals, index = range_max(ints, lo, hi, return_index=True)
+        vals = np.where(index >= 0, x[np.clip(index, 0, None)], 0)
+
+    elif extract_method in commethods and window is not None:
+        # Weighted average over the points strictly inside the window
+        power, cutoff = commethods[extract_method]
+        lo = np.searchsorted(x, t - window, side="right")
+        hi = np.searchsorted(x, t + window, side="left")
+        weights = np.power(ints, float(power))
+        if cutoff is not None:
+            # Remove data points that fall below the threshold relative to the max of each spectrum
+            maxvals = np.amax(ints, axis=1, keepdims=True)
+            weights = np.where(ints > maxvals * cutoff, weights, 0)
+        num = range_sum(weights * x, lo, hi)
+        den = range_sum(weights, lo, hi)
+        count = range_sum(weights != 0, lo, hi)
+        boo1 = (count > 0) & (den != 0)
+        vals = np.divide(num, den, out=np.zeros_like(num), where=boo1)
+
+    else:
+        vals = np.array([[data_extract(d, xval, extract_method, window=window) for xval in t] for d in data])
+
+    vals = np.reshape(vals, (len(data),) + xs.shape)
+    if not stack:
+        vals = vals[0]
+    return vals
+
+
 def extract_from_data_matrix(xaxis, matrix, midpoint, extract_method=0, window=0):
     if extract_method == 0:
         index = nearest(xaxis, midpoint)
@@ -825,7 +1051,66 @@ def kendrick_analysis(massdat, kendrickmass, centermode=1, nbins=50, transformmo
         return None, None, None, None, None
     if massrange is not None:
         massdat = datachop(massdat, massrange[0], massrange[1])
-    xaxis = massdat[:, 0]
+    m1grid, m2grid, igrids = kendrick_grids(massdat[:, 0], massdat[:, 1][np.newaxis], kendrickmass,
+                                            centermode=centermode, nbins=nbins, transformmode=transformmode,
+                                            xaxistype=xaxistype)
+    igrid = igrids[0]
+
+    data2 = np.transpose([np.ravel(m1grid), np.ravel(m2grid), np.ravel(igrid)])
+    data1 = np.transpose([np.unique(m2grid), np.sum(igrid, axis=0)])
+
+    return data1, data2, m1grid, m2grid, igrid
+
+
+def kendrick_analysis_stack(massdats, kendrickmass, centermode=1, nbins=50, transformmode=1, xaxistype=1,
+                            massrange=None):
+    """
+    Mass defect grids for a set of spectra at once.
+
+    If all the spectra share the same mass axis, as they do after mergedata, the grids are computed together.
+    Otherwise, each spectrum is run through kendrick_analysis, and the grids must come out the same shape.
+    :param massdats: List or array of mass data (S x N x 2)
+    :param kendrickmass: Kendrick reference mass
+    :param centermode: 1 to floor the Kendrick mass to the nominal mass, otherwise round
+    :param nbins: Number of defect bins
+    :param transformmode: 1 for interpolation, otherwise integration
+    :param xaxistype: 0 for defects as fractions, 1 for defects in mass units
+    :param massrange: Mass range to keep [min, max]. None for all.
+    :return: m1grid, m2grid, igrids (S x nominal x defects), with each grid normalized to a max of 1
+    """
+    if kendrickmass == 0:
+        print("Error: Kendrick mass is 0.")
+        return None, None, None
+    if massrange is not None:
+        massdats = [datachop(d, massrange[0], massrange[1]) for d in massdats]
+
+    xaxis = massdats[0][:, 0]
+    if np.all([len(d) == len(xaxis) and np.array_equal(d[:, 0], xaxis) for d in massdats]):
+        ints = np.array([d[:, 1] for d in massdats])
+        return kendrick_grids(xaxis, ints, kendrickmass, centermode=centermode, nbins=nbins,
+                              transformmode=transformmode, xaxistype=xaxistype)
+
+    igrids = []
+    m1grid, m2grid = None, None
+    for d in massdats:
+        data1, data2, m1grid, m2grid, igrid = kendrick_analysis(d, kendrickmass, centermode=centermode, nbins=nbins,
+                                                                transformmode=transformmode, xaxistype=xaxistype)
+        igrids.append(igrid)
+    return m1grid, m2grid, np.array(igrids)
+
+
+def kendrick_grids(xaxis, ints, kendrickmass, centermode=1, nbins=50, transformmode=1, xaxistype=1):
+    """
+    Mass defect grids for a stack of spectra on a shared mass axis.
+    :param xaxis: Mass axis (N)
+    :param ints: Intensities (S x N)
+    :param kendrickmass: Kendrick reference mass
+    :param centermode: 1 to floor the Kendrick mass to the nominal mass, otherwise round
+    :param nbins: Number of defect bins
+    :param transformmode: 1 for interpolation, otherwise integration
+    :param xaxistype: 0 for defects as fractions, 1 for defects in mass units
+    :return: m1grid, m2grid, igrids (S x nominal x defects), with each grid normalized to a max of 1
+    """
     kmass = np.array(xaxis) / float(kendrickmass)
     if centermode == 1:
         nominalkmass = np.floor(kmass)
@@ -838,30 +1123,17 @@ def kendrick_analysis(massdat, kendrickmass, centermode=1, nbins=50, transformmo
     m1grid, m2grid = np.meshgrid(nominal, defects, indexing='ij')
 
     # Get Intensities
-    igrid = np.zeros((len(nominal), len(defects)))
     if transformmode == 1:
-        # Interpolation
-        f = interp1d(massdat[:, 0], massdat[:, 1], bounds_error=False, fill_value=0)
-        for j in range(0, len(nominal)):
-            for k in range(0, len(defects)):
-                nommass = nominal[j]
-                defect = defects[k]
-                mass = (nommass + defect) * kendrickmass
-                intensity = f(mass)
-                igrid[j, k] = intensity
+        # Interpolation of every spectrum at every grid point
+        f = interp1d(xaxis, ints, axis=1, bounds_error=False, fill_value=0)
+        igrids = f((m1grid + m2grid) * kendrickmass)
     else:
-        # Integration
-        for j in range(0, len(kmass)):
-            nommass = nominalkmass[j]
-            defect = kmdefectexact[j]
-            pos = nearest(defects, defect)
-            pos2 = nearest(nominal, nommass)
-            try:
-                intensity = massdat[j, 1]
-            except IndexError:
-                intensity = 0
-            igrid[pos2, pos] += intensity
-    igrid /= np.amax(igrid)
+        # Integration into the nearest grid point
+        igrids = np.zeros((len(ints), len(nominal), len(defects)))
+        pos = nearest_array(defects, kmdefectexact)
+        pos2 = nearest_array(nominal, nominalkmass)
+        np.add.at(igrids, (slice(None), pos2, pos), ints)
+    igrids /= np.amax(igrids, axis=(1, 2), keepdims=True)
 
     # Write Outputs
     if xaxistype == 0:
@@ -871,10 +1143,7 @@ def kendrick_analysis(massdat, kendrickmass, centermode=1, nbins=50, transformmo
 
     m1grid *= kendrickmass
     m2grid *= factor
-    data2 = np.transpose([np.ravel(m1grid), np.ravel(m2grid), np.ravel(igrid)])
-    data1 = np.transpose([np.unique(m2grid), np.sum(igrid, axis=0)])
-
-    return data1, data2, m1grid, m2grid, igrid
+    return m1grid, m2grid, igrids
 
 
 def solve_for_mass(mz1, mz2, adductmass=1.007276467):
@@ -1270,14 +1539,19 @@ def cal_data(datatop, poly_coeff=None):
     return datatop
 
 
-def datachop(datatop, newmin, newmax):
+def datachop(datatop, newmin, newmax, view=False):
     """
     Chops the range of the data. The [:,0] column of the data is the column that will be indexed.
     :param datatop: Data array
     :param newmin: Minimum value of chopped data
     :param newmax: Maximum value of chopped data
+    :param view: If True and the data is sorted, return a view of datatop rather than a copy
     :return: New data limited between the two bounds
     """
+    if view and len(datatop) > 0 and np.all(datatop[1:, 0] >= datatop[:-1, 0]):
+        start = np.searchsorted(datatop[:, 0], newmin, side="left")
+        end = np.searchsorted(datatop[:, 0], newmax, side="right")
+        return datatop[start:end]
     boo1 = np.logical_and(datatop[:, 0] <= newmax, datatop[:, 0] >= newmin)
     return datatop[boo1]
 
@@ -1825,11 +2099,12 @@ def dataprep(datatop, config, peaks=True, intthresh=True, silent=False):
     va = config.detectoreffva
     linflag = config.linflag
     redper = config.reductionpercent
+    # The steps below change data2 in place, so copy only the cropped data once
     if type(newmin) != str and type(newmax) != str:
         # Crop Data
-        data2 = datachop(deepcopy(datatop), newmin, newmax)
+        data2 = np.array(datachop(datatop, newmin, newmax, view=True))
     else:
-        data2 = deepcopy(datatop)
+        data2 = np.array(datatop)
     print("Test")
     if config.smashflag == 1:
         print("Smashing!:", config.smashlist)
@@ -1990,40 +2265,33 @@ def peakdetect(data, config=None, window=10, threshold=0, ppm=None, norm=True):
         threshold = config.peakthresh
         norm = config.normthresh
 
-    peaks = []
     length = len(data)
     shape = np.shape(data)
     if length == 0 or shape[1] != 2:
-        return np.array(peaks)
+        return np.array([])
 
     if norm:
         maxval = np.amax(data[:, 1])
     else:
         maxval = 1
-    for i in range(0, length):
-        if data[i, 1] > maxval * threshold:
-            if ppm is not None:
-                ptmass = data[i, 0]
-                newwin = ppm * 1e-6 * ptmass
-                start = nearest(data[:, 0], ptmass - newwin)
-                end = nearest(data[:, 0], ptmass + newwin)
-            else:
-                start = i - window
-                end = i + window
-
-                start = int(start)
-                end = int(end) + 1
 
-                if start < 0:
-                    start = 0
-                if end > length:
-                    end = length
-
-            testmax = np.amax(data[start:end, 1])
-            if data[i, 1] == testmax and np.all(data[i, 1] != data[start:i, 1]):
-                peaks.append([data[i, 0], data[i, 1]])
+    index = np.arange(length)
+    if ppm is not None:
+        newwin = ppm * 1e-6 * data[:, 0]
+        starts = nearest_array(data[:, 0], data[:, 0] - newwin)
+        ends = nearest_array(data[:, 0], data[:, 0] + newwin)
+    else:
+        starts = np.clip((index - window).astype(int), 0, None)
+        ends = np.clip((index + window).astype(int) + 1, None, length)
 
-    return np.array(peaks)
+    # A peak is the maximum of its window with no equal value to its left in the window
+    y = data[:, 1]
+    boo1 = (y > maxval * threshold) & (ends > index)
+    boo1 &= y == range_max(y, starts, ends)
+    boo1 &= y != range_max(y, starts, np.minimum(index, ends))
+    if not np.any(boo1):
+        return np.array([])
+    return np.array(data[boo1, :2])
 
 
 def peakdetect_nonlinear(data, config=None, window=1, threshold=0):
@@ -2035,27 +2303,28 @@ def peakdetect_nonlinear(data, config=None, window=1, threshold=0):
 
     The mass and intensity of peaks meeting these criteria are output as a P x 2 array.
 
-    :param data: Mass data array (N x 2) (mass intensity)
+    :param data: Mass data array (N x 2) (mass intensity), sorted by mass
     :param config: UniDecConfig object
     :return: Array of peaks positions and intensities (P x 2) (mass intensity)
     """
     if config is not None:
         window = config.peakwindow
         threshold = config.peakthresh
-    peaks = []
-    length = len(data)
     maxval = np.amax(data[:, 1])
-    for i in range(0, length):
-        if data[i, 1] > maxval * threshold:
-            start = data[i, 0] - window
-            end = data[i, 0] + window
-            isodat = datachop(data, start, end)
-            testmax = np.amax(isodat[:, 1])
-            index = nearest(isodat[:, 0], data[i, 0])
-            if data[i, 1] == testmax and np.all(data[i, 1] != isodat[:index, 1]):
-                peaks.append([data[i, 0], data[i, 1]])
 
-    return np.array(peaks)
+    x = data[:, 0]
+    starts = np.searchsorted(x, x - window, side="left")
+    ends = np.searchsorted(x, x + window, side="right")
+    # Points to the left of the first point with the same mass
+    lefts = np.searchsorted(x, x, side="left")
+
+    y = data[:, 1]
+    boo1 = y > maxval * threshold
+    boo1 &= y == range_max(y, starts, ends)
+    boo1 &= y != range_max(y, starts, lefts)
+    if not np.any(boo1):
+        return np.array([])
+    return np.array(data[boo1, :2])
 
 
 def mergepeaks(peaks1, peaks2, window):
@@ -2082,25 +2351,29 @@ def mergepeaks(peaks1, peaks2, window):
     return newpeaks
 
 
-def make_peaks_mztab(mzgrid, pks, adductmass, index=None):
+def make_peaks_mztab(mzgrid, pks, adductmass, index=None, xvals=None, yvals=None):
     """
     For each peak in pks, get the charge state distribution.
 
     The intensity at each charge state is determined from mzgrid and stored in a list as peak.mztab.
     An array of the results is also output for help speeding up make_peaks_mztab_spectrum
 
-    :param mzgrid: 2D grid of m/z vs charge (N x Z)
+    :param mzgrid: 2D grid of m/z vs charge (N*Z x 3), or intensities only (N x Z) if xvals and yvals are given
     :param pks: Peaks object (length P)
     :param adductmass: Mass of electrospray adduct.
+    :param xvals: m/z axis (N) for an intensity-only mzgrid
+    :param yvals: Charge axis (Z) for an intensity-only mzgrid
     :return: P x Z array
     """
-    xvals = np.unique(mzgrid[:, 0])
+    if xvals is None or yvals is None:
+        xvals = np.unique(mzgrid[:, 0])
+        yvals = np.unique(mzgrid[:, 1])
+        mzgrid = mzgrid[:, 2]
     xmin = np.amin(xvals)
     xmax = np.amax(xvals)
-    yvals = np.unique(mzgrid[:, 1])
     xlen = len(xvals)
     ylen = len(yvals)
-    newgrid = np.reshape(mzgrid[:, 2], (xlen, ylen))
+    newgrid = np.reshape(mzgrid, (xlen, ylen))
     plen = pks.plen
     ftab = [interp1d(xvals, newgrid[:, k]) for k in range(0, ylen)]
     mztab = [[makespecfun(i, k, pks.masses, adductmass, yvals, xvals, ftab, xmax, xmin) for k in range(0, ylen)] for i
@@ -2138,19 +2411,23 @@ def makespecfun(i, k, peaks_masses, adductmass, charges, xvals, ftab, xmax, xmin
     return np.array([intx, inty, pos])
 
 
-def make_peaks_mztab_spectrum(mzgrid, pks, data2, mztab, index=None):
+def make_peaks_mztab_spectrum(mzgrid, pks, data2, mztab, index=None, yvals=None):
     """
     Used for plotting the dots in plot 4.
 
     Perform the same things as make_peaks_mztab, but instead of using the deconvolved intensities,
     it takes the intensity directly from the spectrum.
-    :param mzgrid: m/z grid (N x Z)
+    :param mzgrid: m/z grid (N*Z x 3). Ignored if yvals is given.
     :param pks: Peaks object
     :param data2: Processed data 1D
     :param mztab: Prior mztab from make_peaks_mztab
+    :param yvals: Charge axis (Z)
     :return: mztab but with intensities replaced by value at the spectrum.
     """
-    zvals = np.unique(mzgrid[:, 1])
+    if yvals is None:
+        zvals = np.unique(mzgrid[:, 1])
+    else:
+        zvals = yvals
     zlen = len(zvals)
     plen = pks.plen
     mztab2 = deepcopy(mztab)
@@ -2852,39 +3129,125 @@ def windowed_fft_single(data, mean, sigma, diffrange=None, norm=True):
     return maxpos, fft2
 
 
-def win_fft_grid(rawdata, binsize, wbin, window_fwhm, diffrange, norm=True):
+def window_stack(data, means, sigmas):
+    """
+    Stack of copies of the intensities of data, each multiplied by a Gaussian window.
+    :param data: Linearized data (N x 2)
+    :param means: Centers of the windows (W)
+    :param sigmas: Standard deviations of the windows (W)
+    :return: Windowed intensities (W x N)
+    """
+    means = np.asarray(means, dtype=float)[:, np.newaxis]
+    sigmas = np.broadcast_to(np.asarray(sigmas, dtype=float), means.shape[:1])[:, np.newaxis]
+    window = ndis_std(data[np.newaxis, :, 0], means, sigmas)
+    return data[np.newaxis, :, 1] * window
+
+
+def fft_mirror_index(index, n):
+    """
+    Map indexes of a full length n FFT onto the rfft output, using the symmetry of the FFT of real data.
+    :param index: Indexes into the full FFT
+    :param n: Length of the FFT
+    :return: Indexes into the rfft output with the same magnitude
+    """
+    return np.where(index <= n // 2, index, n - index)
+
+
+def win_fft_grid(rawdata, binsize, wbin, window_fwhm, diffrange, norm=True, chunksize=2 ** 24):
+    """
+    Map of the double FFT of the data in Gaussian windows stepped across the m/z axis.
+
+    Gives the same result as windowed_fft at each window center. The windows are stacked and transformed a chunk at a
+    time with multi-row FFTs, keeping only the part of the second FFT inside diffrange.
+    :param rawdata: Data (N x 2)
+    :param binsize: Bin size for linearization
+    :param wbin: Step between window centers
+    :param window_fwhm: Standard deviation of the windows
+    :param diffrange: Range of mass differences to keep [min, max]
+    :param norm: Whether to scale each window by its total intensity
+    :param chunksize: Maximum number of windowed data points to transform at once
+    :return: Array of [window center, mass difference, intensity] (W*D x 3)
+    """
     # Prepare data
     mindat = np.amin(rawdata[:, 0])
     maxdat = np.amax(rawdata[:, 0])
 
     mzdata = linearize(rawdata, binsize, 3)
     mzdata = pad_two_power(mzdata)
+    n = len(mzdata)
 
     xvals = np.arange(mindat, maxdat, wbin)
 
-    results = np.array([windowed_fft(mzdata, x, window_fwhm, diffrange=diffrange, norm=norm)[1] for x in xvals])
+    # Axes of the first and second FFT, as in double_fft_diff
+    fvals = fftpack.fftfreq(n, d=mzdata[1, 0] - mzdata[0, 0])
+    dvals = fftpack.fftfreq(n, d=fvals[1] - fvals[0])
+    keep = np.nonzero((dvals < diffrange[1]) & (dvals > diffrange[0]))[0]
+    keep = keep[np.argsort(dvals[keep], kind="stable")]
+    rkeep = fft_mirror_index(keep, n)
+    yvals = dvals[keep]
+
+    intdat = np.empty((len(xvals), len(keep)))
+    step = max(1, int(chunksize // n))
+    for i in range(0, len(xvals), step):
+        stack = window_stack(mzdata, xvals[i:i + step], window_fwhm)
+        # Rebuild the full symmetric magnitude of the first FFT from the real half
+        first = np.abs(scipy.fft.rfft(stack, axis=1, workers=-1))
+        first = np.concatenate((first, first[:, 1:n - n // 2][:, ::-1]), axis=1)
+        second = np.abs(scipy.fft.rfft(first, axis=1, workers=-1))
+        rows = second[:, rkeep] / np.amax(second, axis=1, keepdims=True)
+        if norm:
+            rows *= np.sum(stack, axis=1, keepdims=True)
+        rows -= np.amin(rows, axis=1, keepdims=True)
+        intdat[i:i + step] = rows
 
-    intdat = results[:, :, 1]
-    yvals = np.unique(results[:, :, 0])
     xgrid, ygrid = np.meshgrid(xvals, yvals, indexing="ij")
     out = np.transpose([np.ravel(xgrid), np.ravel(ygrid), np.ravel(intdat)])
     return out
 
 
-def win_fft_grid_single(rawdata, binsize, wbin, window_fwhm, diffrange, norm=True):
+def win_fft_grid_single(rawdata, binsize, wbin, window_fwhm, diffrange, norm=True, chunksize=2 ** 24):
+    """
+    Map of the FFT of the data in Gaussian windows stepped across the m/z axis.
+
+    Gives the same result as windowed_fft_single at each window center, computed in chunks of stacked windows.
+    :param rawdata: Data (N x 2)
+    :param binsize: Bin size for linearization
+    :param wbin: Step between window centers
+    :param window_fwhm: Standard deviation of the windows
+    :param diffrange: Range of spacings to keep [min, max]. The frequencies between 1/max and 1/min are kept.
+    :param norm: Whether to scale each window by its total intensity
+    :param chunksize: Maximum number of windowed data points to transform at once
+    :return: Array of [window center, frequency, intensity] (W*D x 3)
+    """
     # Prepare data
     mindat = np.amin(rawdata[:, 0])
     maxdat = np.amax(rawdata[:, 0])
 
     mzdata = linearize(rawdata, binsize, 3)
     mzdata = pad_two_power(mzdata)
+    n = len(mzdata)
 
     xvals = np.arange(mindat, maxdat, wbin)
 
-    results = np.array([windowed_fft_single(mzdata, x, window_fwhm, diffrange=diffrange, norm=norm)[1] for x in xvals])
+    # Frequency axis and range, as in fft_diff
+    fvals = fftpack.fftfreq(n, d=mzdata[1, 0] - mzdata[0, 0])
+    ftrange = [1. / diffrange[1], 1. / diffrange[0]]
+    keep = np.nonzero((fvals < ftrange[1]) & (fvals > ftrange[0]))[0]
+    keep = keep[np.argsort(fvals[keep], kind="stable")]
+    rkeep = fft_mirror_index(keep, n)
+    yvals = fvals[keep]
+
+    intdat = np.empty((len(xvals), len(keep)))
+    step = max(1, int(chunksize // n))
+    for i in range(0, len(xvals), step):
+        stack = window_stack(mzdata, xvals[i:i + step], window_fwhm)
+        first = np.abs(scipy.fft.rfft(stack, axis=1, workers=-1))
+        rows = first[:, rkeep] / np.amax(first, axis=1, keepdims=True)
+        if norm:
+            rows *= np.sum(stack, axis=1, keepdims=True)
+        rows -= np.amin(rows, axis=1, keepdims=True)
+        intdat[i:i + step] = rows
 
-    intdat = results[:, :, 1]
-    yvals = np.unique(results[:, :, 0])
     xgrid, ygrid = np.meshgrid(xvals, yvals, indexing="ij")
     out = np.transpose([np.ravel(xgrid), np.ravel(ygrid), np.ravel(intdat)])
     return out
@@ -2912,20 +3275,69 @@ def windowed_autocorr(data, mean, sigma, diffrange=None):
     return acpeaks, acdat
 
 
-def win_autocorr_grid(rawdata, binsize, wbin, window_fwhm, diffrange):
+def win_autocorr_grid(rawdata, binsize, wbin, window_fwhm, diffrange, chunksize=2 ** 24):
+    """
+    Map of the autocorrelation of the data in Gaussian windows stepped across the m/z axis.
+
+    Matches windowed_autocorr at each window center. The window widths scale with the center, x * window_fwhm.
+    The autocorrelations are computed in chunks of stacked windows with zero-padded FFTs.
+    :param rawdata: Data (N x 2)
+    :param binsize: Bin size for linearization
+    :param wbin: Step between window centers
+    :param window_fwhm: Standard deviation of the windows relative to their centers
+    :param diffrange: Range of shifts to keep [min, max)
+    :param chunksize: Maximum number of windowed data points to transform at once
+    :return: Array of [window center, shift, intensity] (W*D x 3)
+    """
     # Prepare data
     mindat = np.amin(rawdata[:, 0])
     maxdat = np.amax(rawdata[:, 0])
 
     mzdata = linearize(rawdata, binsize, 3)
     mzdata = pad_two_power(mzdata)
+    n = len(mzdata)
 
     xvals = np.arange(mindat, maxdat, wbin)
+    sigmas = xvals * window_fwhm
+
+    # Only shifts up to the edge of diffrange are kept from each autocorrelation. Bounded with the nominal spacing.
+    center = n // 2
+    dx = mzdata[1, 0] - mzdata[0, 0]
+    maxlag = int(min(center, np.amax(np.abs(diffrange)) / np.abs(dx) + 2))
+
+    intdat = np.empty((len(xvals), maxlag + 1))
+    maxes = np.empty((len(xvals), 1))
+    xdiffs = []
+    step = max(1, int(chunksize // (2 * n)))
+    for i in range(0, len(xvals), step):
+        stack = window_stack(mzdata, xvals[i:i + step], sigmas[i:i + step])
+
+        # Spacing estimated near the maximum of each window, as in autocorr
+        for maxpos1 in np.argmax(stack, axis=1):
+            start = np.amax([maxpos1 - n / 10, 0])
+            end = np.amin([n - 1, maxpos1 + n / 10])
+            cutdat = mzdata[int(start):int(end)]
+            if len(cutdat) < 20:
+                cutdat = mzdata
+            xdiffs.append(np.mean(cutdat[1:, 0] - cutdat[:len(cutdat) - 1, 0]))
+
+        # Linear autocorrelation at shifts 0 to n/2, zero padded to avoid wrapping
+        spec = scipy.fft.rfft(stack, n=2 * n, axis=1, workers=-1)
+        acf = scipy.fft.irfft(spec.real ** 2 + spec.imag ** 2, n=2 * n, axis=1, workers=-1)[:, :center + 1]
+        intdat[i:i + step] = acf[:, :maxlag + 1]
+        maxes[i:i + step, 0] = np.amax(acf, axis=1)
+
+    # The centered autocorrelation is symmetric, so each shift maps onto its absolute value
+    xdiff = np.median(xdiffs) if len(xdiffs) > 0 else dx
+    corrx = np.arange(0.0, n) * xdiff
+    corrx = corrx - corrx[center]
+    keep = np.nonzero((corrx >= diffrange[0]) & (corrx < diffrange[1]))[0]
+    keep = keep[np.abs(keep - center) <= maxlag]
+    yvals = corrx[keep]
+
+    intdat = np.divide(intdat[:, np.abs(keep - center)], maxes, out=np.zeros((len(intdat), len(keep))),
+                       where=maxes != 0)
 
-    results = np.array([windowed_autocorr(mzdata, x, x * window_fwhm, diffrange=diffrange)[1] for x in xvals])
-
-    intdat = results[:, :, 1]
-    yvals = np.unique(results[:, :, 0])
     xgrid, ygrid = np.meshgrid(xvals, yvals, indexing="ij")
     out = np.transpose([np.ravel(xgrid), np.ravel(ygrid), np.ravel(intdat)])
     return out
@@ -3083,7 +3495,7 @@ def peaks_error_FWHM(pks, data, level=0.5):
     :param data: self.data.massdat
     :return:
     """
-    pmax = np.amax([p.height for p in pks.peaks])
+    pmax = np.amax(pks.get_values("height"))
     try:
         datamax = np.amax(np.asarray(data)[:, 1])
     except:
@@ -3092,9 +3504,14 @@ def peaks_error_FWHM(pks, data, level=0.5):
         div = datamax / pmax
     except:
         div = 1
-    for p in pks.peaks:
-        int = p.height
-        index = nearest(data[:, 0], p.mass)
+    pmasses = pks.get_values("mass")
+    pheights = pks.get_values("height")
+    errors = np.zeros(len(pmasses))
+    intervals = []
+    bads = np.zeros(len(pmasses), dtype=bool)
+    centroids = np.zeros(len(pmasses))
+    for i, (pmass, int) in enumerate(zip(pmasses, pheights)):
+        index = nearest(data[:, 0], pmass)
         leftwidth = 0
         rightwidth = 0
         counter = 1
@@ -3130,34 +3547,27 @@ def peaks_error_FWHM(pks, data, level=0.5):
         mlow = data[indexstart, 0]
         mhigh = data[indexend, 0]
 
-        p.errorFWHM = mhigh - mlow
-        p.intervalFWHM = [mlow, mhigh]
-
-        diff = np.abs(np.array(p.intervalFWHM) - p.mass)
-        r = safedivide1(diff, p.errorFWHM)
+        diff = np.abs(np.array([mlow, mhigh]) - pmass)
+        r = safedivide1(diff, mhigh - mlow)
         # Check to make sure that the FWHM is symmetric. If not, flag it and bring things back.
         cutoff = 0.75
         if r[0] > cutoff:
-            mlow = p.mass - diff[1] * cutoff / (1 - cutoff)
-            p.errorFWHM = mhigh - mlow
-            p.intervalFWHM = [mlow, mhigh]
-            p.badFWHM = True
-            pass
+            mlow = pmass - diff[1] * cutoff / (1 - cutoff)
+            bads[i] = True
         elif r[1] > cutoff:
-            mhigh = p.mass + diff[0] * cutoff / (1 - cutoff)
-            p.errorFWHM = mhigh - mlow
-            p.intervalFWHM = [mlow, mhigh]
-            p.badFWHM = True
-            pass
-        else:
-            p.badFWHM = False
+            mhigh = pmass + diff[0] * cutoff / (1 - cutoff)
+            bads[i] = True
 
-        start = p.intervalFWHM[0]
-        end = p.intervalFWHM[1]
-        p.centroid = center_of_mass(data, start, end)[0]
-        # print("Apex:", p.mass, "Centroid:", p.centroid, "FWHM Range:", p.intervalFWHM)
-    pks.centroids = np.array([p.centroid for p in pks.peaks])
-    pks.fwhms = np.array([p.errorFWHM for p in pks.peaks])
+        errors[i] = mhigh - mlow
+        intervals.append([mlow, mhigh])
+        centroids[i] = center_of_mass(data, mlow, mhigh)[0]
+        # print("Apex:", pmass, "Centroid:", centroids[i], "FWHM Range:", intervals[i])
+    pks.set_values("errorFWHM", errors)
+    pks.set_values("intervalFWHM", intervals)
+    pks.set_values("badFWHM", bads)
+    pks.set_values("centroid", centroids)
+    pks.centroids = pks.get_values("centroid")
+    pks.fwhms = pks.get_values("errorFWHM")
 
 
 def peaks_error_mean(pks, data, ztab, massdat, config):
@@ -3212,22 +3622,19 @@ def peaks_error_mean(pks, data, ztab, massdat, config):
 
 
 def subtract_and_divide(pks, basemass, refguess, outputall=False):
-    avgmass = []
-    ints = []
-    nums = []
-    masses = []
-    for p in pks.peaks:
-        if p.ignore == 0:
-            mass = p.mass - basemass
-            num = np.round(mass / float(refguess))
-            if num != 0:
-                avg = mass / num
-                avgmass.append(avg)
-                ints.append(p.height)
-                nums.append(num)
-                masses.append(p.mass)
-                p.sdnum = num
-                p.sdval = avg
+    pmasses = pks.get_values("mass")
+    nums = np.round((pmasses - basemass) / float(refguess))
+    b1 = np.logical_and(pks.get_values("ignore") == 0, nums != 0)
+    nums = nums[b1]
+    masses = pmasses[b1]
+    avgmass = (masses - basemass) / nums
+    ints = pks.get_values("height")[b1]
+    sdnums = pks.get_values("sdnum")
+    sdnums[b1] = nums
+    sdvals = pks.get_values("sdval")
+    sdvals[b1] = avgmass
+    pks.set_values("sdnum", sdnums)
+    pks.set_values("sdval", sdvals)
 
     if outputall:
         return np.average(avgmass, weights=ints), avgmass, ints, nums, masses